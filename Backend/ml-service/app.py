@@ -2,12 +2,12 @@
 Python Flask API Service for ML/AI Integration
 This service provides endpoints for machine learning models and AI features
 """
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 from datetime import datetime, timedelta
+import json
 import os
-import tempfile
-from threading import Lock
+from threading import Lock, Thread
 from werkzeug.utils import secure_filename
 import google.auth
 from google.cloud.secretmanager import SecretManagerServiceClient
@@ -16,7 +16,8 @@ from google.cloud.secretmanager import SecretManagerServiceClient
 from ml_models.weekly_specials import get_weekly_specials_ml
 from ml_models.recommendations import get_recommendations_ml
 from ml_models.price_prediction import get_price_prediction_ml
-from ocr.extractor import process_receipt_internal, build_user_response
+from ocr.extractor import build_user_response
+from ocr.worker_pool import OCRQueueFull, get_ocr_pool
 
 
 def _resolve_project_id():
@@ -81,37 +82,64 @@ from recipe_rag.rag_pipeline import RecipeRAG
 rag = None
 RAG_INIT_ERROR = None
 RAG_LOCK = Lock()
+# Per-component warm-up progress, filled in by RecipeRAG.warm_start
+RAG_STATUS = {}
+RAG_WARMUP_THREAD = None
+# Warm the RAG up in a background thread at boot (set to 0 to defer it
+# until the first recipe request, which then gets a 503 while it loads).
+RAG_WARM_START = os.getenv('RAG_WARM_START', '1').strip().lower() not in ('0', 'false', 'no')
 
 
-def get_rag():
-    """Lazy-load RAG so basic ML endpoints can start quickly in Cloud Run."""
+def _warm_up_rag():
     global rag, RAG_INIT_ERROR
+    try:
+        print("[recipe_rag] warming up Recipe RAG in the background...")
+        rag = RecipeRAG.warm_start(status=RAG_STATUS)
+    except Exception as exc:
+        RAG_INIT_ERROR = exc
+        print(f"[recipe_rag] WARNING: RAG failed to initialise: {exc}")
 
-    if rag is not None:
-        return rag
 
+def start_rag_warmup():
+    """Start the background warm-up once (no-op if running or finished)."""
+    global RAG_WARMUP_THREAD
     with RAG_LOCK:
-        if rag is not None:
-            return rag
-        if RAG_INIT_ERROR is not None:
-            raise RuntimeError(f"RAG pipeline failed to initialise: {RAG_INIT_ERROR}")
+        if rag is not None or RAG_INIT_ERROR is not None:
+            return
+        if RAG_WARMUP_THREAD is not None and RAG_WARMUP_THREAD.is_alive():
+            return
+        RAG_WARMUP_THREAD = Thread(target=_warm_up_rag, name='rag-warmup', daemon=True)
+        RAG_WARMUP_THREAD.start()
 
-        try:
-            print("[recipe_rag] initialising Recipe RAG on first request...")
-            rag = RecipeRAG()
-            return rag
-        except Exception as exc:
-            RAG_INIT_ERROR = exc
-            print(f"[recipe_rag] WARNING: RAG failed to initialise: {exc}")
-            raise RuntimeError(f"RAG pipeline failed to initialise: {exc}") from exc
+
+def get_rag():
+    """
+    Return the warmed-up RAG. Never blocks: while it is still loading this
+    raises RuntimeError (→ 503 via rag_not_ready_response) so requests do
+    not pile up behind the model/index load.
+    """
+    if rag is not None:
+        return rag
+    if RAG_INIT_ERROR is not None:
+        raise RuntimeError(f"RAG pipeline failed to initialise: {RAG_INIT_ERROR}")
+    start_rag_warmup()
+    raise RuntimeError("RAG pipeline is warming up — retry shortly")
 
 
 def rag_not_ready_response(error):
-    return jsonify({
+    response = jsonify({
         'success': False,
         'ready': False,
         'error': str(error),
-    }), 503
+        'components': RAG_STATUS,
+    })
+    if RAG_INIT_ERROR is None:
+        response.headers['Retry-After'] = '5'
+    return response, 503
+
+
+if RAG_WARM_START:
+    start_rag_warmup()
 
 
 
@@ -149,6 +177,23 @@ def health_check():
     })
 
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """
+    Readiness probe: 200 once the Recipe RAG is warm, 503 before that
+    (or if it failed), with per-component load status either way.
+    """
+    payload = {
+        'ready': rag is not None,
+        'service': 'ML/AI Service',
+        'components': RAG_STATUS,
+        'timestamp': datetime.now().isoformat(),
+    }
+    if RAG_INIT_ERROR is not None:
+        payload['error'] = str(RAG_INIT_ERROR)
+    return jsonify(payload), (200 if rag is not None else 503)
+
+
 @app.route('/api/weekly-specials', methods=['GET'])
 def get_weekly_specials():
     """
@@ -271,10 +316,15 @@ def get_price_prediction():
 @app.route('/api/ocr/receipt', methods=['POST'])
 def process_receipt_api():
     """
-    Upload a receipt image and return extracted structured data
+    Upload a receipt image and return extracted structured data.
+
+    The OCR runs on a bounded worker pool. With ?async=1 (or an "async" form
+    field) the request returns 202 and a job id straight away; fetch the
+    result from /api/ocr/jobs/<job_id> (also sent as the Location header).
+    A synchronous request still running after OCR_SYNC_TIMEOUT_SECONDS gets
+    the same 202 instead of its 200. When the pool is full the request is
+    refused with 503 and a Retry-After header.
     """
-    temp_path = None
-
     try:
         if 'file' not in request.files:
             return jsonify({
@@ -300,17 +350,26 @@ def process_receipt_api():
                 'error': 'Unsupported file type. Please upload a JPG, JPEG, PNG, WEBP, or BMP image.'
             }), 400
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp_file:
-            uploaded_file.save(temp_file.name)
-            temp_path = temp_file.name
+        async_mode = str(request.args.get('async', request.form.get('async', ''))).strip().lower() in ('1', 'true', 'yes')
+        pool = get_ocr_pool()
 
-        internal_result = process_receipt_internal(temp_path)
-        user_result = build_user_response(internal_result)
+        # Decoded in memory by the OCR pipeline — no temp file round trip
+        job = pool.submit(uploaded_file.read(), keep=async_mode)
 
-        if not user_result.get('success'):
-            return jsonify(user_result), 400
+        if async_mode or not pool.wait(job):
+            # Async request, or a sync one that outlived OCR_SYNC_TIMEOUT_SECONDS
+            return ocr_job_accepted_response(job)
 
-        return jsonify(user_result), 200
+        return ocr_job_result_response(job)
+
+    except OCRQueueFull as e:
+        response = jsonify({
+            'success': False,
+            'error': 'Receipt processing is busy right now. Please try again shortly.',
+            'pending': e.pending,
+        })
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
 
     except Exception as e:
         return jsonify({
@@ -318,9 +377,52 @@ def process_receipt_api():
             'error': f'Receipt processing failed: {str(e)}'
         }), 500
 
-    finally:
-        if temp_path and os.path.exists(temp_path):
-            os.remove(temp_path)
+
+@app.route('/api/ocr/jobs/<job_id>', methods=['GET'])
+def get_receipt_job(job_id):
+    """
+    Status of an async receipt OCR job; once finished, the same payload the
+    synchronous endpoint returns, plus the job's stage timings.
+    """
+    job = get_ocr_pool().get(job_id)
+
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Unknown or expired receipt job.'
+        }), 404
+
+    if not job.finished.is_set():
+        return ocr_job_accepted_response(job, status_code=200)
+
+    return ocr_job_result_response(job)
+
+
+def ocr_job_accepted_response(job, status_code=202):
+    response = jsonify({
+        'success': True,
+        'job': job.to_dict(),
+        'status_url': f'/api/ocr/jobs/{job.job_id}',
+    })
+    response.headers['Location'] = f'/api/ocr/jobs/{job.job_id}'
+    return response, status_code
+
+
+def ocr_job_result_response(job):
+    if job.error:
+        return jsonify({
+            'success': False,
+            'error': f'Receipt processing failed: {job.error}',
+            'job': job.to_dict(),
+        }), 500
+
+    user_result = build_user_response(job.result)
+    user_result['job'] = job.to_dict()
+
+    if not user_result.get('success'):
+        return jsonify(user_result), 400
+
+    return jsonify(user_result), 200
 
 # ============================================================
 # Recipe RAG endpoints
@@ -337,6 +439,7 @@ def recipe_stats():
             'success': True,
             'ready': False,
             'loaded': False,
+            'components': RAG_STATUS,
         }
         if RAG_INIT_ERROR is not None:
             payload['error'] = str(RAG_INIT_ERROR)
@@ -346,10 +449,16 @@ def recipe_stats():
         'success': True,
         'ready': True,
         'recipe_count': len(rag.retriever.recipes),
-        'active_sessions': len(rag.sessions),
+        'active_sessions': rag.sessions.size(),
+        'state_store': type(rag.sessions).__name__,
         'max_turns_per_session': rag.max_turns,
         'product_matcher_enabled': rag.product_matcher.enabled,
         'mongo_grounding_enabled': rag.mongo_resolver.enabled,
+        'embedding_cache': rag.encoder.cache.stats(),
+        'caches': rag.cache_stats(),
+        'encoder_batching': rag.encoder_stats(),
+        'llm': rag.llm.stats(),
+        'speculative_grounding': rag.speculation_stats(),
     })
 
 
@@ -436,12 +545,59 @@ def recipe_chat():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/recipe/chat/stream', methods=['POST'])
+def recipe_chat_stream():
+    """
+    Streaming RAG chat over Server-Sent Events.
+    Layman: "Same as /chat, but the answer appears word by word."
+    Technical: same request JSON as /api/recipe/chat. Emits
+               `event: sources` (retrieved recipes), then one `event: delta`
+               per LLM chunk ({"text": "..."}), then `event: done` with the
+               full /chat response body. Product grounding runs after the
+               LLM stream closes, so `done.answer` may include Mongo product
+               annotations that were not in the streamed text.
+    """
+    data = request.get_json(silent=True) or {}
+    session_id = data.get('session_id')
+    message = (data.get('message') or '').strip()
+    top_k = int(data.get('top_k', 5))
+
+    if not session_id:
+        return jsonify({'success': False, 'error': 'session_id is required'}), 400
+    if not message:
+        return jsonify({'success': False, 'error': 'message is required'}), 400
+
+    try:
+        current_rag = get_rag()
+    except RuntimeError as e:
+        return rag_not_ready_response(e)
+
+    def sse():
+        try:
+            for event in current_rag.chat_stream(session_id=session_id,
+                                                 user_query=message, top_k=top_k):
+                name = event.pop('event')
+                if name == 'done':
+                    event = {'success': True, **event}
+                yield f"event: {name}\ndata: {json.dumps(event)}\n\n"
+        except Exception as e:
+            print(f"[recipe_chat_stream] ERROR: {e}")
+            payload = json.dumps({'success': False, 'error': str(e)})
+            yield f"event: error\ndata: {payload}\n\n"
+
+    return Response(
+        stream_with_context(sse()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
 @app.route('/api/recipe/reset', methods=['POST'])
 def recipe_reset():
     """
     Wipe a session's conversation history.
     Layman: "Forget everything we've talked about — start fresh."
-    Technical: deletes the session_id key from rag.sessions dict, freeing
+    Technical: deletes the session_id key from the rag.sessions store, freeing
                memory and resetting the turn counter to zero.
     """
     data = request.get_json(silent=True) or {}
@@ -507,13 +663,16 @@ if __name__ == '__main__':
     print(f"Starting ML/AI Service on port {ML_SERVICE_PORT}")
     print("Available endpoints:")
     print("  GET  /health - Health check")
+    print("  GET  /ready - Readiness (Recipe RAG warm-up status)")
     print("  GET  /api/weekly-specials - Get this week's top specials")
     print("  POST /api/ml/recommendations - Get product recommendations")
     print("  POST /api/ml/price-prediction - Predict future prices")
-    print("  POST /api/ocr/receipt - Process uploaded receipt image")
+    print("  POST /api/ocr/receipt - Process uploaded receipt image (?async=1 for a job id)")
+    print("  GET  /api/ocr/jobs/<job_id> - Fetch an async receipt job")
     print("  GET  /api/recipe/stats - Recipe RAG diagnostics")
     print("  GET  /api/recipe/search?q=... - Recipe retrieval (no LLM)")
     print("  POST /api/recipe/chat - Recipe RAG chat (full LLM)")
+    print("  POST /api/recipe/chat/stream - Recipe RAG chat (SSE stream)")
     print("  POST /api/recipe/reset - Wipe a chat session")
     print("  GET  /api/recipe/products?context_id=... - Fetch product cards for a chat turn")
     app.run(host='0.0.0.0', port=ML_SERVICE_PORT, debug=False)
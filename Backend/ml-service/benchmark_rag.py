@@ -0,0 +1,506 @@
+"""
+Recipe RAG Benchmark — repeatable timings for the recipe_rag hot paths
+
+Builds synthetic recipe + product indexes of configurable size in a temp
+directory, loads the real pipeline components on top of them and times:
+
+    retriever.search          RecipeRetriever.search
+    matcher.batch_candidates  ProductMatcher.batch_find_product_candidates
+    resolver.bm25_ranked      MongoProductResolver._bm25_ranked_docs
+    rag.chat                  RecipeRAG.chat (full turn, incl. product grounding)
+
+Everything runs offline. Embeddings come from a deterministic hashing
+encoder, so the numbers measure the pipeline rather than the transformer.
+MongoDB is mongomock and the LLM is a canned responder (--llm-latency-ms
+simulates generation time). The component benchmarks clear their caches
+before every call (cold path); rag.chat runs with caches as in production.
+mongomock evaluates every query by scanning the collection in Python, so
+rag.chat grows with --products much faster than it would against indexed
+MongoDB — compare runs with the same sizes only.
+
+The result is one JSON document on stdout (or --output): p50/p95/p99/mean
+latency in ms per benchmark, the traced allocation peak of a short extra
+pass, and process RSS. With --baseline the run is compared against an
+earlier result and exits 1 when any p95 regresses by more than
+--max-regression.
+
+Usage (from Backend/ml-service/):
+    python benchmark_rag.py
+    python benchmark_rag.py --recipes 20000 --products 20000 --iterations 300
+    python benchmark_rag.py --dtype int8 --search-backend exact
+    python benchmark_rag.py --output bench.json
+    python benchmark_rag.py --baseline bench.json --max-regression 0.2
+
+Requires mongomock (pip install mongomock).
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import re
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+
+# Keep the pipeline offline: no GCS downloads, no real MongoDB, and the
+# memory-mapped layout this script writes.
+os.environ["GOOGLE_CLOUD_PROJECT"] = ""
+os.environ["MONGO_URI"] = ""
+os.environ["RAG_INDEX_FORMAT"] = "npy"
+
+# Make recipe_rag importable when running this script directly
+sys.path.insert(0, os.path.dirname(__file__))
+
+# Import-time notices go to stderr so stdout stays machine-readable
+with contextlib.redirect_stdout(sys.stderr):
+    from recipe_rag.cache import EmbeddingCache
+    from recipe_rag.encoding import CachedEncoder
+    from recipe_rag.rag_pipeline import (
+        MongoProductResolver,
+        ProductMatcher,
+        RecipeRAG,
+        RecipeRetriever,
+    )
+    from recipe_rag.state_store import MemoryStateStore
+    from recipe_rag.vector_index import (
+        build_ivf, normalize_rows, save_embedding_matrix, save_ivf,
+    )
+
+PROTEINS = ["chicken", "beef", "pork", "lamb", "salmon", "prawn", "tofu",
+            "turkey", "tuna", "egg", "chickpea", "lentil"]
+VEGETABLES = ["broccoli", "carrot", "spinach", "capsicum", "zucchini", "onion",
+              "mushroom", "potato", "pumpkin", "tomato", "corn", "kale", "pea",
+              "cauliflower", "eggplant", "cabbage"]
+PANTRY = ["rice", "pasta", "noodle", "garlic", "ginger", "soy sauce", "olive oil",
+          "butter", "cheese", "cream", "coconut milk", "flour", "honey", "lemon",
+          "chilli", "basil", "coriander", "stock", "breadcrumb", "yoghurt"]
+STYLES = ["easy", "creamy", "spicy", "crispy", "slow cooked", "one pan", "baked",
+          "grilled", "stir fry", "roast", "quick", "healthy"]
+CUISINES = ["Australian", "Italian", "Thai", "Indian", "Mexican", "Japanese",
+            "Greek", "Chinese"]
+BRANDS = ["Coles", "Woolworths", "Macro", "Community Co", "Market", "Select"]
+SIZES = ["250g", "500g", "1kg", "2L", "1L", "400g", "each", "6 pack"]
+CATEGORIES = {"meat": PROTEINS, "produce": VEGETABLES, "pantry": PANTRY}
+
+
+# ---------------------------------------------------------------------------
+# Offline stand-ins
+# ---------------------------------------------------------------------------
+
+class HashingEncoder:
+    """
+    Deterministic bag-of-words encoder with the SentenceTransformer
+    `encode` signature: every token maps to a fixed random vector and a
+    sentence is the sum of its tokens, so shared words mean similar vectors.
+    """
+
+    max_seq_length = 384
+
+    def __init__(self, dim: int = 768):
+        self.dim = dim
+        self._token_vectors: Dict[str, np.ndarray] = {}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _token_vector(self, token: str) -> np.ndarray:
+        vector = self._token_vectors.get(token)
+        if vector is None:
+            rng = np.random.default_rng(zlib.crc32(token.encode("utf-8")))
+            vector = rng.standard_normal(self.dim).astype(np.float32)
+            self._token_vectors[token] = vector
+        return vector
+
+    def encode(self, sentences, convert_to_numpy: bool = True, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        out = np.zeros((len(sentences), self.dim), dtype=np.float32)
+        for i, sentence in enumerate(sentences):
+            for token in re.findall(r"[a-z]+", str(sentence).lower()):
+                out[i] += self._token_vector(token)
+        return out[0] if single else out
+
+
+class FakeLLM:
+    """
+    LLMClient stand-in: answers with the first recipe in the prompt, laid
+    out with Ingredients/Instructions headings like the real models, after
+    `latency_ms` of simulated generation.
+    """
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+
+    def _answer(self, messages: List[Dict]) -> str:
+        prompt = messages[-1]["content"]
+        name = re.search(r"^Recipe: (.+)$", prompt, flags=re.M)
+        ingredients = re.search(r"Ingredients:\n(.*?)\n\n", prompt, flags=re.S)
+        return (
+            f"Here's how to make {name.group(1) if name else 'this dish'}.\n\n"
+            f"**Ingredients:**\n{ingredients.group(1) if ingredients else '- salt'}\n\n"
+            "**Instructions:**\n1. Prepare the ingredients.\n"
+            "2. Cook until done.\n3. Serve warm."
+        )
+
+    def generate(self, system_prompt: str, messages: List[Dict]) -> str:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return self._answer(messages)
+
+    def generate_stream(self, system_prompt: str, messages: List[Dict]):
+        answer = self.generate(system_prompt, messages)
+        for start in range(0, len(answer), 40):
+            yield answer[start:start + 40]
+
+    def stats(self) -> Dict:
+        return {}
+
+
+# ---------------------------------------------------------------------------
+# Synthetic data
+# ---------------------------------------------------------------------------
+
+def synthetic_recipes(n: int, rng: np.random.Generator) -> List[Dict]:
+    recipes = []
+    for i in range(n):
+        protein = rng.choice(PROTEINS)
+        veg = rng.choice(VEGETABLES)
+        name = f"{rng.choice(STYLES).title()} {protein.title()} with {veg.title()} {i}"
+        items = [protein, veg] + list(rng.choice(VEGETABLES + PANTRY,
+                                                 size=int(rng.integers(4, 9)),
+                                                 replace=False))
+        ingredients = [
+            f"{int(rng.integers(1, 5)) * 100}g {item}, chopped" if k < 2
+            else f"{int(rng.integers(1, 4))} tbsp {item}"
+            for k, item in enumerate(items)
+        ]
+        instructions = [f"Prepare the {protein}.", f"Cook the {veg} with the {protein}.",
+                        "Season and serve."]
+        metadata = {
+            "name": name,
+            "description": f"A {rng.choice(CUISINES)} style {protein} and {veg} dish.",
+            "category": "Dinner",
+            "cuisine": str(rng.choice(CUISINES)),
+            "prep_time": "15 mins",
+            "cook_time": "30 mins",
+            "servings": "4",
+            "ingredients": ingredients,
+            "instructions": instructions,
+        }
+        text = (f"Recipe: {name}\n{metadata['description']}\n"
+                f"Ingredients: {'; '.join(ingredients)}\n"
+                f"Instructions: {' '.join(instructions)}")
+        recipes.append({"text": text, "metadata": metadata})
+    return recipes
+
+
+def synthetic_products(n: int, rng: np.random.Generator) -> List[Dict]:
+    """Product rows; about 10% have no barcode (description fallback path)."""
+    category_ids = list(CATEGORIES)
+    products = []
+    for i in range(n):
+        category = category_ids[i % len(category_ids)]
+        item = rng.choice(CATEGORIES[category])
+        variant = rng.choice(STYLES + ["fresh", "frozen", "organic", "value"])
+        description = f"{rng.choice(BRANDS)} {variant} {item} {rng.choice(SIZES)} {i}"
+        products.append({
+            "barcode": "0" if i % 10 == 0 else str(9300000000000 + i),
+            "product_id": str(100000 + i),
+            "description": description,
+            "category": category,
+        })
+    return products
+
+
+def synthetic_queries(n: int, rng: np.random.Generator) -> List[str]:
+    """Half ask for a full recipe (products get attached), half browse."""
+    queries = []
+    for i in range(n):
+        protein, veg = rng.choice(PROTEINS), rng.choice(VEGETABLES)
+        if i % 2 == 0:
+            queries.append(f"show me the full recipe for {rng.choice(STYLES)} "
+                           f"{protein} with {veg}")
+        else:
+            queries.append(f"any {rng.choice(CUISINES)} {protein} ideas for dinner?")
+    return queries
+
+
+def build_indexes(index_dir: str, recipes: List[Dict], products: List[Dict],
+                  model: HashingEncoder, dtype: str, batch: int = 2048) -> None:
+    """Write the recipe/product npy layout, metadata and recipe_ann.npz."""
+    def embed(texts):
+        return np.concatenate([model.encode(texts[i:i + batch])
+                               for i in range(0, len(texts), batch)])
+
+    recipe_emb = embed([r["text"] for r in recipes])
+    save_embedding_matrix(index_dir, "recipe_index", recipe_emb, dtype)
+    with open(os.path.join(index_dir, "recipe_metadata.json"), "w", encoding="utf-8") as f:
+        json.dump(recipes, f)
+    e_norm = normalize_rows(recipe_emb)
+    save_ivf(os.path.join(index_dir, "recipe_ann.npz"), build_ivf(e_norm),
+             dim=e_norm.shape[1])
+    del recipe_emb, e_norm
+
+    product_emb = embed([p["description"] for p in products])
+    save_embedding_matrix(index_dir, "product_index", product_emb, dtype)
+    with open(os.path.join(index_dir, "product_metadata.json"), "w", encoding="utf-8") as f:
+        json.dump({"products": [{k: p[k] for k in ("barcode", "product_id", "description")}
+                                for p in products]}, f)
+
+
+def build_mongo(products: List[Dict]):
+    """mongomock database with products/categories shaped like production."""
+    import mongomock
+
+    db = mongomock.MongoClient()["DiscountMate_DB"]
+    category_ids = {
+        code: db["categories"].insert_one({"category_code": code}).inserted_id
+        for code in CATEGORIES
+    }
+    db["products"].insert_many([
+        {
+            "product_name": p["description"].rsplit(" ", 1)[0],
+            "gtin": None if p["barcode"] == "0" else p["barcode"],
+            "product_code": p["product_id"],
+            "category_id": category_ids[p["category"]],
+            "link_image": f"https://example.invalid/{p['product_id']}.jpg",
+        }
+        for p in products
+    ])
+    return db
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+def rss_mb() -> float:
+    """Current resident set size (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_benchmark(fn: Callable, calls: Sequence[tuple], warmup: int,
+                  memory_samples: int, before_each: Callable = None) -> Dict:
+    """Time fn(*args) for every entry of `calls` and summarise in ms."""
+    def call(args):
+        if before_each is not None:
+            before_each()
+        fn(*args)
+
+    for args in calls[:warmup]:
+        call(args)
+
+    samples = np.empty(len(calls), dtype=np.float64)
+    for i, args in enumerate(calls):
+        start = time.perf_counter()
+        call(args)
+        samples[i] = time.perf_counter() - start
+    samples *= 1000
+
+    # Allocation peak from a short separate pass — tracing skews timings.
+    tracemalloc.start()
+    for args in calls[:memory_samples]:
+        call(args)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "iterations": len(calls),
+        "p50_ms": round(float(np.percentile(samples, 50)), 3),
+        "p95_ms": round(float(np.percentile(samples, 95)), 3),
+        "p99_ms": round(float(np.percentile(samples, 99)), 3),
+        "mean_ms": round(float(samples.mean()), 3),
+        "min_ms": round(float(samples.min()), 3),
+        "max_ms": round(float(samples.max()), 3),
+        "tracemalloc_peak_kb": round(traced_peak / 1024, 1),
+        "rss_mb": rss_mb(),
+    }
+
+
+def compare(results: Dict, baseline: Dict, max_regression: float) -> Dict:
+    """p95 ratio (current / baseline) per benchmark present in both runs."""
+    comparison = {}
+    for name, current in results["benchmarks"].items():
+        before = baseline.get("benchmarks", {}).get(name)
+        if not before or not before.get("p95_ms"):
+            continue
+        ratio = current["p95_ms"] / before["p95_ms"]
+        comparison[name] = {
+            "baseline_p95_ms": before["p95_ms"],
+            "p95_ms": current["p95_ms"],
+            "ratio": round(ratio, 3),
+            "regressed": ratio > 1 + max_regression,
+        }
+    return comparison
+
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+
+def benchmark(args, index_dir: str) -> Dict:
+    rng = np.random.default_rng(args.seed)
+    setup = {}
+
+    started = time.perf_counter()
+    recipes = synthetic_recipes(args.recipes, rng)
+    products = synthetic_products(args.products, rng)
+    queries = synthetic_queries(args.queries, rng)
+    model = HashingEncoder(args.dim)
+    build_indexes(index_dir, recipes, products, model, args.dtype)
+    setup["build_indexes_s"] = round(time.perf_counter() - started, 2)
+
+    started = time.perf_counter()
+    encoder = CachedEncoder(model, EmbeddingCache())
+    retriever = RecipeRetriever(encoder, index_dir, backend=args.search_backend)
+    matcher = ProductMatcher(encoder, index_dir)
+    resolver = MongoProductResolver(index_dir, refresh_seconds=10 ** 6,
+                                    db=build_mongo(products))
+    deadline = time.monotonic() + 600
+    while resolver._bm25_index is None and time.monotonic() < deadline:
+        time.sleep(0.05)   # initial BM25 scan runs in the background
+    if resolver._bm25_index is None:
+        raise RuntimeError("BM25 index was not built within 10 minutes")
+    rag = RecipeRAG(
+        index_dir, encoder=encoder, retriever=retriever, product_matcher=matcher,
+        mongo_resolver=resolver, llm=FakeLLM(args.llm_latency_ms),
+        sessions=MemoryStateStore("sessions", 3600, args.iterations + args.warmup),
+        context_store=MemoryStateStore("contexts", 3600, args.iterations + args.warmup),
+    )
+    setup["load_components_s"] = round(time.perf_counter() - started, 2)
+
+    n = args.iterations
+    query_calls = [(queries[i % len(queries)], args.top_k) for i in range(n)]
+    ingredient_lists = [recipes[int(i)]["metadata"]["ingredients"]
+                        for i in rng.integers(0, len(recipes), size=n)]
+    bm25_calls = []
+    for ingredients in ingredient_lists:
+        terms = resolver._ingredient_search_terms(ingredients[0])
+        bm25_calls.append((resolver._tokens_from_text(terms[0]) if terms else ["salt"], 20))
+
+    def cold():
+        encoder.cache.clear()
+        matcher._match_cache.clear()
+        resolver._bm25_index.query_scores.clear()
+
+    results = {}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results["retriever.search"] = run_benchmark(
+            retriever.search, query_calls, args.warmup, args.memory_samples, cold)
+        results["matcher.batch_candidates"] = run_benchmark(
+            matcher.batch_find_product_candidates, [(ings,) for ings in ingredient_lists],
+            args.warmup, args.memory_samples, cold)
+        results["resolver.bm25_ranked"] = run_benchmark(
+            resolver._bm25_ranked_docs, bm25_calls, args.warmup, args.memory_samples, cold)
+        # One session per call; warm-up and traced calls are follow-up turns
+        chat_calls = [(f"bench-{i}", query, args.top_k)
+                      for i, (query, _) in enumerate(query_calls)]
+        results["rag.chat"] = run_benchmark(
+            rag.chat, chat_calls, args.warmup, args.memory_samples)
+        speculation = rag.speculation_stats()
+
+    rag.close()
+
+    return {
+        "config": {
+            "recipes": args.recipes,
+            "products": args.products,
+            "dim": args.dim,
+            "dtype": args.dtype,
+            "search_backend": retriever.search_index.name,
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "top_k": args.top_k,
+            "llm_latency_ms": args.llm_latency_ms,
+            "seed": args.seed,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "setup": setup,
+        "memory": {
+            "recipe_index_mb": round(retriever._e_norm.nbytes / (1024 * 1024), 1),
+            "product_index_mb": round(matcher._e_norm.nbytes / (1024 * 1024), 1),
+            "rss_mb": rss_mb(),
+            "peak_rss_mb": peak_rss_mb(),
+        },
+        "benchmarks": results,
+        "caches": rag.cache_stats(),
+        "speculative_grounding": speculation,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the recipe RAG hot paths")
+    parser.add_argument("--recipes", type=int, default=5000)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200,
+                        help="Distinct synthetic user queries (cycled)")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--dtype", choices=["float32", "float16", "int8"], default="float32",
+                        help="Storage dtype of the synthetic npy indexes")
+    parser.add_argument("--search-backend", choices=["ivf", "exact"], default="ivf")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--memory-samples", type=int, default=10,
+                        help="Calls traced with tracemalloc after the timed pass")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--index-dir", default=None,
+                        help="Keep the synthetic index here instead of a temp dir")
+    parser.add_argument("--output", default=None, help="Write JSON here instead of stdout")
+    parser.add_argument("--baseline", default=None,
+                        help="Earlier result to compare p95 latencies against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed p95 slowdown vs --baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    # Component logging goes to stderr so stdout stays machine-readable
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.index_dir:
+            os.makedirs(args.index_dir, exist_ok=True)
+            report = benchmark(args, args.index_dir)
+        else:
+            with tempfile.TemporaryDirectory(prefix="rag-bench-") as tmp:
+                report = benchmark(args, tmp)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            report["comparison"] = compare(report, json.load(f), args.max_regression)
+        regressed = [name for name, c in report["comparison"].items() if c["regressed"]]
+        if regressed:
+            print(f"p95 regression over {args.max_regression:.0%}: {', '.join(regressed)}",
+                  file=sys.stderr)
+            exit_code = 1
+
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+    sys.exit(exit_code)
@@ -3,18 +3,34 @@ Build Recipe + Ingredient Vector Indexes (offline / one-time)
 
 Loads all recipe JSONs, embeds them with sentence-transformers
 (all-mpnet-base-v2, 768 dims, runs locally — no API calls), and
-saves four files for the live RAG service to load at startup:
+saves these files for the live RAG service to load at startup:
 
     recipe_rag/index/recipe_index.npz       — recipe embeddings (N x 768)
     recipe_rag/index/recipe_metadata.json   — text + metadata per recipe
+    recipe_rag/index/recipe_ann.npz         — IVF clusters for approximate search
     recipe_rag/index/ingredient_index.npz   — ingredient embeddings (M x 768)
     recipe_rag/index/ingredient_metadata.json
         — {"ingredients": [...], "ingredient_to_recipes": {...}}
 
+With --format npy the recipe embeddings are instead written pre-normalised
+and uncompressed so the service can memory-map them:
+
+    recipe_rag/index/recipe_index.npy       — normalised rows (--dtype)
+    recipe_rag/index/recipe_index.meta.json — sidecar (shape, dtype, files)
+
+With --stream the recipe embeddings go straight into that npy layout a
+chunk at a time, checkpointing after each chunk so an interrupted build
+resumes (see recipe_rag/streaming_embed.py).
+
 Usage (from Backend/ml-service/):
     python build_recipe_index.py
     python build_recipe_index.py --recipe-dir "../../Recipe Scraper/woolworths_recipes"
     python build_recipe_index.py --skip-ingredients         # recipes only
+    python build_recipe_index.py --skip-ann                 # exact search only
+    python build_recipe_index.py --ann-nlist 128 --ann-nprobe 8
+    python build_recipe_index.py --format npy --dtype float16  # mmap layout
+    python build_recipe_index.py --backend onnx-int8        # quantised ONNX encoder
+    python build_recipe_index.py --stream --workers 4       # chunked, resumable (npy)
     python build_recipe_index.py --test                     # quick search test
 """
 
@@ -28,10 +44,30 @@ import numpy as np
 # Make recipe_rag importable when running this script directly
 sys.path.insert(0, os.path.dirname(__file__))
 
+from recipe_rag.encoding import EMBEDDING_BACKENDS, load_embedding_model
+from recipe_rag.streaming_embed import (
+    DEFAULT_CHUNK_ROWS,
+    StreamingMatrixWriter,
+    embed_stream,
+    fingerprint_texts,
+)
 from recipe_rag.preprocess import (
     load_recipes_from_directory,
     extract_unique_ingredients,
 )
+from recipe_rag.vector_index import (
+    EmbeddingMatrix,
+    IVFIndex,
+    atomic_output,
+    build_ivf,
+    load_embedding_matrix,
+    normalize_rows,
+    recall_at_k,
+    sample_queries,
+    save_embedding_matrix,
+    save_ivf,
+    top_k_indices,
+)
 
 # Default output location — sits next to rag_pipeline.py for easy loading
 INDEX_DIR = os.path.join(os.path.dirname(__file__), "recipe_rag", "index")
@@ -76,14 +112,28 @@ def embed_ingredients(model, ingredients, batch_size=64):
     return embeddings
 
 
-def save_recipe_index(recipes, embeddings, index_dir):
-    """Save recipe embeddings (.npz) + metadata (.json)."""
+def save_recipe_index(recipes, embeddings, index_dir, index_format="npz",
+                      dtype="float32"):
+    """
+    Save recipe embeddings + metadata (.json).
+    index_format: "npz" (compressed), "npy" (normalised, mmap-able) or "both".
+    """
     os.makedirs(index_dir, exist_ok=True)
 
-    emb_path = os.path.join(index_dir, "recipe_index.npz")
-    np.savez_compressed(emb_path, embeddings=embeddings)
-    emb_mb = os.path.getsize(emb_path) / (1024 * 1024)
-    print(f"  Saved {emb_path} ({emb_mb:.1f} MB)")
+    if index_format in ("npz", "both"):
+        emb_path = os.path.join(index_dir, "recipe_index.npz")
+        np.savez_compressed(emb_path, embeddings=embeddings)
+        emb_mb = os.path.getsize(emb_path) / (1024 * 1024)
+        print(f"  Saved {emb_path} ({emb_mb:.1f} MB)")
+    if index_format in ("npy", "both"):
+        for path in save_embedding_matrix(index_dir, "recipe_index", embeddings, dtype):
+            print(f"  Saved {path} ({os.path.getsize(path) / (1024 * 1024):.1f} MB)")
+    else:
+        # "auto" loading prefers the npy sidecar — don't leave a stale one behind
+        stale_meta = os.path.join(index_dir, "recipe_index.meta.json")
+        if os.path.exists(stale_meta):
+            os.remove(stale_meta)
+            print(f"  Removed stale {stale_meta}")
 
     meta_path = os.path.join(index_dir, "recipe_metadata.json")
     payload = [{"text": r["text"], "metadata": r["metadata"]} for r in recipes]
@@ -93,6 +143,68 @@ def save_recipe_index(recipes, embeddings, index_dir):
     print(f"  Saved {meta_path} ({meta_mb:.1f} MB)")
 
 
+def build_recipe_ann(embeddings, index_dir, nlist=None, nprobe=8, recall_k=10):
+    """
+    Cluster recipe embeddings into an IVF index (recipe_ann.npz) and report
+    recall@k against brute-force search for the nprobe the service will use.
+    `embeddings` may also be an already-normalised EmbeddingMatrix.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    if isinstance(embeddings, EmbeddingMatrix):
+        e_norm = embeddings
+    else:
+        e_norm = normalize_rows(embeddings)
+
+    print(f"\n[Building IVF index over {e_norm.shape[0]} recipes]")
+    start = time.time()
+    ivf = build_ivf(e_norm, nlist=nlist)
+    print(f"  {ivf['centroids'].shape[0]} lists in {time.time() - start:.1f}s")
+
+    ann_path = os.path.join(index_dir, "recipe_ann.npz")
+    save_ivf(ann_path, ivf, dim=e_norm.shape[1])
+    ann_mb = os.path.getsize(ann_path) / (1024 * 1024)
+    print(f"  Saved {ann_path} ({ann_mb:.1f} MB)")
+
+    index = IVFIndex(e_norm, ivf["centroids"], ivf["list_offsets"],
+                     ivf["list_ids"], nprobe=nprobe)
+    recall = recall_at_k(index, e_norm, sample_queries(e_norm), k=recall_k)
+    print(f"  recall@{recall_k} vs exact (nprobe={index.nprobe}): {recall:.3f}")
+    if recall < 0.9:
+        print("  WARNING: recall below 0.90 — raise RECIPE_ANN_NPROBE "
+              "or rebuild with a smaller --ann-nlist")
+    return recall
+
+
+def stream_recipe_index(model, recipes, index_dir, dtype="float32",
+                        model_spec=None, chunk_rows=DEFAULT_CHUNK_ROWS,
+                        workers=1, batch_size=32):
+    """
+    Embed recipes chunk by chunk straight into the npy layout, resuming from
+    a previous interrupted run over the same recipes. Returns the
+    memory-mapped EmbeddingMatrix.
+    """
+    texts = [r["text"] for r in recipes]
+    rows, fingerprint = fingerprint_texts(texts)
+    writer = StreamingMatrixWriter(
+        index_dir, "recipe_index", rows, model.get_sentence_embedding_dimension(),
+        dtype, fingerprint=fingerprint, model_info=model_spec,
+    )
+    print(f"\n[Embedding {rows} recipes in chunks of {chunk_rows}, "
+          f"workers={workers}]")
+    chunks = (texts[i:i + chunk_rows] for i in range(0, rows, chunk_rows))
+    embed_stream(chunks, writer, model=model, model_spec=model_spec,
+                 workers=workers, batch_size=batch_size)
+    for path in writer.finalize():
+        print(f"  Saved {path} ({os.path.getsize(path) / (1024 * 1024):.1f} MB)")
+
+    meta_path = os.path.join(index_dir, "recipe_metadata.json")
+    payload = [{"text": r["text"], "metadata": r["metadata"]} for r in recipes]
+    with atomic_output(meta_path, "w") as f:
+        json.dump(payload, f, ensure_ascii=False)
+    print(f"  Saved {meta_path} ({os.path.getsize(meta_path) / (1024 * 1024):.1f} MB)")
+    return load_embedding_matrix(os.path.join(index_dir, "recipe_index.meta.json"))
+
+
 def save_ingredient_index(ingredients, mapping, embeddings, index_dir):
     """Save ingredient embeddings (.npz) + ingredient→recipe mapping (.json)."""
     os.makedirs(index_dir, exist_ok=True)
@@ -116,7 +228,10 @@ def save_ingredient_index(ingredients, mapping, embeddings, index_dir):
 # Main pipeline
 # ---------------------------------------------------------------------------
 
-def build(recipe_dir, index_dir, skip_ingredients=False):
+def build(recipe_dir, index_dir, skip_ingredients=False, skip_ann=False,
+          ann_nlist=None, ann_nprobe=8, index_format="npz", dtype="float32",
+          backend="torch", onnx_file=None, stream=False,
+          chunk_rows=DEFAULT_CHUNK_ROWS, workers=1):
     print("=" * 70)
     print("RECIPE INDEX BUILDER")
     print("=" * 70)
@@ -127,16 +242,32 @@ def build(recipe_dir, index_dir, skip_ingredients=False):
         print("ERROR: No recipes found. Check --recipe-dir path.")
         return False
 
-    print(f"\n[2/4] Loading embedding model: {EMBEDDING_MODEL_NAME}")
+    print(f"\n[2/4] Loading embedding model: {EMBEDDING_MODEL_NAME} ({backend})")
     print("  (~420MB on first download, then cached locally)")
-    from sentence_transformers import SentenceTransformer
-    model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    model = load_embedding_model(EMBEDDING_MODEL_NAME, backend, onnx_file, strict=True)
     print(f"  Embedding dim: {model.get_sentence_embedding_dimension()}")
     print(f"  Max seq length: {model.max_seq_length}")
 
     print("\n[3/4] Embedding recipes...")
-    recipe_embeddings = embed_recipes(model, recipes)
-    save_recipe_index(recipes, recipe_embeddings, index_dir)
+    if stream:
+        model_spec = {"model_name": EMBEDDING_MODEL_NAME, "backend": backend,
+                      "onnx_file": onnx_file}
+        recipe_embeddings = stream_recipe_index(
+            model, recipes, index_dir, dtype=dtype, model_spec=model_spec,
+            chunk_rows=chunk_rows, workers=workers,
+        )
+    else:
+        recipe_embeddings = embed_recipes(model, recipes)
+        save_recipe_index(recipes, recipe_embeddings, index_dir,
+                          index_format=index_format, dtype=dtype)
+    if skip_ann:
+        stale_ann = os.path.join(index_dir, "recipe_ann.npz")
+        if os.path.exists(stale_ann):
+            os.remove(stale_ann)
+            print(f"  Removed stale {stale_ann} (--skip-ann)")
+    else:
+        build_recipe_ann(recipe_embeddings, index_dir,
+                         nlist=ann_nlist, nprobe=ann_nprobe)
 
     if skip_ingredients:
         print("\n[4/4] Skipping ingredient index (--skip-ingredients)")
@@ -157,25 +288,30 @@ def build(recipe_dir, index_dir, skip_ingredients=False):
 # Optional smoke test
 # ---------------------------------------------------------------------------
 
-def test_search(index_dir, query="quick chicken dinner for family", top_k=3):
+def test_search(index_dir, query="quick chicken dinner for family", top_k=3,
+                backend="torch", onnx_file=None):
     """Quick verification that the saved index loads and searches correctly."""
     print(f"\n--- Smoke test: '{query}' ---")
-    from sentence_transformers import SentenceTransformer
 
-    embeddings = np.load(os.path.join(index_dir, "recipe_index.npz"))["embeddings"]
+    npy_meta = os.path.join(index_dir, "recipe_index.meta.json")
+    if os.path.exists(npy_meta):
+        e_norm = load_embedding_matrix(npy_meta)
+    else:
+        e_norm = normalize_rows(
+            np.load(os.path.join(index_dir, "recipe_index.npz"))["embeddings"]
+        )
     with open(os.path.join(index_dir, "recipe_metadata.json"), "r",
               encoding="utf-8") as f:
         meta = json.load(f)
 
-    model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    model = load_embedding_model(EMBEDDING_MODEL_NAME, backend, onnx_file, strict=True)
     q = model.encode([query], convert_to_numpy=True).astype(np.float32)
 
-    # Cosine similarity
-    q_norm = q / (np.linalg.norm(q, axis=1, keepdims=True) + 1e-10)
-    e_norm = embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-10)
-    sims = (e_norm @ q_norm.T).flatten()
+    # Cosine similarity + partial top-k selection
+    q_norm = normalize_rows(q)[0]
+    sims = e_norm @ q_norm
 
-    top = np.argsort(sims)[::-1][:top_k]
+    top = top_k_indices(sims, top_k)
     for rank, i in enumerate(top, 1):
         print(f"  #{rank} ({sims[i]:.3f}) {meta[i]['metadata']['name']}")
 
@@ -204,6 +340,63 @@ if __name__ == "__main__":
         action="store_true",
         help="Build only the recipe index (skip ingredient embedding)",
     )
+    parser.add_argument(
+        "--skip-ann",
+        action="store_true",
+        help="Do not build recipe_ann.npz (service falls back to exact search)",
+    )
+    parser.add_argument(
+        "--ann-nlist",
+        type=int,
+        default=None,
+        help="Number of IVF clusters (default: sqrt of recipe count)",
+    )
+    parser.add_argument(
+        "--ann-nprobe",
+        type=int,
+        default=8,
+        help="Clusters probed when checking recall (match RECIPE_ANN_NPROBE)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["npz", "npy", "both"],
+        default="npz",
+        help="Recipe embedding layout: compressed npz, mmap-able npy, or both",
+    )
+    parser.add_argument(
+        "--dtype",
+        choices=["float32", "float16", "int8"],
+        default="float32",
+        help="Storage dtype for the npy layout (int8 adds per-row scales)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=EMBEDDING_BACKENDS,
+        default="torch",
+        help="Embedding inference backend (onnx/onnx-int8 need sentence-transformers[onnx])",
+    )
+    parser.add_argument(
+        "--onnx-file",
+        default=None,
+        help="ONNX file inside the model repo (default per backend)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Embed recipes in resumable chunks straight into the npy layout",
+    )
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        default=DEFAULT_CHUNK_ROWS,
+        help="Recipes per chunk with --stream",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Encoder processes with --stream",
+    )
     parser.add_argument(
         "--test",
         action="store_true",
@@ -211,6 +404,10 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
-    ok = build(args.recipe_dir, args.index_dir, args.skip_ingredients)
+    ok = build(args.recipe_dir, args.index_dir, args.skip_ingredients,
+               skip_ann=args.skip_ann, ann_nlist=args.ann_nlist,
+               ann_nprobe=args.ann_nprobe, index_format=args.format,
+               dtype=args.dtype, backend=args.backend, onnx_file=args.onnx_file,
+               stream=args.stream, chunk_rows=args.chunk_rows, workers=args.workers)
     if ok and args.test:
-        test_search(args.index_dir)
\ No newline at end of file
+        test_search(args.index_dir, backend=args.backend, onnx_file=args.onnx_file)
\ No newline at end of file
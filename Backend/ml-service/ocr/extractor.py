@@ -1,23 +1,43 @@
 import os
+import time
 import cv2
+import numpy as np
 import pytesseract
 from pytesseract import Output
 from ocr.parser import build_receipt_data
-from ocr.matcher import load_products_from_csv, match_receipt_items
+from ocr.matcher import get_product_index, match_receipt_items
 
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 PRODUCT_CSV_PATH = os.path.join(BASE_DIR, "data", "products_small.csv")
 
 
-def validate_receipt_image(image_path):
-    if not os.path.exists(image_path):
-        return False, "Image file not found."
+def load_receipt_image(source):
+    # source: a file path, the raw upload bytes, or an already-decoded BGR
+    # image. Uploads are decoded straight from memory with cv2.imdecode, so
+    # the API never writes them to disk. Returns (img, error).
+    if isinstance(source, np.ndarray):
+        return source, None
 
-    img = cv2.imread(image_path)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        buffer = np.frombuffer(source, dtype=np.uint8)
+        img = cv2.imdecode(buffer, cv2.IMREAD_COLOR) if buffer.size else None
+    else:
+        if not os.path.exists(source):
+            return None, "Image file not found."
+        img = cv2.imread(source)
 
     if img is None:
-        return False, "Could not read the uploaded image."
+        return None, "Could not read the uploaded image."
+
+    return img, None
+
+
+def validate_receipt_image(img):
+    if not isinstance(img, np.ndarray):
+        img, error = load_receipt_image(img)
+        if error:
+            return False, error
 
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     height, width = gray.shape
@@ -57,13 +77,51 @@ def preprocess_image(img):
     return processed
 
 
-def extract_ocr_text(processed_image):
+def extract_ocr_data(processed_image):
+    # One Tesseract run gives both the text (via ocr_text_from_data) and the
+    # per-word confidences used by calculate_ocr_quality.
     config = r"--oem 3 --psm 6"
-    return pytesseract.image_to_string(processed_image, config=config)
+    return pytesseract.image_to_data(processed_image, config=config, output_type=Output.DICT)
+
+
+def ocr_text_from_data(data):
+    # Rebuilds the text image_to_string would give for the same pass: words
+    # joined per line, and a blank line wherever a new paragraph (or block)
+    # starts, as Tesseract's own text output does
+    lines = {}
+
+    for i in range(len(data["text"])):
+        word = data["text"][i].strip()
+        if not word:
+            continue
+
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(word)
 
+    # Tesseract reports words in reading order, so dict order is line order
+    out = []
+    paragraph = None
+    for (block_num, par_num, _), words in lines.items():
+        if paragraph is not None and (block_num, par_num) != paragraph:
+            out.append("")
+        paragraph = (block_num, par_num)
+        out.append(" ".join(words))
 
-def calculate_ocr_quality(processed_image, items):
-    data = pytesseract.image_to_data(processed_image, output_type=Output.DICT)
+    return "\n".join(out)
+
+
+def extract_ocr_text(processed_image):
+    return ocr_text_from_data(extract_ocr_data(processed_image))
+
+
+def calculate_ocr_quality(data, items):
+    # data: the image_to_data dict from extract_ocr_data (an image is also
+    # accepted and run through Tesseract here). The confidences come from
+    # the same --psm 6 pass as the text; before the passes were merged they
+    # came from a separate default-psm (3) run, so avg_confidence and
+    # word_count can differ slightly from older results for the same image.
+    if not isinstance(data, dict):
+        data = extract_ocr_data(data)
 
     confidences = []
     valid_words = []
@@ -112,10 +170,8 @@ def calculate_ocr_quality(processed_image, items):
 
 def add_product_matches(receipt_data):
     try:
-        print("[OCR] Product CSV path:", PRODUCT_CSV_PATH)
-        print("[OCR] Product CSV exists:", os.path.exists(PRODUCT_CSV_PATH))
-
-        products = load_products_from_csv(PRODUCT_CSV_PATH)
+        # Parsed once per process; reloaded when the CSV file changes
+        products = get_product_index(PRODUCT_CSV_PATH)
         matched_items = match_receipt_items(receipt_data.get("items", []), products)
 
         receipt_data["matched_items"] = matched_items
@@ -130,8 +186,28 @@ def add_product_matches(receipt_data):
     return receipt_data
 
 
-def process_receipt_internal(image_path):
-    valid, message = validate_receipt_image(image_path)
+def _record_stage(timings, stage, started):
+    # Stage durations in milliseconds; returns the new stage start time
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = round((now - started) * 1000, 1)
+    return now
+
+
+def process_receipt_internal(image_source, timings=None):
+    # image_source: anything load_receipt_image accepts; it is decoded once and
+    # the same array is used for validation, preprocessing and OCR.
+    # timings: optional dict filled with per-stage durations (ms) for
+    # validate, preprocess, tesseract, parse and match
+    started = time.perf_counter()
+    img, message = load_receipt_image(image_source)
+    valid = img is not None
+
+    if valid:
+        valid, message = validate_receipt_image(img)
+
+    started = _record_stage(timings, "validate", started)
+
     if not valid:
         return {
             "success": False,
@@ -141,10 +217,12 @@ def process_receipt_internal(image_path):
             "quality": {}
         }
 
-    img = cv2.imread(image_path)
     processed = preprocess_image(img)
+    started = _record_stage(timings, "preprocess", started)
 
-    ocr_text = extract_ocr_text(processed)
+    ocr_data = extract_ocr_data(processed)
+    ocr_text = ocr_text_from_data(ocr_data)
+    started = _record_stage(timings, "tesseract", started)
 
     if not ocr_text.strip():
         return {
@@ -156,7 +234,8 @@ def process_receipt_internal(image_path):
         }
 
     receipt_data = build_receipt_data(ocr_text)
-    quality = calculate_ocr_quality(processed, receipt_data["items"])
+    quality = calculate_ocr_quality(ocr_data, receipt_data["items"])
+    started = _record_stage(timings, "parse", started)
 
     warning = None
 
@@ -182,6 +261,7 @@ def process_receipt_internal(image_path):
         warning = "Some items may not be extracted correctly due to image quality."
 
     receipt_data = add_product_matches(receipt_data)
+    _record_stage(timings, "match", started)
 
     return {
         "success": True,
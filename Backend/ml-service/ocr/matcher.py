@@ -2,12 +2,19 @@ import re
 import csv
 import json
 import os
+import threading
 from difflib import SequenceMatcher
 
+import numpy as np
+
 
 MIN_MATCH_SCORE = 0.50
 MIN_TEXT_SCORE = 0.45
 
+# Products fully scored per receipt line; the rest of the catalogue is
+# ruled out by the trigram shortlist in ProductMatchIndex.
+SHORTLIST_SIZE = 50
+
 
 def normalize_text(text: str) -> str:
     if not text:
@@ -107,6 +114,115 @@ def similarity_score(a: str, b: str) -> float:
     return (seq * 0.45) + (token * 0.35) + (partial * 0.20)
 
 
+def _token_score_sets(a_set: set, b_set: set) -> float:
+    if not a_set or not b_set:
+        return 0.0
+    return len(a_set & b_set) / max(len(a_set), len(b_set))
+
+
+def _partial_token_score_lists(a_tokens: list, b_tokens: list) -> float:
+    if not a_tokens or not b_tokens:
+        return 0.0
+
+    matches = 0
+    for at in a_tokens:
+        for bt in b_tokens:
+            if at == bt or at in bt or bt in at:
+                matches += 1
+                break
+
+    return matches / max(len(a_tokens), len(b_tokens))
+
+
+def _trigrams(text: str) -> set:
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _Text:
+    """A normalised string with its tokens, computed once."""
+
+    __slots__ = ("norm", "tokens", "token_set")
+
+    def __init__(self, norm: str):
+        self.norm = norm
+        self.tokens = norm.split()
+        self.token_set = set(self.tokens)
+
+    def similarity(self, other: "_Text") -> float:
+        # Same weights as similarity_score, without re-normalising either side
+        seq = SequenceMatcher(None, self.norm, other.norm).ratio()
+        token = _token_score_sets(self.token_set, other.token_set)
+        partial = _partial_token_score_lists(self.tokens, other.tokens)
+        return (seq * 0.45) + (token * 0.35) + (partial * 0.20)
+
+
+class ProductMatchIndex:
+    """
+    Products prepared once for receipt matching.
+
+    Names (and brand + name) are normalised up front, and a trigram
+    inverted index shortlists the SHORTLIST_SIZE products sharing the most
+    character trigrams with a receipt line; only those get the full
+    similarity_score treatment. Catalogues no larger than the shortlist are
+    scored exhaustively, exactly like the old linear scan.
+    """
+
+    def __init__(self, products: list, shortlist_size: int = SHORTLIST_SIZE):
+        self.products = products
+        self.shortlist_size = shortlist_size
+        self._names = []
+        self._combined = []
+        postings = {}
+        gram_counts = np.zeros(len(products), dtype=np.float32)
+
+        for pos, product in enumerate(products):
+            product_name = product.get("name", "") or ""
+            brand = product.get("brand", "") or ""
+            name = _Text(normalize_text(product_name))
+            combined = _Text(normalize_text(f"{brand} {product_name}".strip()))
+            self._names.append(name)
+            self._combined.append(combined)
+
+            grams = _trigrams(name.norm) | _trigrams(combined.norm)
+            gram_counts[pos] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(pos)
+
+        self._postings = {
+            gram: np.asarray(ids, dtype=np.int32) for gram, ids in postings.items()
+        }
+        self._gram_counts = gram_counts
+
+    def __len__(self):
+        return len(self.products)
+
+    def shortlist(self, normalized_ocr: str) -> list:
+        """Positions of the likeliest products, in catalogue order."""
+        n = len(self.products)
+        if n <= self.shortlist_size:
+            return list(range(n))
+
+        ocr_grams = _trigrams(normalized_ocr)
+        grams = [self._postings[g] for g in ocr_grams if g in self._postings]
+        if not grams:
+            return []
+        shared = np.bincount(np.concatenate(grams), minlength=n).astype(np.float32)
+        # Dice coefficient, so long product names don't win on length alone
+        dice = 2 * shared / (self._gram_counts + len(ocr_grams))
+        top = np.argpartition(-dice, self.shortlist_size - 1)[:self.shortlist_size]
+        return sorted(int(pos) for pos in top if shared[pos] > 0)
+
+    def text_scores(self, normalized_ocr: str):
+        """(position, text score) for every shortlisted product."""
+        # similarity_score normalises its input again; keep that behaviour
+        ocr = _Text(normalize_text(normalized_ocr))
+        for pos in self.shortlist(normalized_ocr):
+            score_name = ocr.similarity(self._names[pos])
+            score_combined = ocr.similarity(self._combined[pos])
+            yield pos, max(score_name, score_combined)
+
+
 def get_confidence(score: float) -> str:
     if score >= 0.75:
         return "high"
@@ -185,6 +301,38 @@ def load_products_from_csv(csv_file: str):
     return products
 
 
+# csv path -> ((mtime_ns, size), ProductMatchIndex), shared by every request
+_CATALOGUES = {}
+_CATALOGUE_LOCK = threading.Lock()
+
+
+def get_product_index(csv_file: str) -> ProductMatchIndex:
+    """
+    Process-wide ProductMatchIndex for `csv_file`. The CSV is parsed and
+    normalised once, then again only when its mtime or size changes, so a
+    replaced catalogue is picked up without a restart.
+    """
+    try:
+        st = os.stat(csv_file)
+        version = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        version = None   # missing file — load_products_from_csv reports it
+
+    cached = _CATALOGUES.get(csv_file)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    with _CATALOGUE_LOCK:
+        cached = _CATALOGUES.get(csv_file)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        if cached is not None:
+            print(f"[MATCHER] Product CSV changed, reloading: {csv_file}")
+        index = ProductMatchIndex(load_products_from_csv(csv_file))
+        _CATALOGUES[csv_file] = (version, index)
+        return index
+
+
 def price_score(ocr_price, product_price):
     ocr_price = clean_price(ocr_price)
     product_price = clean_price(product_price)
@@ -204,7 +352,9 @@ def price_score(ocr_price, product_price):
     return 0.0
 
 
-def match_single_item(ocr_item: str, products: list, ocr_price=None, threshold: float = MIN_MATCH_SCORE):
+def match_single_item(ocr_item: str, products, ocr_price=None, threshold: float = MIN_MATCH_SCORE):
+    # products: a ProductMatchIndex, or a plain product list (indexed here)
+    index = products if isinstance(products, ProductMatchIndex) else ProductMatchIndex(products)
     normalized_ocr = normalize_text(ocr_item)
 
     best_match = None
@@ -212,18 +362,9 @@ def match_single_item(ocr_item: str, products: list, ocr_price=None, threshold:
     best_text_score = 0
     best_price_score = 0
 
-    for product in products:
-        product_name = product.get("name", "") or ""
-        brand = product.get("brand", "") or ""
-        product_price = product.get("price")
-
-        combined_text = f"{brand} {product_name}".strip()
-
-        score_name = similarity_score(normalized_ocr, product_name)
-        score_combined = similarity_score(normalized_ocr, combined_text)
-
-        text_score = max(score_name, score_combined)
-        p_score = price_score(ocr_price, product_price)
+    for pos, text_score in index.text_scores(normalized_ocr):
+        product = index.products[pos]
+        p_score = price_score(ocr_price, product.get("price"))
 
         final_score = (text_score * 0.85) + (p_score * 0.15)
 
@@ -264,9 +405,12 @@ def match_single_item(ocr_item: str, products: list, ocr_price=None, threshold:
     }
 
 
-def match_receipt_items(parsed_items: list, products: list, threshold: float = MIN_MATCH_SCORE):
+def match_receipt_items(parsed_items: list, products, threshold: float = MIN_MATCH_SCORE):
     results = []
 
+    if not isinstance(products, ProductMatchIndex):
+        products = ProductMatchIndex(products)
+
     print(f"[MATCHER] Matching {len(parsed_items)} receipt items against {len(products)} products")
 
     for item in parsed_items:
@@ -0,0 +1,262 @@
+"""
+Bounded process pool for receipt OCR.
+
+process_receipt_internal is CPU-bound (OpenCV preprocessing plus a
+Tesseract run), so calling it from the Flask request thread let a burst of
+uploads saturate the container and starve /health. Receipts are instead
+handed to a small pool of spawned worker processes:
+
+  - at most OCR_MAX_PENDING receipts are queued or running at once; past
+    that, submit() raises OCRQueueFull and the API answers 503 with a
+    Retry-After header instead of piling more work onto the box;
+  - each job records per-stage timings (queue, validate, preprocess,
+    tesseract, parse, match, total) in milliseconds;
+  - async jobs are kept for OCR_JOB_TTL_SECONDS after they finish so the
+    client can fetch the result by job id.
+
+Jobs live in this process's memory, so with several gunicorn workers a job
+id is only known to the worker that accepted the upload.
+
+A spawned process normally re-imports the parent's main script (as
+__mp_main__). Under `python app.py` that would load Secret Manager, torch
+and the RAG pipeline in every OCR worker, so workers are started with a
+bare __main__ instead (see _slim_main); they only import this package.
+"""
+
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import types
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from ocr.extractor import PRODUCT_CSV_PATH, process_receipt_internal
+from ocr.matcher import get_product_index
+
+
+OCR_WORKERS = max(1, int(os.getenv("OCR_WORKERS", "2")))
+# Receipts queued or running before new uploads are turned away with a 503
+OCR_MAX_PENDING = max(1, int(os.getenv("OCR_MAX_PENDING", str(OCR_WORKERS * 4))))
+# How long a finished async job (and its result) can still be fetched
+OCR_JOB_TTL_SECONDS = float(os.getenv("OCR_JOB_TTL_SECONDS", "900"))
+# How long a synchronous upload waits before it is turned into an async job
+OCR_SYNC_TIMEOUT_SECONDS = float(os.getenv("OCR_SYNC_TIMEOUT_SECONDS", "60"))
+OCR_RETRY_AFTER_SECONDS = int(os.getenv("OCR_RETRY_AFTER_SECONDS", "5"))
+
+
+class OCRQueueFull(RuntimeError):
+    def __init__(self, pending, retry_after):
+        super().__init__(f"Receipt OCR queue is full ({pending} receipts pending)")
+        self.pending = pending
+        self.retry_after = retry_after
+
+
+def _init_worker():
+    # One Tesseract thread per worker; the pool is the parallelism
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+    try:
+        get_product_index(PRODUCT_CSV_PATH)
+    except Exception as e:
+        print(f"[ocr] WARNING: could not preload product catalogue: {e}")
+
+
+def _run_receipt_job(image_bytes, submitted_at):
+    started = time.time()
+    timings = {"queue": round((started - submitted_at) * 1000, 1)}
+
+    try:
+        result = process_receipt_internal(image_bytes, timings=timings)
+    except Exception as e:
+        # Re-raise as a plain error: some library exceptions (e.g. pytesseract's)
+        # cannot be unpickled in the parent, which would break the whole pool
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+    timings["total"] = round((time.time() - submitted_at) * 1000, 1)
+    return result, timings
+
+
+@contextmanager
+def _slim_main():
+    # multiprocessing's spawn re-runs sys.modules["__main__"] (by path or
+    # module name) in every new worker. While workers are being started,
+    # show it an empty __main__ so the children skip that import.
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+class OCRJob:
+    def __init__(self):
+        self.job_id = uuid.uuid4().hex
+        self.future = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.result = None
+        self.timings = {}
+        self.error = None
+        # Set by ReceiptOCRPool._finish once result/timings/error are filled in
+        self.finished = threading.Event()
+
+    @property
+    def status(self):
+        if not self.finished.is_set():
+            return "running" if self.future.running() else "queued"
+        return "failed" if self.error else "done"
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "submitted_at": self.submitted_at,
+            "finished_at": self.finished_at,
+            "timings": self.timings,
+            "error": self.error,
+        }
+
+
+class ReceiptOCRPool:
+    def __init__(self, workers=OCR_WORKERS, max_pending=OCR_MAX_PENDING,
+                 job_ttl_seconds=OCR_JOB_TTL_SECONDS):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.job_ttl_seconds = job_ttl_seconds
+        self._executor = None
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _new_executor(self):
+        # spawn, like the embedding pool: the parent runs torch and Flask
+        # threads, which do not survive a fork cleanly
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+
+    def submit(self, image_bytes, keep=False):
+        """
+        Queue a receipt for OCR and return its OCRJob. keep=True stores the
+        job so it can be fetched with get() after it finishes.
+        Raises OCRQueueFull when OCR_MAX_PENDING receipts are already pending.
+        """
+        with self._lock:
+            self._prune_jobs()
+
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise OCRQueueFull(self._pending, OCR_RETRY_AFTER_SECONDS)
+
+            job = OCRJob()
+
+            if self._executor is None:
+                self._executor = self._new_executor()
+
+            # The executor spawns its workers lazily, inside submit()
+            with _slim_main():
+                try:
+                    job.future = self._executor.submit(_run_receipt_job, image_bytes,
+                                                       job.submitted_at)
+                except BrokenProcessPool:
+                    # A worker died (e.g. killed for memory); start a fresh pool
+                    print("[ocr] WARNING: worker pool broke — restarting it")
+                    self._executor.shutdown(wait=False)
+                    self._executor = self._new_executor()
+                    job.future = self._executor.submit(_run_receipt_job, image_bytes,
+                                                       job.submitted_at)
+
+            self._pending += 1
+
+            if keep:
+                self._jobs[job.job_id] = job
+
+        job.future.add_done_callback(lambda future: self._finish(job))
+        return job
+
+    def _finish(self, job):
+        try:
+            job.result, job.timings = job.future.result()
+        except Exception as e:
+            job.error = str(e) or type(e).__name__
+
+        job.finished_at = time.time()
+        job.finished.set()
+
+        with self._lock:
+            self._pending -= 1
+            if job.error:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+        stages = " ".join(f"{stage}={ms}ms" for stage, ms in job.timings.items())
+        outcome = f"failed: {job.error}" if job.error else stages
+        print(f"[ocr] job {job.job_id[:8]} {outcome}")
+
+    def wait(self, job, timeout=OCR_SYNC_TIMEOUT_SECONDS):
+        """
+        Block until `job` finishes; returns True if it did. A job that is
+        still running at the timeout is kept so it can be fetched later.
+        """
+        if job.finished.wait(timeout):
+            return True
+
+        with self._lock:
+            self._jobs[job.job_id] = job
+
+        return False
+
+    def get(self, job_id):
+        with self._lock:
+            self._prune_jobs()
+            return self._jobs.get(job_id)
+
+    def _prune_jobs(self):
+        # Called with the lock held
+        cutoff = time.time() - self.job_ttl_seconds
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "stored_jobs": len(self._jobs),
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_ocr_pool():
+    global _POOL
+
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ReceiptOCRPool()
+            print(f"[ocr] receipt OCR pool: {_POOL.workers} workers, "
+                  f"up to {_POOL.max_pending} pending receipts")
+
+        return _POOL
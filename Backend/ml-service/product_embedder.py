@@ -25,18 +25,39 @@ Output (next to recipe_index.npz):
           "row_count": M
         }
 
+    With --format npy the embeddings are written pre-normalised and
+    uncompressed (product_index.npy + product_index.meta.json) so the
+    RAG service can memory-map them instead of decompressing the npz.
+
+    With --incremental the previous index is reused: every product carries a
+    content hash of its description, and only descriptions whose hash is not
+    already in the index are re-embedded (removed rows simply drop out).
+    Reuse needs float32 vectors (the npz, or an npy built with --dtype
+    float32); a float16/int8 index is re-embedded in full.
+    Each output file is replaced atomically, metadata last.
+
+    With --stream the CSV is read in chunks and embeddings are written into
+    a preallocated npy memmap with a checkpoint after every chunk, so huge
+    catalogues fit in memory and an interrupted run resumes (always the npy
+    layout; see recipe_rag/streaming_embed.py).
+
 Usage (from Backend/ml-service/):
     python product_embedder.py
     python product_embedder.py --csv "../../Master_Data_2026_Onward/Master_table_for_embedding.csv"
     python product_embedder.py --barcode-col Barcode --id-col ProductId --desc-col Description
+    python product_embedder.py --format npy --dtype int8
+    python product_embedder.py --backend onnx-int8   # faster CPU embedding
+    python product_embedder.py --incremental         # only embed new/changed rows
+    python product_embedder.py --stream --workers 4  # chunked + resumable, npy layout
 """
 
 import argparse
+import hashlib
 import json
 import os
 import sys
 import time
-from typing import List
+from typing import Dict, Iterable, List
 
 import numpy as np
 import pandas as pd
@@ -44,6 +65,22 @@ import pandas as pd
 # Make recipe_rag importable when running this script directly
 sys.path.insert(0, os.path.dirname(__file__))
 
+from recipe_rag.encoding import EMBEDDING_BACKENDS, load_embedding_model, loaded_backend
+from recipe_rag.streaming_embed import (
+    DEFAULT_CHUNK_ROWS,
+    StreamingMatrixWriter,
+    embed_stream,
+    fingerprint_texts,
+)
+from recipe_rag.vector_index import (
+    atomic_output,
+    load_embedding_matrix,
+    normalize_rows,
+    read_matrix_meta,
+    save_embedding_matrix,
+    top_k_indices,
+)
+
 # Default output sits beside the recipe index
 INDEX_DIR = os.path.join(os.path.dirname(__file__), "recipe_rag", "index")
 EMBEDDING_MODEL_NAME = "all-mpnet-base-v2"
@@ -55,6 +92,95 @@ DEFAULT_CSV = os.path.join(
 )
 
 
+# ---------------------------------------------------------------------------
+# Incremental helpers
+# ---------------------------------------------------------------------------
+
+def content_hash(description: str) -> str:
+    """Stable key for a description's embedding (whitespace-insensitive)."""
+    text = " ".join(str(description).split())
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def hashes_digest(hashes: Iterable[str]) -> str:
+    """
+    Digest of the content hashes, in row order. Stored with the embedding
+    matrix so a reuse can prove the rows line up with product_metadata.json.
+    """
+    digest = hashlib.sha1()
+    for h in hashes:
+        digest.update(h.encode("ascii"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def load_previous_embeddings(index_dir: str, backend: str) -> Dict[str, np.ndarray]:
+    """
+    content hash -> embedding from the existing product index, or {} when
+    there is none or it was built with a different model/backend (its
+    vectors would not be comparable with freshly embedded ones). Only
+    float32 vectors are reused: float16/int8 rows come back dequantised,
+    so re-quantising them on every rebuild would let products drift.
+    """
+    meta_path = os.path.join(index_dir, "product_metadata.json")
+    if not os.path.exists(meta_path):
+        print("  No previous product_metadata.json — full embed")
+        return {}
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("embedding_model") != EMBEDDING_MODEL_NAME or \
+            meta.get("embedding_backend", "torch") != backend:
+        print(f"  Previous index used {meta.get('embedding_model')}/"
+              f"{meta.get('embedding_backend', 'torch')} — full embed")
+        return {}
+
+    # Same preference as RAG_INDEX_FORMAT=auto: the npy sidecar wins, so an
+    # npz left behind by an older build is never paired with new metadata.
+    npz_path = os.path.join(index_dir, "product_index.npz")
+    npy_meta = os.path.join(index_dir, "product_index.meta.json")
+    if os.path.exists(npy_meta):
+        matrix_meta = read_matrix_meta(npy_meta)
+        if matrix_meta["dtype"] != "float32":
+            print(f"  Previous embeddings are stored as {matrix_meta['dtype']} "
+                  f"(lossy) — full embed")
+            return {}
+        stored_digest = matrix_meta.get("content_hashes_sha1")
+        embeddings = load_embedding_matrix(npy_meta, mmap=True)
+    elif os.path.exists(npz_path):
+        with np.load(npz_path, allow_pickle=True) as data:
+            embeddings = data["embeddings"].astype(np.float32)
+            stored_digest = (str(data["content_hashes_sha1"])
+                             if "content_hashes_sha1" in data.files else None)
+    else:
+        print("  No previous product embeddings — full embed")
+        return {}
+
+    products = meta["products"]
+    hashes = [p.get("content_hash") or content_hash(p["description"]) for p in products]
+    if len(hashes) != embeddings.shape[0] or stored_digest != hashes_digest(hashes):
+        print("  Previous embeddings do not match product_metadata.json "
+              "(content hash check) — full embed")
+        return {}
+    return {h: embeddings[i] for i, h in enumerate(hashes)}
+
+
+def _encode(model, texts: List[str], batch_size: int) -> np.ndarray:
+    if not texts:
+        dim = model.get_sentence_embedding_dimension()
+        return np.empty((0, dim), dtype=np.float32)
+    return model.encode(
+        texts,
+        show_progress_bar=True,
+        batch_size=batch_size,
+        convert_to_numpy=True,
+    ).astype(np.float32)
+
+
+def _atomic_json_dump(path: str, payload: Dict) -> None:
+    with atomic_output(path, "w") as f:
+        json.dump(payload, f, ensure_ascii=False)
+
+
 # ---------------------------------------------------------------------------
 # Core function (importable / reusable)
 # ---------------------------------------------------------------------------
@@ -67,9 +193,17 @@ def embed_products(
     index_dir: str = INDEX_DIR,
     batch_size: int = 64,
     drop_duplicates: bool = True,
+    index_format: str = "npz",
+    dtype: str = "float32",
+    backend: str = "torch",
+    onnx_file: str = None,
+    incremental: bool = False,
 ):
     """
-    Load product CSV, embed descriptions, save .npz + .json.
+    Load product CSV, embed descriptions, save .npz (and/or the mmap-able
+    .npy layout, see index_format) + .json. With incremental=True only
+    descriptions missing from the existing index (by content hash) are
+    embedded.
 
     Returns the loaded DataFrame (with embeddings attached as `_emb` column
     NOT included — that would bloat memory; embeddings are saved separately).
@@ -112,52 +246,79 @@ def embed_products(
     product_ids: List[str] = df[id_col].fillna("").astype(str).tolist()
 
     # 2. Load embedding model
-    print(f"\n[2/4] Loading embedding model: {EMBEDDING_MODEL_NAME}")
-    from sentence_transformers import SentenceTransformer
-    model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    print(f"\n[2/4] Loading embedding model: {EMBEDDING_MODEL_NAME} ({backend})")
+    model = load_embedding_model(EMBEDDING_MODEL_NAME, backend, onnx_file, strict=True)
     print(f"  Embedding dim: {model.get_sentence_embedding_dimension()}")
 
-    # 3. Embed
-    print(f"\n[3/4] Embedding {len(descriptions):,} product descriptions"
+    # 3. Embed (only unseen content in incremental mode)
+    hashes = [content_hash(d) for d in descriptions]
+    previous: Dict[str, np.ndarray] = (
+        load_previous_embeddings(index_dir, backend) if incremental else {}
+    )
+    todo: Dict[str, str] = {}   # hash -> description still to embed
+    for h, d in zip(hashes, descriptions):
+        if h not in previous and h not in todo:
+            todo[h] = d
+    if incremental and previous:
+        current = set(hashes)
+        print(f"  Incremental: {len(hashes) - sum(h in todo for h in hashes):,} reused, "
+              f"{len(todo):,} new/changed, "
+              f"{sum(h not in current for h in previous):,} removed")
+
+    print(f"\n[3/4] Embedding {len(todo):,} product descriptions"
           f" (batch_size={batch_size})...")
     start = time.time()
-    embeddings = model.encode(
-        descriptions,
-        show_progress_bar=True,
-        batch_size=batch_size,
-        convert_to_numpy=True,
-    ).astype(np.float32)
+    fresh = _encode(model, list(todo.values()), batch_size)
     elapsed = time.time() - start
-    print(f"  Done in {elapsed:.1f}s "
-          f"({len(descriptions)/elapsed:.0f} products/sec)")
+    if todo:
+        print(f"  Done in {elapsed:.1f}s "
+              f"({len(todo)/max(elapsed, 1e-9):.0f} products/sec)")
+    vectors: Dict[str, np.ndarray] = dict(zip(todo.keys(), fresh))
+    embeddings = np.empty((len(hashes), fresh.shape[1]), dtype=np.float32)
+    for i, h in enumerate(hashes):
+        embeddings[i] = vectors[h] if h in vectors else previous[h]
     print(f"  Shape: {embeddings.shape}")
 
     # 4. Save
     print(f"\n[4/4] Saving index to {index_dir}/")
     os.makedirs(index_dir, exist_ok=True)
 
-    npz_path = os.path.join(index_dir, "product_index.npz")
-    np.savez_compressed(
-        npz_path,
-        embeddings=embeddings,
-        barcodes=np.array(barcodes, dtype=object),
-        product_ids=np.array(product_ids, dtype=object),
-    )
-    npz_mb = os.path.getsize(npz_path) / (1024 * 1024)
-    print(f"  Saved {npz_path} ({npz_mb:.1f} MB)")
-
+    if index_format in ("npz", "both"):
+        npz_path = os.path.join(index_dir, "product_index.npz")
+        with atomic_output(npz_path, suffix=".npz") as f:
+            np.savez_compressed(
+                f,
+                embeddings=embeddings,
+                barcodes=np.array(barcodes, dtype=object),
+                product_ids=np.array(product_ids, dtype=object),
+                content_hashes_sha1=np.array(hashes_digest(hashes)),
+            )
+        npz_mb = os.path.getsize(npz_path) / (1024 * 1024)
+        print(f"  Saved {npz_path} ({npz_mb:.1f} MB)")
+    if index_format in ("npy", "both"):
+        for path in save_embedding_matrix(index_dir, "product_index", embeddings, dtype,
+                                          extra={"content_hashes_sha1": hashes_digest(hashes)}):
+            print(f"  Saved {path} ({os.path.getsize(path) / (1024 * 1024):.1f} MB)")
+    else:
+        # "auto" loading prefers the npy sidecar — don't leave a stale one behind
+        stale_meta = os.path.join(index_dir, "product_index.meta.json")
+        if os.path.exists(stale_meta):
+            os.remove(stale_meta)
+            print(f"  Removed stale {stale_meta}")
+
+    # Metadata last: the service pairs it with the embeddings by row count
     meta_path = os.path.join(index_dir, "product_metadata.json")
     payload = {
         "products": [
-            {"barcode": b, "product_id": p, "description": d}
-            for b, p, d in zip(barcodes, product_ids, descriptions)
+            {"barcode": b, "product_id": p, "description": d, "content_hash": h}
+            for b, p, d, h in zip(barcodes, product_ids, descriptions, hashes)
         ],
         "source_file": os.path.basename(csv_path),
         "embedding_model": EMBEDDING_MODEL_NAME,
+        "embedding_backend": loaded_backend(model),
         "row_count": len(descriptions),
     }
-    with open(meta_path, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False)
+    _atomic_json_dump(meta_path, payload)
     meta_mb = os.path.getsize(meta_path) / (1024 * 1024)
     print(f"  Saved {meta_path} ({meta_mb:.1f} MB)")
 
@@ -169,32 +330,153 @@ def embed_products(
     return df
 
 
+def _iter_product_chunks(csv_path: str, barcode_col: str, id_col: str,
+                         desc_col: str, chunk_rows: int, drop_duplicates: bool):
+    """
+    (descriptions, barcodes, product_ids) per CSV chunk, filtered the same
+    way as embed_products. Deterministic, so the CSV can be replayed.
+    """
+    seen = set()
+    for df in pd.read_csv(csv_path, dtype=str, chunksize=chunk_rows):
+        missing = [c for c in (barcode_col, id_col, desc_col) if c not in df.columns]
+        if missing:
+            raise ValueError(
+                f"CSV is missing column(s) {missing}. "
+                f"Available columns: {list(df.columns)}"
+            )
+        df = df[df[desc_col].notna() & (df[desc_col].str.strip() != "")]
+        if drop_duplicates:
+            df = df[~df[desc_col].isin(seen)].drop_duplicates(subset=[desc_col], keep="first")
+            seen.update(df[desc_col])
+        yield (
+            df[desc_col].astype(str).str.strip().tolist(),
+            df[barcode_col].fillna("").astype(str).tolist(),
+            df[id_col].fillna("").astype(str).tolist(),
+        )
+
+
+def embed_products_streaming(
+    csv_path: str,
+    barcode_col: str = "Barcode",
+    id_col: str = "ProductId",
+    desc_col: str = "Description",
+    index_dir: str = INDEX_DIR,
+    batch_size: int = 64,
+    drop_duplicates: bool = True,
+    dtype: str = "float32",
+    backend: str = "torch",
+    onnx_file: str = None,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    workers: int = 1,
+) -> int:
+    """
+    Like embed_products, but reads the CSV `chunk_rows` at a time and writes
+    embeddings straight into the npy layout (see recipe_rag/streaming_embed),
+    checkpointing after every chunk so an interrupted run resumes. Memory
+    stays at one chunk of embeddings regardless of catalogue size.
+
+    Returns the number of products indexed.
+    """
+    print("=" * 70)
+    print("PRODUCT EMBEDDER (streaming)")
+    print("=" * 70)
+    print(f"CSV: {csv_path}")
+
+    if not os.path.exists(csv_path):
+        raise FileNotFoundError(f"CSV not found: {csv_path}")
+
+    def chunks():
+        return _iter_product_chunks(csv_path, barcode_col, id_col, desc_col,
+                                    chunk_rows, drop_duplicates)
+
+    # 1. Count + fingerprint the rows that will be embedded
+    rows, fingerprint = fingerprint_texts(d for descs, _, _ in chunks() for d in descs)
+    print(f"\n[1/4] {rows:,} products to embed ({chunk_rows:,} rows per chunk)")
+
+    print(f"\n[2/4] Loading embedding model: {EMBEDDING_MODEL_NAME} ({backend})")
+    model = load_embedding_model(EMBEDDING_MODEL_NAME, backend, onnx_file, strict=True)
+    dim = model.get_sentence_embedding_dimension()
+    print(f"  Embedding dim: {dim}")
+
+    model_spec = {"model_name": EMBEDDING_MODEL_NAME, "backend": backend,
+                  "onnx_file": onnx_file}
+    writer = StreamingMatrixWriter(index_dir, "product_index", rows, dim, dtype,
+                                   fingerprint=fingerprint, model_info=model_spec)
+
+    # 3. Embed; metadata is streamed to a temp file alongside, which only
+    # replaces product_metadata.json after the matrix is in place (step 4)
+    print(f"\n[3/4] Embedding (workers={workers}, batch_size={batch_size})...")
+    meta_path = os.path.join(index_dir, "product_metadata.json")
+    with atomic_output(meta_path, "w") as meta_file:
+        meta_file.write('{"products": [')
+        digest = hashlib.sha1()   # running hashes_digest of the rows
+
+        def descriptions_with_metadata():
+            first = True
+            for descriptions, barcodes, product_ids in chunks():
+                for b, p, d in zip(barcodes, product_ids, descriptions):
+                    h = content_hash(d)
+                    digest.update(h.encode("ascii") + b"\n")
+                    entry = {"barcode": b, "product_id": p, "description": d,
+                             "content_hash": h}
+                    meta_file.write(("" if first else ", ")
+                                    + json.dumps(entry, ensure_ascii=False))
+                    first = False
+                yield descriptions
+
+        embed_stream(descriptions_with_metadata(), writer, model=model,
+                     model_spec=model_spec, workers=workers, batch_size=batch_size)
+        tail = {
+            "source_file": os.path.basename(csv_path),
+            "embedding_model": EMBEDDING_MODEL_NAME,
+            "embedding_backend": loaded_backend(model),
+            "row_count": rows,
+        }
+        meta_file.write("], " + json.dumps(tail)[1:])
+
+        # 4. Matrix into place, then metadata (the service pairs them by row count)
+        print(f"\n[4/4] Saving index to {index_dir}/")
+        for path in writer.finalize({"content_hashes_sha1": digest.hexdigest()}):
+            print(f"  Saved {path} ({os.path.getsize(path) / (1024 * 1024):.1f} MB)")
+    print(f"  Saved {meta_path} ({os.path.getsize(meta_path) / (1024 * 1024):.1f} MB)")
+
+    print("\n" + "=" * 70)
+    print("BUILD COMPLETE")
+    print(f"  Products: {rows:,}")
+    print(f"  Index dir: {index_dir}")
+    print("=" * 70)
+    return rows
+
+
 # ---------------------------------------------------------------------------
 # Optional smoke test
 # ---------------------------------------------------------------------------
 
-def test_lookup(index_dir: str, query: str = "beef mince", top_k: int = 5):
+def test_lookup(index_dir: str, query: str = "beef mince", top_k: int = 5,
+                backend: str = "torch", onnx_file: str = None):
     """Verify the saved index loads + returns sensible matches."""
     print(f"\n--- Smoke test: '{query}' ---")
-    from sentence_transformers import SentenceTransformer
-
-    data = np.load(os.path.join(index_dir, "product_index.npz"), allow_pickle=True)
-    embeddings = data["embeddings"]
-    barcodes = data["barcodes"]
-    product_ids = data["product_ids"]
 
     with open(os.path.join(index_dir, "product_metadata.json"),
               "r", encoding="utf-8") as f:
         meta = json.load(f)
     products = meta["products"]
+    barcodes = [p["barcode"] for p in products]
+    product_ids = [p["product_id"] for p in products]
 
-    model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    npy_meta = os.path.join(index_dir, "product_index.meta.json")
+    if os.path.exists(npy_meta):
+        e_norm = load_embedding_matrix(npy_meta)
+    else:
+        data = np.load(os.path.join(index_dir, "product_index.npz"), allow_pickle=True)
+        e_norm = normalize_rows(data["embeddings"])
+
+    model = load_embedding_model(EMBEDDING_MODEL_NAME, backend, onnx_file, strict=True)
     q = model.encode([query], convert_to_numpy=True).astype(np.float32)
-    q_norm = q / (np.linalg.norm(q, axis=1, keepdims=True) + 1e-10)
-    e_norm = embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-10)
-    sims = (e_norm @ q_norm.T).flatten()
+    q_norm = normalize_rows(q)[0]
+    sims = e_norm @ q_norm
 
-    top = np.argsort(sims)[::-1][:top_k]
+    top = top_k_indices(sims, top_k)
     for rank, i in enumerate(top, 1):
         print(f"  #{rank} ({sims[i]:.3f}) "
               f"barcode={barcodes[i]} id={product_ids[i]} | "
@@ -216,20 +498,64 @@ if __name__ == "__main__":
     parser.add_argument("--batch-size", type=int, default=64)
     parser.add_argument("--no-dedupe", action="store_true",
                         help="Keep duplicate descriptions")
+    parser.add_argument("--format", choices=["npz", "npy", "both"], default="npz",
+                        help="Embedding layout: compressed npz, mmap-able npy, or both")
+    parser.add_argument("--dtype", choices=["float32", "float16", "int8"],
+                        default="float32",
+                        help="Storage dtype for the npy layout")
+    parser.add_argument("--backend", choices=EMBEDDING_BACKENDS, default="torch",
+                        help="Embedding inference backend (onnx/onnx-int8 need "
+                             "sentence-transformers[onnx])")
+    parser.add_argument("--onnx-file", default=None,
+                        help="ONNX file inside the model repo (default per backend)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Reuse embeddings of unchanged descriptions from the "
+                             "existing index (float32 indexes only; a float16/int8 "
+                             "index is re-embedded in full)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Chunked, resumable build straight into the npy layout")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS,
+                        help="CSV rows per chunk with --stream")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Encoder processes with --stream")
     parser.add_argument("--test", action="store_true",
                         help="Run a smoke lookup after building")
     parser.add_argument("--test-query", default="beef mince")
     args = parser.parse_args()
-
-    embed_products(
-        csv_path=args.csv,
-        barcode_col=args.barcode_col,
-        id_col=args.id_col,
-        desc_col=args.desc_col,
-        index_dir=args.index_dir,
-        batch_size=args.batch_size,
-        drop_duplicates=not args.no_dedupe,
-    )
+    if args.stream and args.incremental:
+        parser.error("--stream and --incremental cannot be combined")
+
+    if args.stream:
+        embed_products_streaming(
+            csv_path=args.csv,
+            barcode_col=args.barcode_col,
+            id_col=args.id_col,
+            desc_col=args.desc_col,
+            index_dir=args.index_dir,
+            batch_size=args.batch_size,
+            drop_duplicates=not args.no_dedupe,
+            dtype=args.dtype,
+            backend=args.backend,
+            onnx_file=args.onnx_file,
+            chunk_rows=args.chunk_rows,
+            workers=args.workers,
+        )
+    else:
+        embed_products(
+            csv_path=args.csv,
+            barcode_col=args.barcode_col,
+            id_col=args.id_col,
+            desc_col=args.desc_col,
+            index_dir=args.index_dir,
+            batch_size=args.batch_size,
+            drop_duplicates=not args.no_dedupe,
+            index_format=args.format,
+            dtype=args.dtype,
+            backend=args.backend,
+            onnx_file=args.onnx_file,
+            incremental=args.incremental,
+        )
 
     if args.test:
-        test_lookup(args.index_dir, args.test_query)
\ No newline at end of file
+        test_lookup(args.index_dir, args.test_query,
+                    backend=args.backend, onnx_file=args.onnx_file)
\ No newline at end of file
@@ -0,0 +1,336 @@
+"""
+Inverted-index BM25 for MongoProductResolver.
+
+rank_bm25.BM25Okapi.get_scores walks every document in Python for every
+query term. This index stores postings in CSR form (term -> doc ids) with
+the per-posting BM25 weight precomputed, so a query only touches the
+documents that contain at least one of its tokens:
+
+    score(d) = sum over query tokens t of weight[t, d]
+    weight[t, d] = idf(t) * tf * (k1 + 1) / (tf + k1 * (1 - b + b * |d| / avgdl))
+
+Scores, idf (including the epsilon floor for negative idf) and the k1/b/
+epsilon defaults match BM25Okapi. Equal scores rank the higher doc id
+first, as np.argsort(scores)[::-1] over BM25Okapi scores did (the old
+default quicksort did not pin the order of ties; a stable sort does).
+
+ProductBM25Index bundles the index with the product documents and their
+tokens, persists both to disk (product_bm25.npz + product_bm25.json), and
+can be patched with just the products that changed since its watermark —
+so a process start does not need a full products collection scan. It also
+keeps the product names sorted for local prefix lookups, which answer most
+case-insensitive `^term` regex queries (a collection scan each in Mongo)
+without touching the database.
+"""
+
+import bisect
+import json
+import os
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from .cache import MISSING, TTLCache, normalize_cache_text   # Flask package
+    from .vector_index import atomic_output, top_k_indices
+except ImportError:
+    from cache import MISSING, TTLCache, normalize_cache_text    # CLI direct run
+    from vector_index import atomic_output, top_k_indices
+
+
+class InvertedBM25:
+    """Okapi BM25 over a tokenised corpus, scored through postings lists."""
+
+    def __init__(self, corpus: List[List[str]], k1: float = 1.5, b: float = 0.75,
+                 epsilon: float = 0.25):
+        if not corpus:
+            raise ValueError("InvertedBM25 needs a non-empty corpus")
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.corpus_size = len(corpus)
+        # Ties a saved .npz to the .json written alongside it
+        self.snapshot_id = ""
+
+        vocab: Dict[str, int] = {}
+        term_ids: List[int] = []
+        doc_ids: List[int] = []
+        tfs: List[int] = []
+        doc_len = np.empty(self.corpus_size, dtype=np.float64)
+        for doc_id, tokens in enumerate(corpus):
+            doc_len[doc_id] = len(tokens)
+            for token, tf in Counter(tokens).items():
+                term_ids.append(vocab.setdefault(token, len(vocab)))
+                doc_ids.append(doc_id)
+                tfs.append(tf)
+
+        self.vocab = vocab
+        self.avgdl = float(doc_len.mean())
+
+        term_arr = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_arr, kind="stable")
+        self.postings_docs = np.asarray(doc_ids, dtype=np.int32)[order]
+        tf_arr = np.asarray(tfs, dtype=np.float64)[order]
+        doc_freq = np.bincount(term_arr, minlength=len(vocab))
+        self.offsets = np.concatenate([[0], np.cumsum(doc_freq)]).astype(np.int64)
+
+        # idf exactly as BM25Okapi: negative values are floored to
+        # epsilon * mean(idf) so very common terms still count a little.
+        idf = np.log(self.corpus_size - doc_freq + 0.5) - np.log(doc_freq + 0.5)
+        idf[idf < 0] = self.epsilon * idf.mean()
+        self.idf = idf
+
+        norm = k1 * (1 - b + b * doc_len / self.avgdl)
+        posting_terms = term_arr[order]
+        self.postings_weights = (
+            idf[posting_terms] * tf_arr * (k1 + 1)
+            / (tf_arr + norm[self.postings_docs])
+        )
+
+    def __len__(self) -> int:
+        return self.corpus_size
+
+    def score_postings(self, query_tokens: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        BM25 scores for every document containing a query token.
+        Returns (doc_ids ascending, scores); documents absent from the
+        result score 0. Repeated query tokens count once per occurrence,
+        as in BM25Okapi.
+        """
+        slices = []
+        for token in query_tokens:
+            term_id = self.vocab.get(token)
+            if term_id is not None:
+                slices.append(slice(self.offsets[term_id], self.offsets[term_id + 1]))
+        if not slices:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+        docs = np.concatenate([self.postings_docs[s] for s in slices])
+        weights = np.concatenate([self.postings_weights[s] for s in slices])
+        doc_ids, inverse = np.unique(docs, return_inverse=True)
+        return doc_ids, np.bincount(inverse, weights=weights)
+
+    @staticmethod
+    def best_first(doc_ids: np.ndarray, scores: np.ndarray,
+                   k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The `k` best positively scored (doc_ids, scores) from score_postings,
+        best-first. Ties go to the higher doc id, like argsort(scores)[::-1].
+        """
+        positive = scores > 0
+        # Reversed so top_k_indices' lower-index tie break means higher doc id
+        doc_ids, scores = doc_ids[positive][::-1], scores[positive][::-1]
+        best = top_k_indices(scores, k)
+        return doc_ids[best], scores[best]
+
+    def top_k(self, query_tokens: List[str], k: int) -> List[Tuple[int, float]]:
+        """Best `k` (doc_id, score) pairs with a positive score, best-first."""
+        doc_ids, scores = self.best_first(*self.score_postings(query_tokens), k)
+        return [(int(doc_id), float(score)) for doc_id, score in zip(doc_ids, scores)]
+
+    @staticmethod
+    def rank_of(doc_ids: np.ndarray, scores: np.ndarray, doc_id: int) -> Optional[int]:
+        """
+        1-based rank of `doc_id` among positively scored documents
+        (ties broken by higher doc id), or None if it did not score.
+        """
+        pos = int(np.searchsorted(doc_ids, doc_id))
+        if pos >= doc_ids.shape[0] or doc_ids[pos] != doc_id:
+            return None
+        score = scores[pos]
+        if score <= 0:
+            return None
+        ahead = np.count_nonzero(scores > score)
+        ahead += np.count_nonzero((scores == score) & (doc_ids > doc_id))
+        return int(ahead) + 1
+
+    # -- persistence --------------------------------------------------------
+
+    def save(self, path: str, snapshot_id: str = "") -> None:
+        terms = [""] * len(self.vocab)
+        for term, term_id in self.vocab.items():
+            terms[term_id] = term
+        with atomic_output(path, suffix=".npz") as f:
+            np.savez(
+                f,
+                params=np.array([self.k1, self.b, self.epsilon, self.avgdl]),
+                corpus_size=np.array(self.corpus_size, dtype=np.int64),
+                snapshot_id=np.array(snapshot_id, dtype=str),
+                terms=np.array(terms, dtype=str),
+                offsets=self.offsets,
+                idf=self.idf,
+                postings_docs=self.postings_docs,
+                postings_weights=self.postings_weights,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "InvertedBM25":
+        with np.load(path) as data:
+            index = cls.__new__(cls)
+            index.k1, index.b, index.epsilon, index.avgdl = (
+                float(v) for v in data["params"]
+            )
+            index.corpus_size = int(data["corpus_size"])
+            index.snapshot_id = str(data["snapshot_id"]) if "snapshot_id" in data.files else ""
+            index.vocab = {str(term): i for i, term in enumerate(data["terms"])}
+            index.offsets = data["offsets"]
+            index.idf = data["idf"]
+            index.postings_docs = data["postings_docs"]
+            index.postings_weights = data["postings_weights"]
+        return index
+
+
+# ---------------------------------------------------------------------------
+# Product index with persistence + incremental refresh
+# ---------------------------------------------------------------------------
+
+SNAPSHOT_FORMAT_VERSION = 2
+QUERY_CACHE_MAX = 2048
+QUERY_CACHE_TTL_SECONDS = 30 * 60
+BM25_SNAPSHOT_FILES = ["product_bm25.json", "product_bm25.npz"]
+
+
+def _json_safe_doc(doc: Dict) -> Dict:
+    """Product doc with ObjectIds (and other BSON scalars) as strings."""
+    safe = {}
+    for key, value in doc.items():
+        if value is None or isinstance(value, (str, int, float, bool)):
+            safe[key] = value
+        else:
+            safe[key] = str(value)
+    return safe
+
+
+class ProductBM25Index:
+    """
+    BM25 over product documents, immutable once built.
+
+    Updates produce a new instance (with_changes), so a resolver can swap
+    its reference atomically while request threads keep using the old one.
+    Per-query sparse scores are cached on the instance (bounded by
+    QUERY_CACHE_MAX / QUERY_CACHE_TTL_SECONDS) and die with it.
+    Normalised product names are kept sorted so find_by_name_prefix is a
+    binary search.
+    """
+
+    def __init__(self, docs: List[Dict], tokens: List[List[str]],
+                 watermark: Optional[datetime] = None,
+                 built_at: Optional[float] = None,
+                 bm25: Optional[InvertedBM25] = None):
+        if len(docs) != len(tokens):
+            raise ValueError(f"{len(docs)} docs but {len(tokens)} token lists")
+        self.docs = docs
+        self.tokens = tokens
+        self.bm25 = bm25 if bm25 is not None else InvertedBM25(tokens)
+        if self.bm25.corpus_size != len(docs):
+            raise ValueError("BM25 statistics do not match the document list")
+        self.pos_by_id = {str(doc["_id"]): pos for pos, doc in enumerate(docs)}
+        self.watermark = watermark
+        self.built_at = built_at if built_at is not None else time.time()
+        # query key -> (doc positions, scores) of every positively scored product
+        self.query_scores = TTLCache(QUERY_CACHE_MAX, QUERY_CACHE_TTL_SECONDS)
+        names = sorted(
+            (normalize_cache_text(doc.get("product_name")), pos)
+            for pos, doc in enumerate(docs)
+            if doc.get("product_name")
+        )
+        self._sorted_names = [name for name, _ in names]
+        self._sorted_name_pos = [pos for _, pos in names]
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def scores(self, query_tokens: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        query_key = " ".join(query_tokens)
+        cached = self.query_scores.get(query_key)
+        if cached is MISSING:
+            cached = self.bm25.score_postings(query_tokens)
+            self.query_scores.put(query_key, cached)
+        return cached
+
+    def find_by_name_prefix(self, prefix: str) -> Optional[Dict]:
+        """
+        Product whose normalised product_name starts with `prefix`
+        (case-insensitive), or None. With several matches the
+        alphabetically first (i.e. shortest common) name wins.
+        """
+        prefix = normalize_cache_text(prefix)
+        if not prefix:
+            return None
+        i = bisect.bisect_left(self._sorted_names, prefix)
+        if i < len(self._sorted_names) and self._sorted_names[i].startswith(prefix):
+            return self.docs[self._sorted_name_pos[i]]
+        return None
+
+    def with_changes(self,
+                     upserts: Iterable[Tuple[Dict, List[str]]],
+                     removed_ids: Iterable[str],
+                     watermark: Optional[datetime]) -> "ProductBM25Index":
+        """
+        New index with `upserts` (doc, tokens) added or replaced and
+        `removed_ids` dropped. Only the in-memory token lists are re-indexed.
+        """
+        by_id = {
+            str(doc["_id"]): (doc, tokens)
+            for doc, tokens in zip(self.docs, self.tokens)
+        }
+        for mongo_id in removed_ids:
+            by_id.pop(str(mongo_id), None)
+        for doc, tokens in upserts:
+            by_id[str(doc["_id"])] = (doc, tokens)
+        docs = [entry[0] for entry in by_id.values()]
+        tokens = [entry[1] for entry in by_id.values()]
+        return ProductBM25Index(docs, tokens, watermark=watermark or self.watermark)
+
+    # -- persistence --------------------------------------------------------
+
+    @staticmethod
+    def snapshot_paths(index_dir: str, stem: str = "product_bm25") -> Tuple[str, str]:
+        return (os.path.join(index_dir, f"{stem}.json"),
+                os.path.join(index_dir, f"{stem}.npz"))
+
+    def save(self, index_dir: str, stem: str = "product_bm25") -> None:
+        """
+        Write docs/tokens (.json) and BM25 statistics (.npz) atomically.
+
+        Every process runs its own refresher, so each save goes through
+        unique temp files, and both halves carry the same snapshot_id:
+        load() rejects a .json/.npz pair written by two different saves.
+        """
+        os.makedirs(index_dir, exist_ok=True)
+        json_path, npz_path = self.snapshot_paths(index_dir, stem)
+        snapshot_id = uuid.uuid4().hex
+        self.bm25.save(npz_path, snapshot_id)
+        payload = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "snapshot_id": snapshot_id,
+            "built_at": self.built_at,
+            "watermark": self.watermark.isoformat() if self.watermark else None,
+            "docs": [_json_safe_doc(doc) for doc in self.docs],
+            "tokens": self.tokens,
+        }
+        with atomic_output(json_path, suffix=".json") as f:
+            f.write(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+    @classmethod
+    def load(cls, index_dir: str, stem: str = "product_bm25") -> "ProductBM25Index":
+        """Load a snapshot; raises (OSError/ValueError/KeyError) if unusable."""
+        json_path, npz_path = cls.snapshot_paths(index_dir, stem)
+        with open(json_path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        if payload.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"unsupported BM25 snapshot version {payload.get('format_version')}")
+        bm25 = InvertedBM25.load(npz_path)
+        if bm25.snapshot_id != payload.get("snapshot_id"):
+            raise ValueError("BM25 snapshot .json and .npz come from different saves")
+        watermark = payload.get("watermark")
+        return cls(
+            payload["docs"],
+            payload["tokens"],
+            watermark=datetime.fromisoformat(watermark) if watermark else None,
+            built_at=payload.get("built_at"),
+            bm25=bm25,
+        )
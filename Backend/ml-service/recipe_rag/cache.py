@@ -0,0 +1,132 @@
+"""
+In-process caches for the recipe RAG service.
+
+TTLCache is the shared building block: a thread-safe LRU bounded both by
+entry count and by age, with hit/miss/eviction/expiration counters that
+are surfaced on /api/recipe/stats. It backs:
+
+  - EmbeddingCache: query/ingredient embeddings keyed by normalised text,
+    so the same sentence is only run through the transformer once,
+    whichever component (RecipeRetriever, ProductMatcher) asks first.
+  - ProductMatcher's ingredient -> product candidate cache.
+  - MongoProductResolver's description/ingredient lookups and the
+    per-query BM25 score cache.
+
+Expired entries are dropped lazily on lookup and opportunistically from
+the LRU end on insert, so no operation ever scans the whole cache.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+import numpy as np
+
+# Returned by TTLCache.get when a key is absent, so None can be cached as a
+# legitimate "looked up, nothing found" value.
+MISSING = object()
+
+
+def normalize_cache_text(text: str) -> str:
+    """Cache key for a sentence: lower-cased with whitespace collapsed."""
+    return " ".join(str(text or "").lower().split())
+
+
+class TTLCache:
+    """Bounded, TTL-aware LRU mapping with eviction metrics."""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 30 * 60):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0     # dropped to respect max_entries
+        self.expirations = 0   # dropped because they outlived ttl_seconds
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expired(self, created: float, now: float) -> bool:
+        return now - created > self.ttl_seconds
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[1], now):
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (value, now)
+            self._entries.move_to_end(key)
+            # Least recently used entries sit at the front; drop any that
+            # have expired, then trim to size.
+            while self._entries:
+                oldest_key, (_, created) = next(iter(self._entries.items()))
+                if not self._expired(created, now):
+                    break
+                del self._entries[oldest_key]
+                self.expirations += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def clear_prefix(self, prefix: str) -> int:
+        """Drop every string key starting with `prefix`; returns how many."""
+        with self._lock:
+            stale = [key for key in self._entries
+                     if isinstance(key, str) and key.startswith(prefix)]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class EmbeddingCache(TTLCache):
+    """TTLCache of normalised text -> read-only float32 embedding vector."""
+
+    def __init__(self, max_entries: int = 4096, ttl_seconds: float = 3600):
+        super().__init__(max_entries, ttl_seconds)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return super().get(key, default)
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        vector = np.asarray(vector, dtype=np.float32)
+        vector.setflags(write=False)   # shared between callers — keep it immutable
+        super().put(key, vector)
@@ -0,0 +1,363 @@
+"""
+Sentence encoders used by the recipe RAG pipeline.
+
+Encoders wrap a SentenceTransformer (or anything with the same `encode`
+signature) and are chained:
+
+    model -> BatchingEncoder -> CachedEncoder
+
+CachedEncoder memoises per-sentence embeddings in an EmbeddingCache.
+RecipeRetriever and ProductMatcher both receive the same CachedEncoder, so
+a chat turn that searches recipes and then looks up products for the same
+user query only runs the transformer once.
+
+BatchingEncoder coalesces cache misses from concurrent requests: sentences
+arriving within `max_wait_ms` of each other are encoded in one batch (up
+to `max_batch`), which uses the CPU matrix kernels far better than many
+single-sentence calls.
+
+load_embedding_model builds the model itself, on PyTorch or on ONNX
+Runtime (fp32 or dynamically int8-quantised) — same `encode` interface.
+The ONNX backends need the optional extra, which requirements.txt leaves
+commented out:
+
+    pip install "sentence-transformers[onnx]==5.2.2"
+
+Then run this module to check an ONNX backend against PyTorch (the same
+check runs in tests/test_encoding_parity.py):
+
+    python recipe_rag/encoding.py --backend onnx-int8
+"""
+
+import argparse
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+try:
+    from .cache import EmbeddingCache, normalize_cache_text   # Flask package
+except ImportError:
+    from cache import EmbeddingCache, normalize_cache_text    # CLI direct run
+
+# EMBEDDING_BACKEND values. The ONNX files ship in the sentence-transformers
+# hub repos (all-mpnet-base-v2 has onnx/model.onnx plus quantised variants);
+# quint8_avx2 is the int8 export that runs on any x86-64 Cloud Run CPU.
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+DEFAULT_ONNX_FILES = {
+    "onnx": "onnx/model.onnx",
+    "onnx-int8": "onnx/model_quint8_avx2.onnx",
+}
+# Lowest per-sentence cosine to PyTorch an ONNX backend may show
+MIN_PARITY_COSINE = {
+    "onnx": 0.999,
+    "onnx-int8": 0.98,
+}
+
+
+def load_embedding_model(model_name: str, backend: str = "torch",
+                         onnx_file: Optional[str] = None, strict: bool = False):
+    """
+    SentenceTransformer for `model_name` on the requested backend.
+    ONNX backends need `pip install sentence-transformers[onnx]`; if the
+    ONNX model cannot be loaded this warns and falls back to PyTorch, or
+    raises RuntimeError when `strict` (index builders, the parity check).
+    The backend actually loaded is recorded on the model; see loaded_backend.
+    """
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError as e:
+        raise RuntimeError("sentence-transformers not installed") from e
+
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"unknown embedding backend '{backend}' "
+                         f"(expected one of {EMBEDDING_BACKENDS})")
+    if backend == "torch":
+        return _with_backend(SentenceTransformer(model_name), "torch")
+
+    file_name = onnx_file or DEFAULT_ONNX_FILES[backend]
+    try:
+        model = SentenceTransformer(model_name, backend="onnx",
+                                    model_kwargs={"file_name": file_name})
+        print(f"[encoding] {model_name} on ONNX Runtime ({file_name})")
+        return _with_backend(model, backend)
+    except Exception as e:
+        if strict:
+            raise RuntimeError(f"ONNX backend unavailable ({file_name}): {e}") from e
+        print(f"[encoding] WARNING: ONNX backend unavailable ({file_name}): {e} "
+              f"— falling back to PyTorch")
+        return _with_backend(SentenceTransformer(model_name), "torch")
+
+
+def _with_backend(model, backend: str):
+    model.embedding_backend = backend
+    return model
+
+
+def loaded_backend(model) -> str:
+    """Backend a load_embedding_model model actually runs on."""
+    return getattr(model, "embedding_backend", "torch")
+
+
+class CachedEncoder:
+    """
+    Drop-in replacement for `model.encode(...)` backed by an EmbeddingCache.
+
+    Sentences are keyed (and encoded) in normalised form — lower-cased with
+    whitespace collapsed. all-mpnet-base-v2 lower-cases its input anyway,
+    so this does not change the resulting vectors.
+    Any other attribute is delegated to the wrapped model.
+    """
+
+    def __init__(self, model, cache: EmbeddingCache):
+        self.model = model
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def encode(self, sentences: Union[str, List[str]], convert_to_numpy: bool = True,
+               **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        keys = [normalize_cache_text(s) for s in ([sentences] if single else sentences)]
+        vectors: List = [None] * len(keys)
+
+        missing = {}   # key -> positions waiting for it (dedupes within a batch)
+        for pos, key in enumerate(keys):
+            cached = self.cache.get(key)
+            if cached is None:
+                missing.setdefault(key, []).append(pos)
+            else:
+                vectors[pos] = cached
+
+        if missing:
+            miss_keys = list(missing)
+            encoded = self.model.encode(miss_keys, convert_to_numpy=True, **kwargs)
+            for key, vector in zip(miss_keys, encoded):
+                self.cache.put(key, vector)
+                for pos in missing[key]:
+                    vectors[pos] = vector
+
+        if not vectors:
+            return np.empty((0, 0), dtype=np.float32)
+        result = np.stack(vectors).astype(np.float32, copy=False)
+        return result[0] if single else result
+
+
+class BatchingEncoder:
+    """
+    Coalesces concurrent `encode` calls into shared model batches.
+
+    A single daemon worker takes the first waiting request, keeps
+    collecting requests for up to `max_wait_ms` (or until `max_batch`
+    sentences are queued), runs one `model.encode` and fans the rows back
+    out to the callers. Calls with extra encode options, or that are
+    already a full batch on their own, go straight to the model.
+    Any other attribute is delegated to the wrapped model.
+
+    Every queued request is always completed (result or exception) and the
+    worker survives any failure; callers still give up after
+    `timeout_seconds` rather than wait on it forever.
+    """
+
+    def __init__(self, model, max_batch: int = 32, max_wait_ms: float = 5.0,
+                 timeout_seconds: float = 60.0):
+        self.model = model
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.timeout_seconds = timeout_seconds
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._sentences = 0
+        self._batches = 0
+        self._direct_calls = 0
+        self._encode_seconds = 0.0
+        self._max_batch_seen = 0
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._start_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def encode(self, sentences: Union[str, List[str]], convert_to_numpy: bool = True,
+               **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        batch = [sentences] if single else list(sentences)
+        if kwargs or not convert_to_numpy or not batch or len(batch) >= self.max_batch:
+            with self._stats_lock:
+                self._direct_calls += 1
+            return self.model.encode(sentences, convert_to_numpy=convert_to_numpy, **kwargs)
+
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((batch, future))
+        # Raises concurrent.futures.TimeoutError if the batch never completes
+        result = future.result(timeout=self.timeout_seconds)
+        return result[0] if single else result
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            try:
+                size = len(pending[0][0])
+                deadline = time.monotonic() + self.max_wait
+                while size < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    pending.append(item)
+                    size += len(item[0])
+                self._encode_batch(pending)
+            except Exception as e:
+                # Never let one bad batch kill the only worker: fail whatever
+                # is still outstanding and keep serving the queue.
+                print(f"[encoding] batch failed: {e}")
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _encode_batch(self, pending: List[tuple]):
+        sentences = [s for batch, _ in pending for s in batch]
+        started = time.monotonic()
+        vectors = np.asarray(self.model.encode(sentences, convert_to_numpy=True))
+        elapsed = time.monotonic() - started
+        if vectors.shape[0] != len(sentences):
+            raise ValueError(f"model returned {vectors.shape[0]} rows "
+                             f"for {len(sentences)} sentences")
+
+        offset = 0
+        for batch, future in pending:
+            future.set_result(vectors[offset:offset + len(batch)])
+            offset += len(batch)
+
+        with self._stats_lock:
+            self._requests += len(pending)
+            self._sentences += len(sentences)
+            self._batches += 1
+            self._encode_seconds += elapsed
+            self._max_batch_seen = max(self._max_batch_seen, len(sentences))
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": round(self.max_wait * 1000, 2),
+                "requests": self._requests,
+                "sentences": self._sentences,
+                "batches": self._batches,
+                "direct_calls": self._direct_calls,
+                "mean_batch_size": (round(self._sentences / self._batches, 2)
+                                    if self._batches else 0.0),
+                "largest_batch": self._max_batch_seen,
+                "sentences_per_second": (round(self._sentences / self._encode_seconds, 1)
+                                         if self._encode_seconds else 0.0),
+                "queued": self._queue.qsize(),
+            }
+
+
+# ---------------------------------------------------------------------------
+# ONNX parity check (CLI)
+# ---------------------------------------------------------------------------
+
+PARITY_SENTENCES = [
+    "quick chicken dinner for family",
+    "vegetarian pasta with spinach and ricotta",
+    "what can I make with beef mince?",
+    "gluten free chocolate brownies",
+    "400g chicken breasts, diced",
+    "2 tbsp extra virgin olive oil",
+    "1 brown onion, finely chopped",
+    "Coles RSPCA Approved Chicken Breast Fillets | approx. 1kg",
+    "Woolworths Beef Mince 3 Star 500g",
+    "Barilla Spaghetti No.5 500g",
+    "Macro Organic Baby Spinach 120g",
+    "Bulla Thickened Cream 300ml",
+]
+
+
+def parity_report(reference, candidate, sentences: List[str], top_k: int = 3) -> Dict:
+    """
+    Compare two encoders on `sentences`: per-sentence cosine between the
+    two embeddings, top-k neighbour agreement within the sample, and
+    encode latency of each.
+    """
+    def timed(model):
+        started = time.perf_counter()
+        vectors = np.asarray(model.encode(sentences, convert_to_numpy=True),
+                             dtype=np.float32)
+        return vectors, time.perf_counter() - started
+
+    timed(candidate)   # warm-up (ONNX session / torch kernels)
+    ref, ref_seconds = timed(reference)
+    cand, cand_seconds = timed(candidate)
+
+    ref_n = ref / np.linalg.norm(ref, axis=1, keepdims=True)
+    cand_n = cand / np.linalg.norm(cand, axis=1, keepdims=True)
+    cosines = np.sum(ref_n * cand_n, axis=1)
+
+    k = min(top_k, len(sentences) - 1)
+    ref_top = np.argsort(-(ref_n @ ref_n.T), axis=1)[:, 1:k + 1]
+    cand_top = np.argsort(-(cand_n @ cand_n.T), axis=1)[:, 1:k + 1]
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_top, cand_top)]) if k else 1.0
+
+    return {
+        "sentences": len(sentences),
+        "cosine_min": round(float(cosines.min()), 5),
+        "cosine_mean": round(float(cosines.mean()), 5),
+        f"top{k}_neighbour_agreement": round(float(overlap), 4),
+        "reference_ms_per_sentence": round(1000 * ref_seconds / len(sentences), 2),
+        "candidate_ms_per_sentence": round(1000 * cand_seconds / len(sentences), 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check an ONNX embedding backend against PyTorch")
+    parser.add_argument("--model", default="all-mpnet-base-v2")
+    parser.add_argument("--backend", choices=EMBEDDING_BACKENDS[1:], default="onnx-int8")
+    parser.add_argument("--onnx-file", default=None,
+                        help="ONNX file inside the model repo (default per backend)")
+    parser.add_argument("--sentences-file", default=None,
+                        help="Optional text file, one sentence per line")
+    parser.add_argument("--min-cosine", type=float, default=None,
+                        help="Fail below this cosine (default per backend: "
+                             + ", ".join(f"{v} {k}" for k, v in MIN_PARITY_COSINE.items()) + ")")
+    args = parser.parse_args()
+
+    sentences = PARITY_SENTENCES
+    if args.sentences_file:
+        with open(args.sentences_file, "r", encoding="utf-8") as f:
+            sentences = [line.strip() for line in f if line.strip()]
+
+    reference = load_embedding_model(args.model, "torch")
+    # strict: a silent PyTorch fallback would compare PyTorch with itself
+    candidate = load_embedding_model(args.model, args.backend, args.onnx_file, strict=True)
+    report = parity_report(reference, candidate, sentences)
+    for key, value in report.items():
+        print(f"  {key}: {value}")
+
+    min_cosine = args.min_cosine
+    if min_cosine is None:
+        min_cosine = MIN_PARITY_COSINE[args.backend]
+    if report["cosine_min"] < min_cosine:
+        print(f"FAIL: cosine_min {report['cosine_min']} < {min_cosine}")
+        sys.exit(1)
+    print("OK")
@@ -20,6 +20,8 @@ Required env vars (already set in Backend/.env):
 from __future__ import annotations
 
 import os
+import threading
+import uuid
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import Optional
@@ -51,6 +53,26 @@ INDEX_FILES = [
     "product_metadata.json",
 ]
 
+# Same artefacts in the memory-mapped npy layout (RAG_INDEX_FORMAT=npy).
+# int8 builds also write <stem>.scales.npy; the loader fetches whatever the
+# .meta.json sidecar lists.
+NPY_INDEX_FILES = [
+    "recipe_index.meta.json",
+    "recipe_index.npy",
+    "recipe_metadata.json",
+    "product_index.meta.json",
+    "product_index.npy",
+    "product_metadata.json",
+]
+
+# Artefacts the pipeline can run without (it falls back to a slower path).
+# ensure_all_indexes fetches these best-effort and never fails on them.
+OPTIONAL_INDEX_FILES = [
+    "recipe_ann.npz",
+    "product_bm25.json",
+    "product_bm25.npz",
+]
+
 RAG_BUCKET_NAME = os.environ.get("RAG_BUCKET_NAME", "discountmate-ml-models")
 RAG_OBJECT_PREFIX = os.environ.get("RAG_OBJECT_PREFIX", "recipe_rag/")
 RAG_GCP_PROJECT = os.environ.get("GOOGLE_CLOUD_PROJECT")
@@ -74,12 +96,43 @@ def _resolve_local_index_dir() -> Path:
     return Path(__file__).resolve().parent / "index"
 
 
+_BUCKET = None
+_BUCKET_LOCK = threading.Lock()
+
+
+def _get_bucket():
+    """
+    The RAG bucket handle, authenticated once per process.
+
+    The StorageClient (and its pooled, keep-alive HTTP session) is shared by
+    every download, including the parallel ones in ensure_all_indexes, so
+    credentials are resolved and TLS is negotiated once rather than per file.
+    A failed attempt is not cached, so the next download retries auth.
+    """
+    global _BUCKET
+    if _BUCKET is not None:
+        return _BUCKET
+    with _BUCKET_LOCK:
+        if _BUCKET is None:
+            # Lazy imports — only blow up if we actually need to download
+            import google.auth
+            from google.cloud.storage import Client as StorageClient
+
+            auth_kwargs = {"scopes": ["https://www.googleapis.com/auth/devstorage.read_only"]}
+            if not _is_gcp_serverless() and RAG_GCP_PROJECT:
+                auth_kwargs["quota_project_id"] = RAG_GCP_PROJECT
+
+            credentials, detected_project = google.auth.default(**auth_kwargs)
+            client = StorageClient(
+                project=RAG_GCP_PROJECT or detected_project,
+                credentials=credentials,
+            )
+            _BUCKET = client.bucket(RAG_BUCKET_NAME)
+    return _BUCKET
+
+
 def _download_one(blob_name: str, dest_path: Path) -> None:
     """Download a single object from GCS to dest_path (atomic via temp file)."""
-    # Lazy imports — only blow up if we actually need to download
-    import google.auth
-    from google.cloud.storage import Client as StorageClient
-
     if not RAG_GCP_PROJECT and not _is_gcp_serverless():
         raise RuntimeError(
             "GOOGLE_CLOUD_PROJECT is not set. Add it to your .env, then run:\n"
@@ -87,20 +140,12 @@ def _download_one(blob_name: str, dest_path: Path) -> None:
         )
 
     dest_path.parent.mkdir(parents=True, exist_ok=True)
-    temp_path = dest_path.with_name(f".{dest_path.name}.download")
+    # Unique per call: warm start can fetch the same optional file from two
+    # threads (ensure_all_indexes and the Mongo resolver's BM25 snapshot).
+    temp_path = dest_path.with_name(f".{dest_path.name}.{uuid.uuid4().hex}.download")
 
     try:
-        auth_kwargs = {"scopes": ["https://www.googleapis.com/auth/devstorage.read_only"]}
-        if not _is_gcp_serverless() and RAG_GCP_PROJECT:
-            auth_kwargs["quota_project_id"] = RAG_GCP_PROJECT
-
-        credentials, detected_project = google.auth.default(**auth_kwargs)
-        client = StorageClient(
-            project=RAG_GCP_PROJECT or detected_project,
-            credentials=credentials,
-        )
-        bucket = client.bucket(RAG_BUCKET_NAME)
-        blob = bucket.blob(blob_name)
+        blob = _get_bucket().blob(blob_name)
         print(f"[gcs_loader] downloading "
               f"gs://{RAG_BUCKET_NAME}/{blob_name} -> {dest_path}")
         blob.download_to_filename(str(temp_path))
@@ -144,24 +189,37 @@ def ensure_index_file(filename: str,
     return str(local_path)
 
 
-def ensure_all_indexes(index_dir: Optional[str] = None) -> None:
-    """Ensure every file in INDEX_FILES is present locally, downloading in parallel."""
+def ensure_all_indexes(index_dir: Optional[str] = None,
+                       index_format: str = "npz") -> None:
+    """
+    Ensure every file in INDEX_FILES (NPY_INDEX_FILES when index_format is
+    "npy") is present locally, downloading in parallel.
+    Files in OPTIONAL_INDEX_FILES are fetched best-effort afterwards.
+    """
     target_dir = Path(index_dir) if index_dir else _resolve_local_index_dir()
-    missing = [f for f in INDEX_FILES if not (target_dir / f).exists()]
-    if not missing:
-        return
-    print(f"[gcs_loader] {len(missing)} file(s) missing locally, "
-          f"fetching from GCS in parallel: {missing}")
-    with ThreadPoolExecutor(max_workers=min(len(missing), 4)) as executor:
-        futures = {
-            executor.submit(ensure_index_file, f, str(target_dir)): f
-            for f in missing
-        }
-        for future in as_completed(futures):
-            filename = futures[future]
-            try:
-                future.result()
-            except RuntimeError as exc:
-                raise RuntimeError(
-                    f"Failed to download {filename}: {exc}"
-                ) from exc
+    required = NPY_INDEX_FILES if index_format == "npy" else INDEX_FILES
+    missing = [f for f in required if not (target_dir / f).exists()]
+    if missing:
+        print(f"[gcs_loader] {len(missing)} file(s) missing locally, "
+              f"fetching from GCS in parallel: {missing}")
+        with ThreadPoolExecutor(max_workers=min(len(missing), 4)) as executor:
+            futures = {
+                executor.submit(ensure_index_file, f, str(target_dir)): f
+                for f in missing
+            }
+            for future in as_completed(futures):
+                filename = futures[future]
+                try:
+                    future.result()
+                except RuntimeError as exc:
+                    raise RuntimeError(
+                        f"Failed to download {filename}: {exc}"
+                    ) from exc
+
+    for filename in OPTIONAL_INDEX_FILES:
+        if (target_dir / filename).exists():
+            continue
+        try:
+            ensure_index_file(filename, str(target_dir))
+        except RuntimeError as exc:
+            print(f"[gcs_loader] optional {filename} unavailable: {exc}")
@@ -0,0 +1,118 @@
+"""
+Per-model health tracking for the LLM cascade.
+
+CircuitBreaker remembers models that answered 429 (rate limited) or 503
+(overloaded / cold) and keeps them out of the cascade for a cool-down
+window — honouring a numeric Retry-After header when the provider sends
+one — so a chat turn does not spend its budget on a model that is known
+to be refusing requests.
+
+ModelHealth records every attempt: outcome counts plus a fixed-bucket
+latency histogram per model, exported on /api/recipe/stats to tune the
+model order in OPENROUTER_MODELS / HF_MODELS.
+"""
+
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket
+# is open-ended.
+LATENCY_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 45.0)
+
+# Status codes that trip the breaker
+CIRCUIT_STATUSES = (429, 503)
+
+
+class CircuitBreaker:
+    """Model name -> monotonic time until which the model is skipped."""
+
+    def __init__(self, cooldown_seconds: float = 60.0, max_cooldown_seconds: float = 600.0):
+        self.cooldown_seconds = cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+        self._open_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def is_open(self, model: str) -> bool:
+        with self._lock:
+            until = self._open_until.get(model)
+            if until is None:
+                return False
+            if time.monotonic() >= until:
+                del self._open_until[model]
+                return False
+            return True
+
+    def trip(self, model: str, retry_after: Optional[str] = None) -> float:
+        """Open the circuit for `model`; returns the cool-down applied."""
+        cooldown = self.cooldown_seconds
+        try:
+            if retry_after is not None:
+                cooldown = min(max(float(retry_after), 1.0), self.max_cooldown_seconds)
+        except (TypeError, ValueError):
+            pass   # HTTP-date form — keep the default cool-down
+        with self._lock:
+            self._open_until[model] = time.monotonic() + cooldown
+        return cooldown
+
+    def reset(self, model: str) -> None:
+        with self._lock:
+            self._open_until.pop(model, None)
+
+    def snapshot(self) -> Dict[str, float]:
+        """Open circuits with their remaining cool-down in seconds."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                model: round(until - now, 1)
+                for model, until in self._open_until.items()
+                if until > now
+            }
+
+
+class ModelHealth:
+    """Thread-safe per-model outcome counters and latency histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[str, Dict] = {}
+
+    def record(self, model: str, outcome: str, latency: float) -> None:
+        """
+        `outcome` is "success", "empty", "error" (transport/parse failure)
+        or "http_<status>".
+        """
+        bucket = next(
+            (f"<={bound:g}s" for bound in LATENCY_BUCKETS if latency <= bound),
+            f">{LATENCY_BUCKETS[-1]:g}s",
+        )
+        with self._lock:
+            entry = self._models.setdefault(model, {
+                "outcomes": Counter(),
+                "latency": Counter(),
+                "latency_total": 0.0,
+            })
+            entry["outcomes"][outcome] += 1
+            entry["latency"][bucket] += 1
+            entry["latency_total"] += latency
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            result = {}
+            for model, entry in self._models.items():
+                attempts = sum(entry["outcomes"].values())
+                successes = entry["outcomes"].get("success", 0)
+                result[model] = {
+                    "attempts": attempts,
+                    "successes": successes,
+                    "success_rate": round(successes / attempts, 4) if attempts else 0.0,
+                    "outcomes": dict(entry["outcomes"]),
+                    "mean_latency_s": round(entry["latency_total"] / attempts, 3) if attempts else 0.0,
+                    "latency_histogram": {
+                        label: entry["latency"].get(label, 0)
+                        for label in [f"<={b:g}s" for b in LATENCY_BUCKETS]
+                        + [f">{LATENCY_BUCKETS[-1]:g}s"]
+                    },
+                }
+            return result
@@ -12,15 +12,21 @@ images always come from MongoDB so the LLM never hallucinates products.
 
 import json
 import os
+import queue
 import re
+import threading
 import time
 import uuid
-from typing import Dict, List, Optional
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import numpy as np
 import requests
 from dotenv import load_dotenv
-from rank_bm25 import BM25Okapi
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 try:
     from sentence_transformers import SentenceTransformer
@@ -30,9 +36,27 @@ except ImportError:
           "Run: pip install sentence-transformers")
 
 try:
-    from .gcs_loader import ensure_index_file   # Flask package
+    from .bm25_index import BM25_SNAPSHOT_FILES, InvertedBM25, ProductBM25Index
+    from .cache import MISSING, EmbeddingCache, TTLCache
+    from .encoding import BatchingEncoder, CachedEncoder, load_embedding_model
+    from .gcs_loader import ensure_all_indexes, ensure_index_file   # Flask package
+    from .llm_health import CIRCUIT_STATUSES, CircuitBreaker, ModelHealth
+    from .state_store import StateStore, make_state_store
+    from .vector_index import (
+        EmbeddingMatrix, ExactIndex, compact_embeddings, load_embedding_matrix,
+        load_ivf, normalize_rows, read_matrix_meta, top_k_indices,
+    )
 except ImportError:
-    from gcs_loader import ensure_index_file    # CLI direct run
+    from bm25_index import BM25_SNAPSHOT_FILES, InvertedBM25, ProductBM25Index
+    from cache import MISSING, EmbeddingCache, TTLCache
+    from encoding import BatchingEncoder, CachedEncoder, load_embedding_model
+    from gcs_loader import ensure_all_indexes, ensure_index_file    # CLI direct run
+    from llm_health import CIRCUIT_STATUSES, CircuitBreaker, ModelHealth
+    from state_store import StateStore, make_state_store
+    from vector_index import (
+        EmbeddingMatrix, ExactIndex, compact_embeddings, load_embedding_matrix,
+        load_ivf, normalize_rows, read_matrix_meta, top_k_indices,
+    )
 
 # ---------------------------------------------------------------------------
 # Configuration
@@ -104,10 +128,103 @@ HF_MODELS = [
     "meta-llama/Llama-3.1-8B-Instruct",
 ]
 
+# LLM cascade: how many models to call concurrently per wave (1 = strictly
+# sequential, the default; hedging is opt-in because every extra model in a
+# wave spends free-tier quota), and how long a model that answered 429/503
+# is skipped for when it sends no Retry-After header.
+LLM_HEDGE_WIDTH = int(os.getenv("LLM_HEDGE_WIDTH", "1"))
+LLM_CIRCUIT_COOLDOWN_SECONDS = int(os.getenv("LLM_CIRCUIT_COOLDOWN_SECONDS", "60"))
+# Keep-alive connections kept per provider host by LLMClient's session
+LLM_HTTP_POOL_SIZE = int(os.getenv("LLM_HTTP_POOL_SIZE", "8"))
+
+# Recipe search backend: "ivf" uses recipe_ann.npz when present (falls back
+# to exact search if it is missing or stale); "exact" always brute-forces.
+RECIPE_SEARCH_BACKEND = os.getenv("RECIPE_SEARCH_BACKEND", "ivf").strip().lower()
+RECIPE_ANN_NPROBE = int(os.getenv("RECIPE_ANN_NPROBE", "8"))
+
+# Storage for the normalised recipe/product matrices: float32, float16 (half
+# the memory) or int8 with a per-row scale (a quarter).
+RAG_EMBEDDING_DTYPE = os.getenv("RAG_EMBEDDING_DTYPE", "float32").strip().lower()
+
+# On-disk index layout: "npz" (compressed, normalised at load), "npy"
+# (pre-normalised, memory-mapped — see build_recipe_index.py --format npy),
+# or "auto" (npy when its <stem>.meta.json sidecar exists locally, else npz).
+RAG_INDEX_FORMAT = os.getenv("RAG_INDEX_FORMAT", "auto").strip().lower()
+
+# Embedding inference backend: "torch", "onnx" (ONNX Runtime fp32) or
+# "onnx-int8" (dynamically quantised). EMBEDDING_ONNX_FILE overrides the
+# ONNX file loaded from the model repo. Check parity with
+# `python recipe_rag/encoding.py --backend onnx-int8`.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").strip().lower()
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "").strip() or None
+
+# Query/ingredient embeddings shared by RecipeRetriever and ProductMatcher
+EMBEDDING_CACHE_MAX = int(os.getenv("EMBEDDING_CACHE_MAX", "4096"))
+EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", str(60 * 60)))
+# Cache misses from concurrent requests are coalesced into one encode call
+# of up to EMBED_BATCH_MAX sentences, waiting at most EMBED_BATCH_WAIT_MS
+# for company (0 disables batching).
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "32"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+
+# Product BM25 snapshot (product_bm25.json/.npz in the index dir). Loaded at
+# startup instead of scanning Mongo, then patched in the background with
+# products whose PRODUCT_UPDATED_FIELD moved past the snapshot watermark.
+# A full rescan (which also drops deleted products) runs once the snapshot
+# is older than BM25_FULL_REBUILD_SECONDS.
+PRODUCT_UPDATED_FIELD = os.getenv("PRODUCT_UPDATED_FIELD", "updated_at")
+BM25_REFRESH_SECONDS = int(os.getenv("BM25_REFRESH_SECONDS", str(10 * 60)))
+BM25_FULL_REBUILD_SECONDS = int(os.getenv("BM25_FULL_REBUILD_SECONDS", str(24 * 60 * 60)))
+BM25_SCAN_MAX_TIME_MS = int(os.getenv("BM25_SCAN_MAX_TIME_MS", "120000"))
+
+# MongoProductResolver ingredient/description lookups (None results are
+# cached too, so repeated misses do not hit Mongo again)
+DESCRIPTION_CACHE_MAX = int(os.getenv("DESCRIPTION_CACHE_MAX", "4096"))
+DESCRIPTION_CACHE_TTL_SECONDS = int(os.getenv("DESCRIPTION_CACHE_TTL_SECONDS", str(30 * 60)))
+
 MAX_TURNS_PER_SESSION = 3
 MATCH_CACHE_TTL_SECONDS = 30 * 60
 MATCH_CACHE_MAX = 2000
 CONTEXT_STORE_TTL_SECONDS = 30 * 60
+CONTEXT_STORE_MAX = 500
+# Chat histories expire after this long without a new turn
+SESSION_TTL_SECONDS = int(os.getenv("RAG_SESSION_TTL_SECONDS", str(2 * 60 * 60)))
+SESSION_STORE_MAX = 5000
+
+# Speculative product grounding: while the LLM is generating, resolve the
+# ingredients of the top RAG_SPECULATIVE_RECIPES retrieved recipes in a
+# background pool (only for queries that ask for a detailed recipe). The
+# result is used if the answer picks one of those recipes, else discarded.
+SPECULATIVE_RECIPES = int(os.getenv("RAG_SPECULATIVE_RECIPES", "1"))
+GROUNDING_WORKERS = int(os.getenv("RAG_GROUNDING_WORKERS", "4"))
+
+
+def load_index_matrix(stem: str,
+                      index_dir: str = INDEX_DIR,
+                      index_format: str = RAG_INDEX_FORMAT,
+                      embedding_dtype: str = RAG_EMBEDDING_DTYPE) -> EmbeddingMatrix:
+    """
+    Load the `<stem>` embeddings as a normalised EmbeddingMatrix.
+
+    The npy layout is memory-mapped as-is (its dtype was fixed at build time);
+    the legacy npz layout is decompressed, normalised and stored as
+    `embedding_dtype`. Raises RuntimeError if the files are unavailable.
+    """
+    meta_name = f"{stem}.meta.json"
+    use_npy = index_format == "npy" or (
+        index_format == "auto" and os.path.exists(os.path.join(index_dir, meta_name))
+    )
+    if use_npy:
+        meta_path = ensure_index_file(meta_name, index_dir)
+        for filename in read_matrix_meta(meta_path)["files"]:
+            ensure_index_file(filename, index_dir)
+        return load_embedding_matrix(meta_path, mmap=True)
+
+    emb_path = ensure_index_file(f"{stem}.npz", index_dir)
+    with np.load(emb_path, allow_pickle=True) as data:
+        embeddings = data["embeddings"].astype(np.float32)
+    return compact_embeddings(embeddings, embedding_dtype)
+
 
 # ---------------------------------------------------------------------------
 # System prompts
@@ -151,18 +268,34 @@ class MongoProductResolver:
     The product embedding index was built from CSV metadata where product_id
     does not match MongoDB products.product_code. Barcode is the strongest
     join key because it maps to products.gtin in the current MongoDB data.
+
+    The BM25 product index is loaded from a snapshot when one exists and is
+    otherwise built by a background scan; either way it is kept fresh by a
+    background refresher, so construction never blocks on a full scan.
+    Until the index is ready, ingredient lookups simply return no BM25 hits.
+
+    Pass `db` (an open pymongo or mongomock Database) to use it instead of
+    connecting to MONGO_URI — benchmark_rag.py does this.
     """
 
-    def __init__(self):
+    def __init__(self, index_dir: str = INDEX_DIR,
+                 refresh_seconds: int = BM25_REFRESH_SECONDS,
+                 db=None):
         self._products_col = None
         self._pricings_col = None
         self._category_code_by_id: Dict[str, str] = {}
         self.enabled = False
-        self._description_cache: Dict[str, Optional[Dict]] = {}
-        self._bm25 = None
-        self._bm25_docs: List[Dict] = []
-        self._bm25_rank_by_query: Dict[str, Dict[str, int]] = {}
-        self._try_connect()
+        self.index_dir = index_dir
+        self.refresh_seconds = refresh_seconds
+        self._description_cache = TTLCache(DESCRIPTION_CACHE_MAX, DESCRIPTION_CACHE_TTL_SECONDS)
+        # Swapped as a whole by the refresher; read once per call by lookups.
+        self._bm25_index: Optional[ProductBM25Index] = None
+        self._bm25_refresh_lock = threading.Lock()
+        self._bm25_stop = threading.Event()
+        if db is not None:
+            self._attach(db)
+        else:
+            self._try_connect()
 
     def _try_connect(self):
         if not MONGO_URI:
@@ -172,19 +305,21 @@ class MongoProductResolver:
             from pymongo import MongoClient
             client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
             client.admin.command("ping")
-            db = client[MONGO_DB_NAME]
-            self._products_col = db["products"]
-            self._pricings_col = db["product_pricings"]
-            self._category_code_by_id = {
-                str(c["_id"]): str(c.get("category_code", "")).lower()
-                for c in db["categories"].find({}, {"category_code": 1})
-            }
-            self._build_bm25_index()
-            self.enabled = True
-            print(f"[MongoProductResolver] connected to {MONGO_DB_NAME}")
+            self._attach(client[MONGO_DB_NAME])
         except Exception as e:
             print(f"[MongoProductResolver] connection failed: {e} — product grounding disabled")
 
+    def _attach(self, db):
+        self._products_col = db["products"]
+        self._pricings_col = db["product_pricings"]
+        self._category_code_by_id = {
+            str(c["_id"]): str(c.get("category_code", "")).lower()
+            for c in db["categories"].find({}, {"category_code": 1})
+        }
+        self.enabled = True
+        print(f"[MongoProductResolver] connected to {db.name}")
+        self._start_bm25_index()
+
     def _normalize_token(self, token: str) -> str:
         token = token.lower().strip("'")
         if len(token) > 3 and token.endswith("ies"):
@@ -226,60 +361,145 @@ class MongoProductResolver:
         category_code = self._category_code_by_id.get(str(doc.get("category_id")), "")
         return self._tokens_from_text(f"{self._product_name(doc)} {category_code}")
 
-    def _build_bm25_index(self):
-        if self._products_col is None:
-            return
-        projection = {
+    def _bm25_projection(self) -> Dict:
+        return {
             "product_name": 1, "name": 1, "item_name": 1,
             "product_code": 1, "product_id": 1, "gtin": 1,
             "category_id": 1, "link_image": 1, "image": 1,
+            PRODUCT_UPDATED_FIELD: 1,
         }
+
+    def _scan_bm25_docs(self, query: Dict):
+        """
+        Stream products matching `query` and split them into BM25 entries
+        (doc, tokens) and ids that no longer qualify. Also returns the
+        newest PRODUCT_UPDATED_FIELD value seen (the next watermark).
+        """
+        entries = []
+        rejected_ids = []
+        watermark = None
+        cursor = self._products_col.find(query, self._bm25_projection())
+        for doc in cursor.max_time_ms(BM25_SCAN_MAX_TIME_MS):
+            updated = doc.pop(PRODUCT_UPDATED_FIELD, None)
+            if isinstance(updated, datetime) and (watermark is None or updated > watermark):
+                watermark = updated
+            tokens = (
+                self._bm25_tokens_for_doc(doc)
+                if self._product_name(doc) and self._is_recipe_product_candidate(doc)
+                else []
+            )
+            if tokens:
+                entries.append((doc, tokens))
+            else:
+                rejected_ids.append(str(doc["_id"]))
+        return entries, rejected_ids, watermark
+
+    def _build_bm25_index(self):
+        """Full products scan → fresh index + snapshot."""
+        if self._products_col is None:
+            return
+        entries, _, watermark = self._scan_bm25_docs({})
+        if not entries:
+            print("[MongoProductResolver] BM25 scan found no products")
+            return
+        index = ProductBM25Index(
+            [doc for doc, _ in entries],
+            [tokens for _, tokens in entries],
+            watermark=watermark,
+        )
+        self._install_bm25_index(index, save=True)
+        print(f"[MongoProductResolver] BM25 indexed {len(index)} products (full scan)")
+
+    def _refresh_bm25_index(self):
+        """Apply products changed since the watermark, or rescan when stale."""
+        index = self._bm25_index
+        if index is None or time.time() - index.built_at > BM25_FULL_REBUILD_SECONDS:
+            self._build_bm25_index()
+            return
+        if index.watermark is None:
+            return   # products carry no PRODUCT_UPDATED_FIELD — wait for a full rescan
+        entries, rejected_ids, watermark = self._scan_bm25_docs(
+            {PRODUCT_UPDATED_FIELD: {"$gt": index.watermark}}
+        )
+        if not entries and not rejected_ids:
+            return
+        updated = index.with_changes(entries, rejected_ids, watermark)
+        # Keep the snapshot age of the last full scan so deletions still get
+        # picked up by the periodic rescan.
+        updated.built_at = index.built_at
+        self._install_bm25_index(updated, save=True)
+        print(f"[MongoProductResolver] BM25 refreshed: {len(entries)} upserted, "
+              f"{len(rejected_ids)} removed ({len(updated)} products)")
+
+    def _install_bm25_index(self, index: ProductBM25Index, save: bool):
+        self._bm25_index = index
+        # Ingredient lookups are pure BM25 results, so they are only valid
+        # for the index they were ranked against.
+        self._description_cache.clear_prefix("ingredient:")
+        if not save:
+            return
         try:
-            docs = []
-            corpus = []
-            for doc in self._products_col.find({}, projection).max_time_ms(15000):
-                if not self._product_name(doc) or not self._is_recipe_product_candidate(doc):
-                    continue
-                tokens = self._bm25_tokens_for_doc(doc)
-                if not tokens:
-                    continue
-                docs.append(doc)
-                corpus.append(tokens)
+            index.save(self.index_dir)
+        except OSError as e:
+            print(f"[MongoProductResolver] could not save BM25 snapshot: {e}")
 
-            self._bm25_docs = docs
-            self._bm25 = BM25Okapi(corpus) if corpus else None
-            print(f"[MongoProductResolver] BM25 indexed {len(self._bm25_docs)} products")
-        except Exception as e:
-            print(f"[MongoProductResolver] BM25 index unavailable: {e}")
-            self._bm25 = None
-            self._bm25_docs = []
+    def _load_bm25_snapshot(self) -> Optional[ProductBM25Index]:
+        for filename in BM25_SNAPSHOT_FILES:
+            try:
+                ensure_index_file(filename, self.index_dir)
+            except (RuntimeError, ImportError) as e:
+                print(f"[MongoProductResolver] no BM25 snapshot ({filename}): {e}")
+                return None
+        try:
+            return ProductBM25Index.load(self.index_dir)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[MongoProductResolver] BM25 snapshot unreadable: {e}")
+            return None
+
+    def _start_bm25_index(self):
+        snapshot = self._load_bm25_snapshot()
+        if snapshot is not None:
+            self._install_bm25_index(snapshot, save=False)
+            print(f"[MongoProductResolver] BM25 loaded {len(snapshot)} products from snapshot "
+                  f"(watermark {snapshot.watermark})")
+        threading.Thread(
+            target=self._bm25_refresh_loop,
+            name="bm25-refresher",
+            daemon=True,
+        ).start()
+
+    def _bm25_refresh_loop(self):
+        # Without a snapshot the first pass is the full scan; afterwards
+        # sleep between incremental refreshes.
+        delay = 0 if self._bm25_index is None else self.refresh_seconds
+        while not self._bm25_stop.wait(delay):
+            with self._bm25_refresh_lock:
+                try:
+                    self._refresh_bm25_index()
+                except Exception as e:
+                    print(f"[MongoProductResolver] BM25 refresh failed: {e}")
+            delay = self.refresh_seconds
+
+    def stop_refresh(self):
+        """Stop the background BM25 refresher (used by tests and shutdown)."""
+        self._bm25_stop.set()
 
     def _bm25_ranked_docs(self, query_tokens: List[str], limit: int = 20) -> List[Dict]:
-        if self._bm25 is None or not query_tokens:
+        index = self._bm25_index
+        if index is None or not query_tokens:
             return []
-        scores = self._bm25.get_scores(query_tokens)
-        if len(scores) == 0:
-            return []
-        order = np.argsort(scores)[::-1]
-        ranked = []
-        rank_map: Dict[str, int] = {}
-        for idx in order:
-            score = float(scores[int(idx)])
-            if score <= 0:
-                break
-            doc = self._bm25_docs[int(idx)]
-            mongo_id = str(doc["_id"])
-            rank_map[mongo_id] = len(rank_map) + 1
-            if len(ranked) < limit:
-                ranked.append(doc)
-        self._bm25_rank_by_query[" ".join(query_tokens)] = rank_map
-        return ranked
+        doc_ids, _ = InvertedBM25.best_first(*index.scores(query_tokens), limit)
+        return [index.docs[int(pos)] for pos in doc_ids]
 
     def _bm25_rank_for_doc(self, query_tokens: List[str], mongo_id: str) -> Optional[int]:
-        query_key = " ".join(query_tokens)
-        if query_key not in self._bm25_rank_by_query:
-            self._bm25_ranked_docs(query_tokens, limit=20)
-        return self._bm25_rank_by_query.get(query_key, {}).get(mongo_id)
+        index = self._bm25_index
+        if index is None or not query_tokens:
+            return None
+        pos = index.pos_by_id.get(mongo_id)
+        if pos is None:
+            return None
+        doc_ids, scores = index.scores(query_tokens)
+        return InvertedBM25.rank_of(doc_ids, scores, pos)
 
     def _rrf_score(
         self,
@@ -335,19 +555,26 @@ class MongoProductResolver:
 
         for term in self._ingredient_search_terms(ingredient):
             cache_key = f"ingredient:{term}"
-            if cache_key in self._description_cache:
-                return self._description_cache[cache_key]
+            cached = self._description_cache.get(cache_key)
+            if cached is not MISSING:
+                # A remembered miss ends the search too, as it always has;
+                # only a fresh miss moves on to the next term.
+                return cached
 
             tokens = self._tokens_from_text(term)
             if not tokens:
                 continue
 
+            index_ready = self._bm25_index is not None
             ranked_docs = self._bm25_ranked_docs(tokens, limit=1)
             if not ranked_docs:
-                self._description_cache[cache_key] = None
+                # No index yet (cold start, first scan running) is not a
+                # real miss — don't remember it.
+                if index_ready:
+                    self._description_cache.put(cache_key, None)
                 continue
 
-            self._description_cache[cache_key] = ranked_docs[0]
+            self._description_cache.put(cache_key, ranked_docs[0])
             return ranked_docs[0]
         return None
 
@@ -466,6 +693,76 @@ class MongoProductResolver:
             "_id": mongo_id,
         }
 
+    def _lookup_key(self, value) -> Optional[str]:
+        """Compare gtin/code/id values the way _value_variants queries them."""
+        if value is None:
+            return None
+        s = str(value).strip()
+        if not s:
+            return None
+        try:
+            return str(int(s))
+        except (ValueError, TypeError):
+            return s
+
+    def _fetch_candidate_docs(self, candidates: List[Dict],
+                              limit: Optional[int] = None) -> List[Dict]:
+        """
+        One `find` for every candidate's gtin/code/id. Unlimited by default:
+        the `$in` values already bound the result, and a shared limit would
+        let one candidate matching many docs starve the others.
+        """
+        assert self._products_col is not None
+        cursor = self._products_col.find(
+            self._build_candidate_filter(candidates),
+            {
+                "product_name": 1, "name": 1, "item_name": 1,
+                "product_code": 1, "product_id": 1, "gtin": 1,
+            },
+        ).max_time_ms(5000)
+        if limit:
+            cursor = cursor.limit(limit)
+        return list(cursor)
+
+    def _description_fallback_doc(self, candidate: Dict) -> Optional[Dict]:
+        """
+        Prefix lookup by description for candidates without a barcode.
+        Tried first against the BM25 index's sorted product names. The index
+        only holds recipe-candidate products, so a local miss (or a missing
+        index) still falls back to Mongo's case-insensitive `^term` regex,
+        an unindexable scan whose result is cached per term.
+
+        With several matching products the local table returns the
+        alphabetically first name, whereas find_one returns whichever
+        match Mongo reaches first in natural order; for terms the index
+        answers, the product picked can therefore differ from the old one.
+        """
+        assert self._products_col is not None
+        barcode = str(candidate.get("barcode", "")).strip()
+        if barcode not in ("", "0"):
+            return None
+        index = self._bm25_index
+        for term in self._description_search_terms(candidate.get("description", "")):
+            if index is not None:
+                doc = index.find_by_name_prefix(term)
+                if doc:
+                    return doc
+            cache_key = term.lower()
+            doc = self._description_cache.get(cache_key)
+            if doc is MISSING:
+                doc = self._products_col.find_one(
+                    {"product_name": re.compile(f"^{re.escape(term)}", re.I)},
+                    {
+                        "product_name": 1, "name": 1, "item_name": 1,
+                        "product_code": 1, "product_id": 1, "gtin": 1,
+                    },
+                    max_time_ms=5000,
+                )
+                self._description_cache.put(cache_key, doc)
+            if doc:
+                return doc
+        return None
+
     def resolve_names(self, candidates: List[Dict]) -> List[Dict]:
         """
         Bulk-fetch product names from MongoDB by candidate gtin/code/id.
@@ -473,48 +770,70 @@ class MongoProductResolver:
         """
         if not self.enabled or not candidates:
             return []
-        assert self._products_col is not None
         try:
-            query = self._build_candidate_filter(candidates)
-            docs = list(self._products_col.find(
-                query,
-                {
-                    "product_name": 1, "name": 1, "item_name": 1,
-                    "product_code": 1, "product_id": 1, "gtin": 1,
-                },
-            ).max_time_ms(5000).limit(len(candidates) * 3))
-
             result = []
             seen_ids: set = set()
-            for doc in docs:
+            for doc in self._fetch_candidate_docs(candidates, limit=len(candidates) * 3):
                 self._append_display_doc(doc, result, seen_ids)
 
             for candidate in candidates:
-                barcode = str(candidate.get("barcode", "")).strip()
-                if barcode not in ("", "0"):
-                    continue
-                for term in self._description_search_terms(candidate.get("description", "")):
-                    cache_key = term.lower()
-                    if cache_key in self._description_cache:
-                        doc = self._description_cache[cache_key]
-                    else:
-                        doc = self._products_col.find_one(
-                            {"product_name": re.compile(f"^{re.escape(term)}", re.I)},
-                            {
-                                "product_name": 1, "name": 1, "item_name": 1,
-                                "product_code": 1, "product_id": 1, "gtin": 1,
-                            },
-                            max_time_ms=5000,
-                        )
-                        self._description_cache[cache_key] = doc
-                    if doc:
-                        self._append_display_doc(doc, result, seen_ids)
-                        break
+                doc = self._description_fallback_doc(candidate)
+                if doc:
+                    self._append_display_doc(doc, result, seen_ids)
             return result
         except Exception as e:
             print(f"[MongoProductResolver] resolve_names error: {e}")
             return []
 
+    def resolve_candidates(self, candidates: List[Dict]) -> List[Optional[Dict]]:
+        """
+        Resolve each candidate to its own display item (or None), aligned
+        with `candidates`. Equivalent to calling resolve_names([candidate])
+        per candidate, but with a single `find` round-trip for all of them.
+        """
+        if not self.enabled or not candidates:
+            return [None] * len(candidates)
+        try:
+            docs = self._fetch_candidate_docs(candidates)
+        except Exception as e:
+            print(f"[MongoProductResolver] resolve_candidates error: {e}")
+            return [None] * len(candidates)
+
+        # First displayable doc (in cursor order) per gtin / code-or-id value
+        items = [self._display_item_from_doc(doc) for doc in docs]
+        by_gtin: Dict[str, int] = {}
+        by_code: Dict[str, int] = {}
+        for pos, doc in enumerate(docs):
+            if items[pos] is None:
+                continue
+            gtin = self._lookup_key(doc.get("gtin"))
+            if gtin is not None:
+                by_gtin.setdefault(gtin, pos)
+            for field in ("product_code", "product_id"):
+                code = self._lookup_key(doc.get(field))
+                if code is not None:
+                    by_code.setdefault(code, pos)
+
+        resolved: List[Optional[Dict]] = []
+        for candidate in candidates:
+            positions = []
+            barcode = str(candidate.get("barcode", "")).strip()
+            if barcode not in ("", "0"):
+                positions.append(by_gtin.get(self._lookup_key(barcode)))
+            positions.append(by_code.get(self._lookup_key(candidate.get("product_id"))))
+            positions = [pos for pos in positions if pos is not None]
+
+            item = items[min(positions)] if positions else None
+            if item is None:
+                try:
+                    doc = self._description_fallback_doc(candidate)
+                except Exception as e:
+                    print(f"[MongoProductResolver] resolve_candidates error: {e}")
+                    doc = None
+                item = self._display_item_from_doc(doc) if doc else None
+            resolved.append(item)
+        return resolved
+
     def resolve_ingredients(self, ingredients: List[str], candidates: List[Dict]) -> List[Dict]:
         """
         Resolve recipe ingredient lines to MongoDB products.
@@ -549,6 +868,14 @@ class MongoProductResolver:
         seen_ids: set = set()
         product_by_id: Dict[str, Dict] = {}
 
+        # Resolve every vector candidate of the recipe in one round-trip;
+        # the per-ingredient RRF scoring below then runs in memory.
+        with_candidates = [ing for ing in ingredients if ingredient_candidates.get(ing)]
+        resolved_items = self.resolve_candidates(
+            [ingredient_candidates[ing] for ing in with_candidates]
+        )
+        vector_items = dict(zip(with_candidates, resolved_items))
+
         for ingredient in ingredients:
             scored_items = []
             terms = self._ingredient_search_terms(ingredient)
@@ -556,9 +883,8 @@ class MongoProductResolver:
 
             candidate = ingredient_candidates.get(ingredient)
             if candidate:
-                resolved = self.resolve_names([candidate])
-                if resolved:
-                    vector_item = resolved[0]
+                vector_item = vector_items.get(ingredient)
+                if vector_item:
                     bm25_rank = self._bm25_rank_for_doc(
                         query_tokens,
                         str(vector_item["_id"]),
@@ -743,123 +1069,291 @@ class MongoProductResolver:
 # LLM cascade (OpenRouter -> HuggingFace)
 # ---------------------------------------------------------------------------
 
+def build_http_session(pool_size: int = LLM_HTTP_POOL_SIZE) -> requests.Session:
+    """
+    Shared keep-alive session for the LLM providers.
+
+    Connections are pooled per host (pool_size each; extra concurrent
+    requests open short-lived connections rather than blocking). Only
+    failures that cannot have reached the model are retried: connection
+    errors, and a 502 from the gateway, with exponential backoff.
+    A 504 is not retried: the gateway gave up waiting, but the model may
+    have finished (and billed) the generation anyway. 429/503 are not
+    retried either — LLMClient's circuit breaker moves on to another model
+    instead — and read timeouts are not retried because the provider may
+    still be generating.
+    """
+    retry = Retry(
+        total=2,
+        connect=2,
+        read=0,
+        status=1,
+        backoff_factor=0.5,
+        status_forcelist=(502,),
+        allowed_methods=frozenset({"POST"}),
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 class LLMClient:
-    """Cascading LLM client: OpenRouter free models → HuggingFace fallback."""
+    """
+    Cascading LLM client: OpenRouter free models → HuggingFace fallback.
+
+    With hedge_width > 1 the cascade runs in waves: the next `hedge_width`
+    healthy models are called concurrently and the first usable answer
+    wins; the losers are abandoned (their results discarded) and the next
+    wave only starts if the whole wave failed. Models that answer 429/503
+    are skipped for a cool-down window by the circuit breaker; if every
+    model is cooling down, all of them are tried anyway, soonest-to-reopen
+    first.
+    """
 
     def __init__(self,
                  openrouter_models: Optional[List[str]] = None,
                  hf_models: Optional[List[str]] = None,
                  temperature: float = 0.7,
-                 max_tokens: int = 1500):
+                 max_tokens: int = 1500,
+                 hedge_width: int = LLM_HEDGE_WIDTH,
+                 circuit_cooldown_seconds: float = LLM_CIRCUIT_COOLDOWN_SECONDS):
         self.openrouter_models = openrouter_models or OPENROUTER_MODELS
         self.hf_models = hf_models or HF_MODELS
         self.temperature = temperature
         self.max_tokens = max_tokens
+        self.hedge_width = max(1, hedge_width)
+        self.breaker = CircuitBreaker(circuit_cooldown_seconds)
+        self.health = ModelHealth()
+        # One pooled session for the process lifetime: successive turns
+        # (and the concurrent calls of a hedged wave) reuse TLS connections.
+        self.http = build_http_session()
 
         print(f"[LLMClient] OpenRouter key: "
               f"{'yes' if OPENROUTER_API_KEY else 'NO'}")
         print(f"[LLMClient] HuggingFace token: "
               f"{'yes' if HF_TOKEN else 'NO — fallback disabled'}")
         print(f"[LLMClient] Cascade: {len(self.openrouter_models)} OpenRouter "
-              f"→ {len(self.hf_models)} HuggingFace")
-
-    def _try_openrouter(self, messages: List[Dict]) -> Optional[str]:
-        if not OPENROUTER_API_KEY:
-            return None
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+              f"→ {len(self.hf_models)} HuggingFace "
+              f"(hedge width {self.hedge_width})")
+
+    def _routes(self) -> List[Tuple[str, str]]:
+        """(provider, model) pairs in cascade order, for configured providers."""
+        routes = []
+        if OPENROUTER_API_KEY:
+            routes.extend(("OpenRouter", m) for m in self.openrouter_models)
+        if HF_TOKEN:
+            routes.extend(("HuggingFace", m) for m in self.hf_models)
+        else:
+            print("  [HuggingFace] no token — skipping")
+        return routes
+
+    def _provider_request(self, provider: str) -> Tuple[str, Dict, int]:
+        """(url, headers, timeout) for a provider."""
+        if provider == "OpenRouter":
+            return OPENROUTER_URL, {
+                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+                "Content-Type": "application/json",
+                "HTTP-Referer": "https://discountmate.app",
+                "X-Title": "DiscountMate RAG",
+            }, 30
+        return HUGGINGFACE_URL, {
+            "Authorization": f"Bearer {HF_TOKEN}",
             "Content-Type": "application/json",
-            "HTTP-Referer": "https://discountmate.app",
-            "X-Title": "DiscountMate RAG",
+        }, 45
+
+    def _rejected(self, provider: str, model_name: str,
+                  r: requests.Response, latency: float) -> bool:
+        """Record and report a non-200 response; trips the breaker on 429/503."""
+        if r.status_code == 200:
+            return False
+        self.health.record(model_name, f"http_{r.status_code}", latency)
+        if r.status_code in CIRCUIT_STATUSES:
+            cooldown = self.breaker.trip(model_name, r.headers.get("Retry-After"))
+            print(f"  [{provider}] {model_name} status {r.status_code} "
+                  f"— skipping for {cooldown:.0f}s")
+            return True
+        try:
+            data = r.json()
+            err = data.get("error", data.get("message", "unknown"))
+        except ValueError:
+            err = "non-JSON body"
+        print(f"  [{provider}] {model_name} error {r.status_code}: {err}")
+        return True
+
+    def _call_model(self, provider: str, model_name: str,
+                    messages: List[Dict]) -> Optional[str]:
+        """One completion attempt; records health and trips the breaker."""
+        url, headers, timeout = self._provider_request(provider)
+        payload = {
+            "model": model_name,
+            "messages": messages,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
         }
-        for model_name in self.openrouter_models:
-            payload = {
-                "model": model_name,
-                "messages": messages,
-                "temperature": self.temperature,
-                "max_tokens": self.max_tokens,
-            }
-            try:
-                r = requests.post(OPENROUTER_URL, headers=headers,
-                                  json=payload, timeout=30)
-                data = r.json()
-            except (requests.RequestException, ValueError) as e:
-                print(f"  [OpenRouter] {model_name} request failed: {e}")
-                continue
+        started = time.monotonic()
+        try:
+            r = self.http.post(url, headers=headers, json=payload, timeout=timeout)
+        except requests.RequestException as e:
+            self.health.record(model_name, "error", time.monotonic() - started)
+            print(f"  [{provider}] {model_name} request failed: {e}")
+            return None
+        latency = time.monotonic() - started
+        if self._rejected(provider, model_name, r, latency):
+            return None
 
-            if r.status_code == 200:
-                content = (data.get("choices", [{}])[0]
-                           .get("message", {}).get("content"))
-                if content:
-                    print(f"  [OpenRouter] used: {model_name}")
-                    return content
-            elif r.status_code == 429:
-                print(f"  [OpenRouter] {model_name} rate limited")
-            else:
-                print(f"  [OpenRouter] {model_name} error {r.status_code}")
+        try:
+            data = r.json()
+        except ValueError:
+            self.health.record(model_name, "error", latency)
+            print(f"  [{provider}] {model_name} non-JSON "
+                  f"(status {r.status_code})")
+            return None
+
+        content = (data.get("choices", [{}])[0]
+                   .get("message", {}).get("content"))
+        self.health.record(model_name, "success" if content else "empty", latency)
+        if content:
+            print(f"  [{provider}] used: {model_name}")
+        return content or None
+
+    def _run_wave(self, wave: List[Tuple[str, str]],
+                  messages: List[Dict]) -> Optional[str]:
+        """Call every model in `wave` concurrently; first usable answer wins."""
+        if len(wave) == 1:
+            return self._call_model(wave[0][0], wave[0][1], messages)
+
+        results: "queue.Queue[Optional[str]]" = queue.Queue()
+
+        def attempt(provider: str, model_name: str):
+            try:
+                results.put(self._call_model(provider, model_name, messages))
+            except Exception as e:   # never leave the waiter hanging
+                print(f"  [{provider}] {model_name} failed: {e}")
+                results.put(None)
+
+        for provider, model_name in wave:
+            # Daemon threads: a losing request cannot be interrupted, so it
+            # is left to finish (or time out) on its own and its answer is
+            # dropped.
+            threading.Thread(target=attempt, args=(provider, model_name),
+                             name=f"llm-{model_name}", daemon=True).start()
+
+        for _ in wave:
+            content = results.get()
+            if content:
+                return content
         return None
 
-    def _try_huggingface(self, messages: List[Dict]) -> Optional[str]:
-        if not HF_TOKEN:
-            print("  [HuggingFace] no token — skipping")
-            return None
-        headers = {
-            "Authorization": f"Bearer {HF_TOKEN}",
-            "Content-Type": "application/json",
-        }
-        for model_name in self.hf_models:
+    def _healthy_routes(self) -> List[Tuple[str, str]]:
+        routes = self._routes()
+        healthy = [r for r in routes if not self.breaker.is_open(r[1])]
+        if len(healthy) < len(routes):
+            print(f"  [LLMClient] {len(routes) - len(healthy)} model(s) "
+                  f"cooling down after 429/503")
+        if not healthy and routes:
+            # Every circuit is open: rather than failing without a single
+            # attempt, try all models, the one that reopens soonest first.
+            cooldowns = self.breaker.snapshot()
+            return sorted(routes, key=lambda r: cooldowns.get(r[1], 0.0))
+        return healthy
+
+    def _exhausted(self) -> RuntimeError:
+        return RuntimeError(
+            "All LLM providers exhausted "
+            f"({len(self.openrouter_models)} OpenRouter + "
+            f"{len(self.hf_models)} HuggingFace). Try again in ~60s."
+        )
+
+    def generate(self, system_prompt: str, messages: List[Dict]) -> str:
+        """Run the cascade. messages = [{role, content}, ...] (no system)."""
+        full = [{"role": "system", "content": system_prompt}] + messages
+
+        healthy = self._healthy_routes()
+        for start in range(0, len(healthy), self.hedge_width):
+            result = self._run_wave(healthy[start:start + self.hedge_width], full)
+            if result:
+                return result
+
+        raise self._exhausted()
+
+    def _stream_deltas(self, r: requests.Response) -> Iterator[str]:
+        """Content deltas from an OpenAI-style `stream: true` SSE response."""
+        for line in r.iter_lines(decode_unicode=True):
+            # Blank lines separate events; ":"-prefixed lines are keep-alive
+            # comments (OpenRouter sends ": OPENROUTER PROCESSING").
+            if not line or line.startswith(":") or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                return
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                continue
+            if chunk.get("error"):
+                raise ValueError(f"stream error: {chunk['error']}")
+            choices = chunk.get("choices") or [{}]
+            content = (choices[0].get("delta") or {}).get("content")
+            if content:
+                yield content
+
+    def generate_stream(self, system_prompt: str, messages: List[Dict]) -> Iterator[str]:
+        """
+        Streaming variant of generate(): yields answer text deltas as the
+        provider sends them. Models are tried in cascade order (not hedged)
+        until one starts producing text; once text has been yielded the
+        answer cannot move to another model, so a later failure raises.
+        """
+        full = [{"role": "system", "content": system_prompt}] + messages
+
+        for provider, model_name in self._healthy_routes():
+            url, headers, timeout = self._provider_request(provider)
             payload = {
                 "model": model_name,
-                "messages": messages,
+                "messages": full,
                 "temperature": self.temperature,
                 "max_tokens": self.max_tokens,
+                "stream": True,
             }
+            started = time.monotonic()
+            produced = False
             try:
-                r = requests.post(HUGGINGFACE_URL, headers=headers,
-                                  json=payload, timeout=45)
-            except requests.RequestException as e:
-                print(f"  [HuggingFace] {model_name} request failed: {e}")
-                continue
-
-            try:
-                data = r.json()
-            except ValueError:
-                print(f"  [HuggingFace] {model_name} non-JSON "
-                      f"(status {r.status_code})")
+                with self.http.post(url, headers=headers, json=payload,
+                                    timeout=timeout, stream=True) as r:
+                    if self._rejected(provider, model_name, r,
+                                      time.monotonic() - started):
+                        continue
+                    for delta in self._stream_deltas(r):
+                        if not produced:
+                            print(f"  [{provider}] streaming: {model_name}")
+                        produced = True
+                        yield delta
+            except (requests.RequestException, ValueError) as e:
+                self.health.record(model_name, "error", time.monotonic() - started)
+                print(f"  [{provider}] {model_name} stream failed: {e}")
+                if produced:
+                    raise RuntimeError(f"{model_name} stream interrupted: {e}") from e
                 continue
 
-            if r.status_code == 200:
-                content = (data.get("choices", [{}])[0]
-                           .get("message", {}).get("content"))
-                if content:
-                    print(f"  [HuggingFace] used: {model_name}")
-                    return content
-            elif r.status_code in (429, 503):
-                print(f"  [HuggingFace] {model_name} status {r.status_code}")
-            else:
-                err = data.get("error", data.get("message", "unknown"))
-                print(f"  [HuggingFace] {model_name} error "
-                      f"{r.status_code}: {err}")
-        return None
-
-    def generate(self, system_prompt: str, messages: List[Dict]) -> str:
-        """Run the cascade. messages = [{role, content}, ...] (no system)."""
-        full = [{"role": "system", "content": system_prompt}] + messages
-
-        result = self._try_openrouter(full)
-        if result:
-            return result
+            self.health.record(model_name, "success" if produced else "empty",
+                               time.monotonic() - started)
+            if produced:
+                return
 
-        print("  All OpenRouter models exhausted — trying HuggingFace...")
-        result = self._try_huggingface(full)
-        if result:
-            return result
+        raise self._exhausted()
 
-        raise RuntimeError(
-            "All LLM providers exhausted "
-            f"({len(self.openrouter_models)} OpenRouter + "
-            f"{len(self.hf_models)} HuggingFace). Try again in ~60s."
-        )
+    def stats(self) -> Dict:
+        return {
+            "hedge_width": self.hedge_width,
+            "circuit_cooldown_seconds": self.breaker.cooldown_seconds,
+            "open_circuits": self.breaker.snapshot(),
+            "models": self.health.stats(),
+        }
 
 
 # ---------------------------------------------------------------------------
@@ -867,51 +1361,76 @@ class LLMClient:
 # ---------------------------------------------------------------------------
 
 class RecipeRetriever:
-    """Loads recipe_index.npz + recipe_metadata.json and does cosine search."""
+    """
+    Loads recipe_index.npz + recipe_metadata.json and does cosine search.
+    Uses the IVF index in recipe_ann.npz when available, otherwise exact search.
+    """
 
-    def __init__(self, embedding_model, index_dir: str = INDEX_DIR):
+    def __init__(self, embedding_model, index_dir: str = INDEX_DIR,
+                 backend: str = RECIPE_SEARCH_BACKEND,
+                 nprobe: int = RECIPE_ANN_NPROBE,
+                 embedding_dtype: str = RAG_EMBEDDING_DTYPE):
         self.model = embedding_model
         self.index_dir = index_dir
-        self.embeddings: Optional[np.ndarray] = None
-        self._e_norm: Optional[np.ndarray] = None
+        self.backend = backend
+        self.nprobe = nprobe
+        self.embedding_dtype = embedding_dtype
+        self._e_norm: Optional[EmbeddingMatrix] = None   # only copy kept resident
+        self.search_index = None
         self.recipes: List[Dict] = []
         self._load()
 
     def _load(self):
         try:
-            emb_path = ensure_index_file("recipe_index.npz", self.index_dir)
+            e_norm = load_index_matrix("recipe_index", self.index_dir,
+                                       embedding_dtype=self.embedding_dtype)
             meta_path = ensure_index_file("recipe_metadata.json", self.index_dir)
         except RuntimeError as e:
             raise FileNotFoundError(
                 f"Recipe index unavailable (local + GCS both failed): {e}\n"
                 "Run: python build_recipe_index.py — or check GCS auth."
             ) from e
-        embeddings = np.load(emb_path)["embeddings"].astype(np.float32)
         with open(meta_path, "r", encoding="utf-8") as f:
             self.recipes = json.load(f)
-        if embeddings.shape[0] != len(self.recipes):
+        if e_norm.shape[0] != len(self.recipes):
             raise ValueError(
-                f"Recipe index shape mismatch: {embeddings.shape[0]} embeddings "
+                f"Recipe index shape mismatch: {e_norm.shape[0]} embeddings "
                 f"vs {len(self.recipes)} metadata entries — rebuild the index."
             )
-        self._e_norm = embeddings / (
-            np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-10
-        )
-        self.embeddings = embeddings
+        self._e_norm = e_norm
+        self.search_index = self._load_search_index()
         print(f"[RecipeRetriever] loaded {len(self.recipes)} recipes "
-              f"({self.embeddings.shape})")
+              f"({self._e_norm.shape} {self._e_norm.dtype_name}, "
+              f"{self._e_norm.nbytes / (1024 * 1024):.1f} MB, "
+              f"{self.search_index.name} search)")
+
+    def _load_search_index(self):
+        exact = ExactIndex(self._e_norm)
+        if self.backend != "ivf":
+            return exact
+        try:
+            ann_path = ensure_index_file("recipe_ann.npz", self.index_dir)
+        except (RuntimeError, ImportError) as e:
+            print(f"[RecipeRetriever] ANN index unavailable — exact search. {e}")
+            return exact
+        try:
+            index = load_ivf(ann_path, self._e_norm, nprobe=self.nprobe)
+        except (ValueError, KeyError, OSError) as e:
+            print(f"[RecipeRetriever] ANN index rejected — exact search. {e}")
+            return exact
+        print(f"[RecipeRetriever] IVF index: {index.nlist} lists, nprobe={index.nprobe}")
+        return index
 
     def search(self, query: str, top_k: int = 8) -> List[Dict]:
-        q = self.model.encode([query], convert_to_numpy=True).astype(np.float32)
-        q_norm = q / (np.linalg.norm(q, axis=1, keepdims=True) + 1e-10)
-        sims = (self._e_norm @ q_norm.T).flatten()
-        top_idx = np.argsort(sims)[::-1][:top_k]
+        q = self.model.encode([query], convert_to_numpy=True)
+        q_norm = normalize_rows(q)[0]
+        top_idx, top_scores = self.search_index.search(q_norm, top_k)
 
         results = []
-        for rank, i in enumerate(top_idx, 1):
+        for rank, (i, score) in enumerate(zip(top_idx.tolist(), top_scores.tolist()), 1):
             results.append({
                 "rank": rank,
-                "score": float(sims[i]),
+                "score": float(score),
                 "text": self.recipes[i]["text"],
                 "metadata": self.recipes[i]["metadata"],
                 "index": int(i),
@@ -930,71 +1449,58 @@ class ProductMatcher:
     Product names, prices, and images always come from MongoDB via
     MongoProductResolver — never from this index directly.
 
-    Product embeddings are pre-normalized at load time and ingredient
-    embeddings are batched to minimise per-call overhead.
+    Product embeddings are pre-normalized at load time (optionally stored as
+    float16/int8) and ingredient embeddings are batched to minimise per-call
+    overhead.
     """
 
     def __init__(self, embedding_model, index_dir: str = INDEX_DIR,
-                 threshold: float = 0.55):
+                 threshold: float = 0.55,
+                 embedding_dtype: str = RAG_EMBEDDING_DTYPE):
         self.model = embedding_model
         self.index_dir = index_dir
         self.threshold = threshold
+        self.embedding_dtype = embedding_dtype
 
-        self.embeddings: Optional[np.ndarray] = None
-        self._e_norm: Optional[np.ndarray] = None   # pre-normalized at load time
+        self._e_norm: Optional[EmbeddingMatrix] = None   # pre-normalized at load time
         self.products: List[Dict] = []
-        self._match_cache: Dict[str, Optional[Dict]] = {}  # ingredient → product candidate
-        self._match_cache_created: Dict[str, float] = {}
+        # ingredient → product candidate (None = no product above threshold)
+        self._match_cache = TTLCache(MATCH_CACHE_MAX, MATCH_CACHE_TTL_SECONDS)
 
         self.enabled = False
         self._try_load()
 
-    def _prune_match_cache(self):
-        if not self._match_cache:
-            return
-        now = time.time()
-        expired = [
-            key for key, created in self._match_cache_created.items()
-            if now - created > MATCH_CACHE_TTL_SECONDS
-        ]
-        for key in expired:
-            self._match_cache.pop(key, None)
-            self._match_cache_created.pop(key, None)
-
-        while len(self._match_cache) > MATCH_CACHE_MAX:
-            oldest_key = next(iter(self._match_cache))
-            self._match_cache.pop(oldest_key, None)
-            self._match_cache_created.pop(oldest_key, None)
-
     def _try_load(self):
         try:
-            emb_path = ensure_index_file("product_index.npz", self.index_dir)
+            # Pre-normalized once (at build time for the npy layout, at load
+            # time for npz) — reused for every batch query. Only the compact
+            # normalized copy stays resident.
+            e_norm = load_index_matrix("product_index", self.index_dir,
+                                       embedding_dtype=self.embedding_dtype)
             meta_path = ensure_index_file("product_metadata.json", self.index_dir)
         except RuntimeError as e:
             print(f"[ProductMatcher] product index unavailable "
                   f"(local + GCS both failed) — annotations DISABLED. {e}")
             return
+        except ValueError as e:
+            print(f"[ProductMatcher] product index unreadable — annotations DISABLED. {e}")
+            return
 
-        data = np.load(emb_path, allow_pickle=True)
-        embeddings = data["embeddings"].astype(np.float32)
         with open(meta_path, "r", encoding="utf-8") as f:
             products = json.load(f)["products"]
 
-        if embeddings.shape[0] != len(products):
+        if e_norm.shape[0] != len(products):
             print(f"[ProductMatcher] WARNING: shape mismatch — "
-                  f"{embeddings.shape[0]} embeddings vs {len(products)} metadata entries "
+                  f"{e_norm.shape[0]} embeddings vs {len(products)} metadata entries "
                   f"— product matching DISABLED")
             return
 
         self.products = products
-        self.embeddings = embeddings
-        # Pre-normalize once at startup — reused for every batch query
-        self._e_norm = embeddings / (
-            np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-10
-        )
+        self._e_norm = e_norm
         self.enabled = True
         print(f"[ProductMatcher] loaded {len(self.products)} products "
-              f"(pre-normalized; MongoDB grounding mode)")
+              f"(pre-normalized {self._e_norm.dtype_name}, "
+              f"{self._e_norm.nbytes / (1024 * 1024):.1f} MB; MongoDB grounding mode)")
 
     def batch_find_product_candidates(self, ingredients: List[str]) -> Dict[str, Optional[Dict]]:
         """
@@ -1004,11 +1510,17 @@ class ProductMatcher:
         if not self.enabled or not ingredients:
             return {ing: None for ing in ingredients}
 
-        self._prune_match_cache()
-        uncached = [ing for ing in ingredients if ing not in self._match_cache]
+        results: Dict[str, Optional[Dict]] = {}
+        uncached = []
+        for ing in ingredients:
+            cached = self._match_cache.get(ing)
+            if cached is MISSING:
+                uncached.append(ing)
+            else:
+                results[ing] = cached
+        uncached = list(dict.fromkeys(uncached))
         if uncached:
-            q = self.model.encode(uncached, convert_to_numpy=True).astype(np.float32)
-            q_norm = q / (np.linalg.norm(q, axis=1, keepdims=True) + 1e-10)
+            q_norm = normalize_rows(self.model.encode(uncached, convert_to_numpy=True))
             # (n_products, n_ingredients) — single matrix multiply for all ingredients
             sims = self._e_norm @ q_norm.T
 
@@ -1016,21 +1528,19 @@ class ProductMatcher:
                 col_sims = sims[:, i]
                 best_idx = int(np.argmax(col_sims))
                 best_score = float(col_sims[best_idx])
+                candidate = None
                 if best_score >= self.threshold:
                     p = self.products[best_idx]
-                    self._match_cache[ing] = {
+                    candidate = {
                         "product_id": str(p.get("product_id", "")).strip(),
                         "barcode": str(p.get("barcode", "")).strip(),
                         "description": str(p.get("description", "")).strip(),
                         "rank": 1,
                     }
-                else:
-                    self._match_cache[ing] = None
-                self._match_cache_created[ing] = time.time()
-
-            self._prune_match_cache()
+                self._match_cache.put(ing, candidate)
+                results[ing] = candidate
 
-        return {ing: self._match_cache.get(ing) for ing in ingredients}
+        return {ing: results.get(ing) for ing in ingredients}
 
     def find_query_product_candidates(self, query: str, top_k: int = 20) -> List[Dict]:
         """
@@ -1039,10 +1549,9 @@ class ProductMatcher:
         """
         if not self.enabled or not query.strip():
             return []
-        q = self.model.encode([query], convert_to_numpy=True).astype(np.float32)
-        q_norm = q / (np.linalg.norm(q, axis=1, keepdims=True) + 1e-10)
-        sims = (self._e_norm @ q_norm.T).flatten()
-        top_idx = np.argsort(sims)[::-1][:top_k]
+        q_norm = normalize_rows(self.model.encode([query], convert_to_numpy=True))[0]
+        sims = self._e_norm @ q_norm
+        top_idx = top_k_indices(sims, top_k)
 
         candidates = []
         for idx in top_idx:
@@ -1061,6 +1570,34 @@ class ProductMatcher:
 # Main RAG orchestrator
 # ---------------------------------------------------------------------------
 
+def build_cached_encoder(embedding_model_name: str = EMBEDDING_MODEL_NAME) -> CachedEncoder:
+    """
+    Load the sentence-transformers model and wrap it as
+    model -> BatchingEncoder -> CachedEncoder.
+    """
+    if SentenceTransformer is None:
+        raise RuntimeError("sentence-transformers not installed")
+    print(f"[RecipeRAG] loading embedding model: {embedding_model_name} "
+          f"({EMBEDDING_BACKEND})")
+    model = load_embedding_model(embedding_model_name, EMBEDDING_BACKEND,
+                                 EMBEDDING_ONNX_FILE)
+    if EMBED_BATCH_WAIT_MS > 0:
+        model = BatchingEncoder(model, EMBED_BATCH_MAX, EMBED_BATCH_WAIT_MS)
+    return CachedEncoder(
+        model,
+        EmbeddingCache(EMBEDDING_CACHE_MAX, EMBEDDING_CACHE_TTL_SECONDS),
+    )
+
+
+def _ensure_rag_indexes(index_dir: str = INDEX_DIR) -> None:
+    """Download every index file the configured layout needs, in parallel."""
+    index_format = RAG_INDEX_FORMAT
+    if index_format == "auto":
+        local_npy = os.path.exists(os.path.join(index_dir, "recipe_index.meta.json"))
+        index_format = "npy" if local_npy else "npz"
+    ensure_all_indexes(index_dir, index_format=index_format)
+
+
 class RecipeRAG:
     """
     End-to-end RAG with multi-turn chat support and MongoDB product grounding.
@@ -1081,54 +1618,134 @@ class RecipeRAG:
     def __init__(self,
                  index_dir: str = INDEX_DIR,
                  max_turns: int = MAX_TURNS_PER_SESSION,
-                 embedding_model_name: str = EMBEDDING_MODEL_NAME):
-        if SentenceTransformer is None:
-            raise RuntimeError("sentence-transformers not installed")
-
-        print(f"[RecipeRAG] loading embedding model: {embedding_model_name}")
-        self.model = SentenceTransformer(embedding_model_name)
-
-        self.retriever = RecipeRetriever(self.model, index_dir)
-        self.product_matcher = ProductMatcher(self.model, index_dir)
-        self.mongo_resolver = MongoProductResolver()
-        self.llm = LLMClient()
+                 embedding_model_name: str = EMBEDDING_MODEL_NAME,
+                 sessions: Optional[StateStore] = None,
+                 context_store: Optional[StateStore] = None,
+                 encoder: Optional[CachedEncoder] = None,
+                 retriever: Optional["RecipeRetriever"] = None,
+                 product_matcher: Optional["ProductMatcher"] = None,
+                 mongo_resolver: Optional[MongoProductResolver] = None,
+                 llm: Optional[LLMClient] = None):
+        # Components not passed in are built here, one after another;
+        # warm_start() builds them concurrently and passes them in.
+        if encoder is None:
+            encoder = build_cached_encoder(embedding_model_name)
+        self.model = encoder.model
+        # One cache in front of the model: the chat query is embedded once and
+        # reused by both the recipe search and the product pre-fetch.
+        self.encoder = encoder
+
+        self.retriever = retriever or RecipeRetriever(self.encoder, index_dir)
+        self.product_matcher = product_matcher or ProductMatcher(self.encoder, index_dir)
+        self.mongo_resolver = mongo_resolver or MongoProductResolver(index_dir)
+        self.llm = llm or LLMClient()
 
         self.max_turns = max_turns
-        self.sessions: Dict[str, List[Dict]] = {}
+        # session_id → chat history; RAG_STATE_STORE picks the backend so
+        # several instances can serve the same conversation.
+        self.sessions = sessions or make_state_store(
+            "sessions", SESSION_TTL_SECONDS, SESSION_STORE_MAX)
         # context_id → list of confirmed MongoDB lookup keys for that turn
-        self._context_store: Dict[str, List[Dict]] = {}
-        self._context_store_created: Dict[str, float] = {}
-        self._CONTEXT_STORE_MAX = 500
+        self._context_store = context_store or make_state_store(
+            "contexts", CONTEXT_STORE_TTL_SECONDS, CONTEXT_STORE_MAX)
+        self._grounding_pool = ThreadPoolExecutor(
+            max_workers=GROUNDING_WORKERS, thread_name_prefix="grounding")
+        self._speculation = Counter()   # started / used / discarded / failed
+        self._speculation_lock = threading.Lock()
         print(f"[RecipeRAG] ready (max {max_turns} turns/session)")
 
+    @classmethod
+    def warm_start(cls, index_dir: str = INDEX_DIR,
+                   status: Optional[Dict[str, Dict]] = None,
+                   **kwargs) -> "RecipeRAG":
+        """
+        Build a RecipeRAG with its slow components loaded concurrently:
+        index download (GCS), embedding model, Mongo resolver (connection +
+        BM25 index) and LLM client in parallel, then the recipe retriever
+        and product matcher (which need the indexes and the model).
+
+        `status` (if given) is filled with per-component progress for a
+        readiness probe: {name: {"state": pending|loading|ready|degraded|
+        failed, "seconds": float, "error": str}}. Raises if the recipe
+        retriever cannot be built.
+        """
+        status = status if status is not None else {}
+        components = ["indexes", "embedding_model", "mongo", "llm",
+                      "retriever", "product_matcher"]
+        for name in components:
+            status[name] = {"state": "pending"}
+
+        def load(name, fn, *args):
+            status[name] = {"state": "loading"}
+            started = time.monotonic()
+            try:
+                value = fn(*args)
+            except Exception as e:
+                status[name] = {"state": "failed",
+                                "seconds": round(time.monotonic() - started, 2),
+                                "error": str(e)}
+                raise
+            enabled = getattr(value, "enabled", True)
+            status[name] = {"state": "ready" if enabled else "degraded",
+                            "seconds": round(time.monotonic() - started, 2)}
+            return value
+
+        embedding_model_name = kwargs.pop("embedding_model_name", EMBEDDING_MODEL_NAME)
+        with ThreadPoolExecutor(max_workers=4, thread_name_prefix="warmup") as pool:
+            indexes = pool.submit(load, "indexes", _ensure_rag_indexes, index_dir)
+            encoder = pool.submit(load, "embedding_model",
+                                  build_cached_encoder, embedding_model_name)
+            mongo = pool.submit(load, "mongo", MongoProductResolver, index_dir)
+            llm = pool.submit(load, "llm", LLMClient)
+
+            try:
+                indexes.result()
+            except Exception as e:
+                # Not fatal by itself: the loaders below fetch what they
+                # need file by file and fail on their own if it is missing.
+                print(f"[RecipeRAG] index prefetch failed: {e}")
+            encoder = encoder.result()
+            retriever = pool.submit(load, "retriever", RecipeRetriever, encoder, index_dir)
+            matcher = pool.submit(load, "product_matcher", ProductMatcher, encoder, index_dir)
+
+            return cls(index_dir=index_dir, encoder=encoder,
+                       retriever=retriever.result(),
+                       product_matcher=matcher.result(),
+                       mongo_resolver=mongo.result(), llm=llm.result(),
+                       **kwargs)
+
+    def encoder_stats(self) -> Dict:
+        """Micro-batching metrics ({} when batching is disabled)."""
+        if isinstance(self.model, BatchingEncoder):
+            return self.model.stats()
+        return {}
+
+    def cache_stats(self) -> Dict[str, Dict]:
+        """Hit/miss/eviction counters for every in-process cache."""
+        stats = {
+            "embedding": self.encoder.cache.stats(),
+            "product_match": self.product_matcher._match_cache.stats(),
+            "description": self.mongo_resolver._description_cache.stats(),
+        }
+        bm25_index = self.mongo_resolver._bm25_index
+        if bm25_index is not None:
+            stats["bm25_query"] = bm25_index.query_scores.stats()
+        return stats
+
     # -- session management -------------------------------------------------
 
     def reset_session(self, session_id: str):
-        self.sessions.pop(session_id, None)
+        self.sessions.delete(session_id)
 
-    def turn_count(self, session_id: str) -> int:
-        return len(self.sessions.get(session_id, [])) // 2
+    def _load_history(self, session_id: str) -> List[Dict]:
+        """Copy of the stored history; a turn persists via sessions.append."""
+        return list(self.sessions.get(session_id) or [])
 
-    def _purge_context_store(self):
-        if not self._context_store:
-            return
-        now = time.time()
-        expired = [
-            key for key, created in self._context_store_created.items()
-            if now - created > CONTEXT_STORE_TTL_SECONDS
-        ]
-        for key in expired:
-            self._context_store.pop(key, None)
-            self._context_store_created.pop(key, None)
-
-        while len(self._context_store) > self._CONTEXT_STORE_MAX:
-            oldest_key = next(iter(self._context_store))
-            self._context_store.pop(oldest_key, None)
-            self._context_store_created.pop(oldest_key, None)
+    def turn_count(self, session_id: str) -> int:
+        return len(self._load_history(session_id)) // 2
 
     def get_context_products(self, context_id: str) -> Optional[List[Dict]]:
         """Return MongoDB lookup keys stored for a given recipe context id."""
-        self._purge_context_store()
         return self._context_store.get(context_id)
 
     # -- context building ---------------------------------------------------
@@ -1281,6 +1898,65 @@ class RecipeRAG:
             ingredient_candidates,
         )
 
+    def _count_speculation(self, outcome: str, n: int = 1):
+        with self._speculation_lock:
+            self._speculation[outcome] += n
+
+    def speculation_stats(self) -> Dict[str, int]:
+        with self._speculation_lock:
+            return dict(self._speculation)
+
+    def close(self):
+        """
+        Stop background work: pending speculative grounding is cancelled
+        (running resolutions are waited for) and the BM25 refresher stops.
+        """
+        self._grounding_pool.shutdown(wait=True, cancel_futures=True)
+        self.mongo_resolver.stop_refresh()
+
+    def _start_speculative_grounding(self, user_query: str,
+                                     results: List[Dict]) -> Dict[int, Future]:
+        """
+        Resolve products for the top retrieved recipes in the background
+        while the LLM runs. Keyed by position in `results`.
+        """
+        if (SPECULATIVE_RECIPES <= 0 or not results
+                or not self._query_requests_detailed_recipe(user_query)):
+            return {}
+        futures = {
+            pos: self._grounding_pool.submit(self._resolve_recipe_products, recipe)
+            for pos, recipe in enumerate(results[:SPECULATIVE_RECIPES])
+        }
+        self._count_speculation("started", len(futures))
+        return futures
+
+    def _discard_speculation(self, futures: Dict[int, Future]):
+        for future in futures.values():
+            # Already-running resolutions cannot be interrupted; their result
+            # is simply never read.
+            future.cancel()
+        self._count_speculation("discarded", len(futures))
+        futures.clear()
+
+    def _ground_answer(self, turn: Dict, recipe: Optional[Dict]) -> Dict:
+        """Products for the answered recipe, from the speculation when it matches."""
+        futures = turn["speculative"]
+        pos = next(
+            (i for i, result in enumerate(turn["results"]) if result is recipe),
+            None,
+        )
+        future = futures.pop(pos, None)
+        self._discard_speculation(futures)
+        if future is not None:
+            try:
+                resolved = future.result()
+                self._count_speculation("used")
+                return resolved
+            except Exception as e:
+                self._count_speculation("failed")
+                print(f"[RecipeRAG] speculative grounding failed, resolving again: {e}")
+        return self._resolve_recipe_products(recipe)
+
     def _append_mongo_matches_to_answer(self, answer: str, matches: List[Dict]) -> str:
         if not matches:
             return answer
@@ -1336,36 +2012,45 @@ class RecipeRAG:
 
     # -- core query ---------------------------------------------------------
 
-    def chat(self, session_id: str, user_query: str, top_k: int = 3) -> Dict:
+    def _limit_reached_response(self, session_id: str) -> Dict:
+        return {
+            "answer": (f"You've reached the {self.max_turns}-message limit "
+                       "for this conversation. Please start a new chat to "
+                       "continue exploring recipes."),
+            "sources": [],
+            "turns": self.turn_count(session_id),
+            "limit_reached": True,
+            "product_candidate_names": [],
+            "products_pending": False,
+            "recipe_context_id": None,
+        }
+
+    def _llm_error_response(self, session_id: str, error: Exception) -> Dict:
+        return {
+            "answer": f"Sorry, all LLM providers are busy right now. {error}",
+            "sources": [],
+            "turns": self.turn_count(session_id),
+            "limit_reached": False,
+            "error": True,
+            "product_candidate_names": [],
+            "products_pending": False,
+            "recipe_context_id": None,
+        }
+
+    def _prepare_turn(self, session_id: str, user_query: str, top_k: int) -> Dict:
         """
-        Multi-turn RAG chat. Returns the LLM answer immediately together with
-        a recipe_context_id that the caller uses to fetch product cards via
-        GET /api/recipe/products?context_id=... (products_pending=True signals this).
+        Retrieve recipes, build the grounded prompt and append the user
+        message to a copy of the session history (stored by _finish_turn
+        once answered). Returns the state _finish_turn needs.
         """
-        history = self.sessions.setdefault(session_id, [])
-
-        if self.turn_count(session_id) >= self.max_turns:
-            return {
-                "answer": (f"You've reached the {self.max_turns}-message limit "
-                           "for this conversation. Please start a new chat to "
-                           "continue exploring recipes."),
-                "sources": [],
-                "turns": self.turn_count(session_id),
-                "limit_reached": True,
-                "product_candidate_names": [],
-                "products_pending": False,
-                "recipe_context_id": None,
-            }
+        history = self._load_history(session_id)
 
         # 1. Retrieve recipes
         results = self.retriever.search(user_query, top_k=top_k)
 
         # Product cards are still resolved after the LLM answer is known, but
         # generation gets a Mongo-grounded product constraint up front.
-        mongo_products: List[Dict] = []
         mongo_names: List[str] = self._prefetch_query_product_names(user_query)
-        confirmed_lookups: List[Dict] = []
-        ingredient_matches: List[Dict] = []
 
         # 2. Prepare a context id. It is only exposed if this answer needs product cards.
         context_id = str(uuid.uuid4())
@@ -1382,22 +2067,22 @@ class RecipeRAG:
                         f"\n\nUser: {user_query}")
 
         history.append({"role": "user", "content": user_msg})
+        return {
+            "history": history,
+            "results": results,
+            "mongo_names": mongo_names,
+            "context_id": context_id,
+            # Product grounding for the likely recipe, overlapping generation
+            "speculative": self._start_speculative_grounding(user_query, results),
+        }
 
-        # 5. Generate via cascade
-        try:
-            answer = self.llm.generate(CHAT_SYSTEM_PROMPT, history)
-        except RuntimeError as e:
-            history.pop()
-            return {
-                "answer": f"Sorry, all LLM providers are busy right now. {e}",
-                "sources": [],
-                "turns": self.turn_count(session_id),
-                "limit_reached": False,
-                "error": True,
-                "product_candidate_names": [],
-                "products_pending": False,
-                "recipe_context_id": None,
-            }
+    def _finish_turn(self, session_id: str, user_query: str, turn: Dict,
+                     answer: str) -> Dict:
+        """Ground the answer in Mongo products, record it and build the response."""
+        results = turn["results"]
+        context_id = turn["context_id"]
+        mongo_names = turn["mongo_names"]
+        confirmed_lookups: List[Dict] = []
 
         should_attach_products = self._should_attach_products(
             user_query,
@@ -1405,29 +2090,28 @@ class RecipeRAG:
         )
         if should_attach_products:
             answered_recipe = self._select_recipe_for_answer(results, answer, user_query)
-            resolved = self._resolve_recipe_products(answered_recipe)
+            resolved = self._ground_answer(turn, answered_recipe)
             mongo_products = resolved["products"]
             ingredient_matches = resolved["matches"]
             mongo_names = [p["product_name"] for p in mongo_products]
             confirmed_lookups = [p["lookup"] for p in mongo_products]
             answer = self._append_mongo_matches_to_answer(answer, ingredient_matches)
+        else:
+            self._discard_speculation(turn["speculative"])
 
-        history.append({"role": "assistant", "content": answer})
+        turn["history"].append({"role": "assistant", "content": answer})
+        # Append just this turn's user/assistant pair rather than writing the
+        # whole list back, so a concurrent turn on the session is not lost.
+        self.sessions.append(session_id, turn["history"][-2:])
 
         products_pending = bool(confirmed_lookups) and should_attach_products
 
         if products_pending:
-            self._purge_context_store()
-            self._context_store[context_id] = confirmed_lookups
-            self._context_store_created[context_id] = time.time()
-            self._purge_context_store()
+            self._context_store.set(context_id, confirmed_lookups)
 
         return {
             "answer": answer,
-            "sources": [
-                {"name": r["metadata"].get("name", ""), "score": r["score"]}
-                for r in results
-            ],
+            "sources": self._sources(results),
             "turns": self.turn_count(session_id),
             "limit_reached": self.turn_count(session_id) >= self.max_turns,
             "product_candidate_names": mongo_names if products_pending else [],
@@ -1435,6 +2119,75 @@ class RecipeRAG:
             "recipe_context_id": context_id if products_pending else None,
         }
 
+    def _sources(self, results: List[Dict]) -> List[Dict]:
+        return [
+            {"name": r["metadata"].get("name", ""), "score": r["score"]}
+            for r in results
+        ]
+
+    def chat(self, session_id: str, user_query: str, top_k: int = 3) -> Dict:
+        """
+        Multi-turn RAG chat. Returns the LLM answer immediately together with
+        a recipe_context_id that the caller uses to fetch product cards via
+        GET /api/recipe/products?context_id=... (products_pending=True signals this).
+        """
+        if self.turn_count(session_id) >= self.max_turns:
+            return self._limit_reached_response(session_id)
+
+        turn = self._prepare_turn(session_id, user_query, top_k)
+
+        # 5. Generate via cascade
+        try:
+            answer = self.llm.generate(CHAT_SYSTEM_PROMPT, turn["history"])
+        except RuntimeError as e:
+            self._discard_speculation(turn["speculative"])
+            return self._llm_error_response(session_id, e)
+        except BaseException:
+            self._discard_speculation(turn["speculative"])
+            raise
+
+        return self._finish_turn(session_id, user_query, turn, answer)
+
+    def chat_stream(self, session_id: str, user_query: str,
+                    top_k: int = 3) -> Iterator[Dict]:
+        """
+        Streaming variant of chat(). Yields events:
+          {"event": "sources", "sources": [...]}        once, before generation
+          {"event": "delta", "text": "..."}             per streamed chunk
+          {"event": "done", **chat() response}          after the stream closes
+        "done" carries the final answer, which may differ from the streamed
+        text once ingredient lines are annotated with Mongo products. Product
+        resolution for the likely recipe is started speculatively alongside
+        the stream and is discarded if the turn does not complete.
+        """
+        if self.turn_count(session_id) >= self.max_turns:
+            yield {"event": "done", **self._limit_reached_response(session_id)}
+            return
+
+        turn = self._prepare_turn(session_id, user_query, top_k)
+        yield {"event": "sources", "sources": self._sources(turn["results"])}
+
+        # On error or client disconnect (GeneratorExit at a yield) the
+        # unanswered user message is simply never stored, and the speculative
+        # grounding is discarded unless _finish_turn took ownership of it.
+        parts: List[str] = []
+        finished = False
+        try:
+            try:
+                for delta in self.llm.generate_stream(CHAT_SYSTEM_PROMPT, turn["history"]):
+                    parts.append(delta)
+                    yield {"event": "delta", "text": delta}
+            except RuntimeError as e:
+                yield {"event": "done", **self._llm_error_response(session_id, e)}
+                return
+
+            response = self._finish_turn(session_id, user_query, turn, "".join(parts))
+            finished = True
+            yield {"event": "done", **response}
+        finally:
+            if not finished:
+                self._discard_speculation(turn["speculative"])
+
 
 # ---------------------------------------------------------------------------
 # CLI smoke test
@@ -0,0 +1,255 @@
+"""
+Conversation state for RecipeRAG: chat histories and product contexts.
+
+Both used to be per-process dicts, so once Cloud Run runs more than one
+instance a follow-up turn or /api/recipe/products?context_id=... lands on
+a worker that never saw the first request, and a restart loses everything.
+A StateStore is one namespace of JSON-serialisable values with a TTL:
+
+  - MemoryStateStore  per-process (the previous behaviour), bounded LRU
+  - SQLiteStateStore  a local file shared by the workers of one machine;
+                      handy for tests and single-VM deployments
+  - RedisStateStore   shared by every instance (Memorystore / any Redis)
+
+Expiry is the store's job (TTLCache, an `expires_at` column, Redis EX), so
+callers never scan for stale entries. append() extends a stored list
+atomically (a lock, an IMMEDIATE transaction, WATCH/MULTI), so two
+concurrent chat turns on one session both keep their messages. Select one with RAG_STATE_STORE
+(memory | sqlite | redis); see make_state_store.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, List, Optional
+
+try:
+    from .cache import MISSING, TTLCache   # Flask package
+except ImportError:
+    from cache import MISSING, TTLCache    # CLI direct run
+
+STATE_STORE_BACKEND = os.getenv("RAG_STATE_STORE", "memory").strip().lower()
+STATE_REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0").strip()
+STATE_REDIS_PREFIX = os.getenv("RAG_STATE_REDIS_PREFIX", "discountmate:rag:")
+STATE_SQLITE_PATH = os.getenv(
+    "RAG_STATE_SQLITE_PATH",
+    os.path.join(os.path.dirname(__file__), "index", "rag_state.sqlite3"),
+)
+
+
+class StateStore(ABC):
+    """One namespace of key -> JSON-serialisable value, each with a TTL."""
+
+    def __init__(self, namespace: str, ttl_seconds: float):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        """Stored value, or None when absent or expired."""
+
+    @abstractmethod
+    def set(self, key: str, value: Any) -> None:
+        """Store `value`, (re)starting its TTL."""
+
+    @abstractmethod
+    def append(self, key: str, items: List[Any]) -> None:
+        """
+        Atomically extend the list stored under `key` (a missing or expired
+        entry counts as empty) and restart its TTL.
+        """
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove `key` if present."""
+
+    def size(self) -> Optional[int]:
+        """Live entries, or None when the backend cannot count cheaply."""
+        return None
+
+
+class MemoryStateStore(StateStore):
+    """Per-process store; also bounded to `max_entries` (least recent first)."""
+
+    def __init__(self, namespace: str, ttl_seconds: float, max_entries: int = 5000):
+        super().__init__(namespace, ttl_seconds)
+        self._cache = TTLCache(max_entries, ttl_seconds)
+        self._append_lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._cache.get(key)
+        return None if value is MISSING else value
+
+    def set(self, key: str, value: Any) -> None:
+        self._cache.put(key, value)
+
+    def append(self, key: str, items: List[Any]) -> None:
+        with self._append_lock:
+            current = self.get(key) or []
+            self._cache.put(key, list(current) + list(items))
+
+    def delete(self, key: str) -> None:
+        self._cache.pop(key)
+
+    def size(self) -> Optional[int]:
+        return len(self._cache)
+
+
+class SQLiteStateStore(StateStore):
+    """
+    Store backed by a SQLite file (WAL mode, so several processes on one
+    machine can share it). Expired rows are invisible to get() and are
+    deleted every `sweep_every` writes.
+    """
+
+    def __init__(self, namespace: str, ttl_seconds: float,
+                 path: str = STATE_SQLITE_PATH, sweep_every: int = 100):
+        super().__init__(namespace, ttl_seconds)
+        self.path = path
+        self.sweep_every = sweep_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS rag_state ("
+                " namespace TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS rag_state_expiry ON rag_state (expires_at)"
+            )
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM rag_state"
+                " WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (self.namespace, key, time.time()),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any) -> None:
+        payload = json.dumps(value)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO rag_state (namespace, key, value, expires_at)"
+                " VALUES (?, ?, ?, ?)",
+                (self.namespace, key, payload, now + self.ttl_seconds),
+            )
+            self._writes += 1
+            if self._writes % self.sweep_every == 0:
+                self._conn.execute("DELETE FROM rag_state WHERE expires_at <= ?", (now,))
+
+    def append(self, key: str, items: List[Any]) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            # IMMEDIATE takes the write lock before the read, so another
+            # process cannot slip a write in between
+            self._conn.execute("BEGIN IMMEDIATE")
+            row = self._conn.execute(
+                "SELECT value FROM rag_state"
+                " WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (self.namespace, key, now),
+            ).fetchone()
+            current = json.loads(row[0]) if row else []
+            self._conn.execute(
+                "INSERT OR REPLACE INTO rag_state (namespace, key, value, expires_at)"
+                " VALUES (?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(current + list(items)),
+                 now + self.ttl_seconds),
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM rag_state WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            )
+
+    def size(self) -> Optional[int]:
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM rag_state WHERE namespace = ? AND expires_at > ?",
+                (self.namespace, time.time()),
+            ).fetchone()
+        return int(count)
+
+
+class RedisStateStore(StateStore):
+    """Store shared by every instance; entries expire via Redis EX."""
+
+    def __init__(self, namespace: str, ttl_seconds: float,
+                 url: str = STATE_REDIS_URL, prefix: str = STATE_REDIS_PREFIX,
+                 client=None):
+        super().__init__(namespace, ttl_seconds)
+        if client is None:
+            import redis   # optional dependency — only needed for this backend
+            client = redis.Redis.from_url(url, socket_timeout=2,
+                                          socket_connect_timeout=2)
+        self._redis = client
+        self._prefix = f"{prefix}{namespace}:"
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self._redis.get(self._prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Any) -> None:
+        self._redis.set(self._prefix + key, json.dumps(value),
+                        ex=max(1, int(self.ttl_seconds)))
+
+    def append(self, key: str, items: List[Any]) -> None:
+        from redis.exceptions import WatchError
+
+        full_key = self._prefix + key
+        with self._redis.pipeline() as pipe:
+            while True:
+                try:
+                    # Optimistic: retried if another writer touches the key
+                    # between the read and the MULTI/EXEC
+                    pipe.watch(full_key)
+                    raw = pipe.get(full_key)
+                    current = json.loads(raw) if raw is not None else []
+                    pipe.multi()
+                    pipe.set(full_key, json.dumps(current + list(items)),
+                             ex=max(1, int(self.ttl_seconds)))
+                    pipe.execute()
+                    return
+                except WatchError:
+                    continue
+
+    def delete(self, key: str) -> None:
+        self._redis.delete(self._prefix + key)
+
+
+def make_state_store(namespace: str, ttl_seconds: float, max_entries: int = 5000,
+                     backend: str = STATE_STORE_BACKEND) -> StateStore:
+    """
+    Store for `namespace` on the configured backend. Falls back to the
+    in-memory store (with a warning) if Redis/SQLite cannot be set up.
+    """
+    try:
+        if backend == "redis":
+            store = RedisStateStore(namespace, ttl_seconds)
+            store._redis.ping()
+            return store
+        if backend == "sqlite":
+            return SQLiteStateStore(namespace, ttl_seconds)
+    except Exception as e:
+        print(f"[state_store] {backend} backend unavailable for '{namespace}' "
+              f"— using in-memory store. {e}")
+    else:
+        if backend != "memory":
+            print(f"[state_store] unknown RAG_STATE_STORE '{backend}' "
+                  f"— using in-memory store")
+    return MemoryStateStore(namespace, ttl_seconds, max_entries)
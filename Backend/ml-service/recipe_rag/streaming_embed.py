@@ -0,0 +1,244 @@
+"""
+Chunked, resumable embedding for the offline index builders.
+
+embed_products / build_recipe_index used to hold every embedding in memory
+and write the index in one go at the end, so a large catalogue needed
+rows x 768 x 4 bytes of RAM and a crash near the end lost the whole run.
+The streaming path instead:
+
+  - preallocates the final npy layout (<stem>.partial.npy, plus
+    <stem>.scales.partial.npy for int8) with np.lib.format.open_memmap and
+    writes each chunk's normalised rows straight into it;
+  - records progress in <stem>.progress.json after every chunk, so a rerun
+    over the same input (same fingerprint, model, dtype) resumes at the
+    first unfinished row;
+  - optionally fans chunks out to a pool of encoder processes, each with its
+    own model and a share of the CPU threads, keeping results in order;
+  - on completion renames the partial files over <stem>.npy and writes the
+    <stem>.meta.json sidecar last (see vector_index.write_matrix_meta).
+
+The output is the same mmap-able layout save_embedding_matrix writes.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from .encoding import load_embedding_model                            # Flask package
+    from .vector_index import (EMBEDDING_DTYPES, EmbeddingMatrix, atomic_output,
+                               normalize_rows, write_matrix_meta)
+except ImportError:
+    from encoding import load_embedding_model                             # CLI direct run
+    from vector_index import (EMBEDDING_DTYPES, EmbeddingMatrix, atomic_output,
+                              normalize_rows, write_matrix_meta)
+
+DEFAULT_CHUNK_ROWS = 4096
+
+
+def fingerprint_texts(texts: Iterable[str]) -> Tuple[int, str]:
+    """
+    (row count, digest) of the input rows, in order; a checkpoint only
+    resumes on a matching digest.
+    """
+    digest = hashlib.sha1()
+    rows = 0
+    for text in texts:
+        digest.update(str(text).encode("utf-8"))
+        digest.update(b"\0")
+        rows += 1
+    return rows, digest.hexdigest()
+
+
+class StreamingMatrixWriter:
+    """
+    Fills a preallocated on-disk embedding matrix chunk by chunk.
+
+    `rows_done` is how many leading rows are already written (non-zero when
+    a matching checkpoint was found); callers skip those rows.
+    """
+
+    def __init__(self, index_dir: str, stem: str, rows: int, dim: int,
+                 dtype: str = "float32", fingerprint: str = "",
+                 model_info: Optional[Dict] = None):
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"dtype must be one of {EMBEDDING_DTYPES}, got {dtype!r}")
+        os.makedirs(index_dir, exist_ok=True)
+        self.index_dir = index_dir
+        self.stem = stem
+        self.rows = rows
+        self.dim = dim
+        self.dtype = dtype
+        self.data_path = os.path.join(index_dir, f"{stem}.partial.npy")
+        self.scales_path = (os.path.join(index_dir, f"{stem}.scales.partial.npy")
+                            if dtype == "int8" else None)
+        self.progress_path = os.path.join(index_dir, f"{stem}.progress.json")
+        self._progress = {
+            "stem": stem,
+            "rows": rows,
+            "dim": dim,
+            "dtype": dtype,
+            "fingerprint": fingerprint,
+            "model": model_info or {},
+            "rows_done": 0,
+        }
+        self.rows_done = self._resume_point()
+        mode = "r+" if self.rows_done else "w+"
+        self._data = np.lib.format.open_memmap(
+            self.data_path, mode=mode, dtype=np.dtype(dtype), shape=(rows, dim))
+        self._scales = None
+        if self.scales_path:
+            self._scales = np.lib.format.open_memmap(
+                self.scales_path, mode=mode, dtype=np.float32, shape=(rows,))
+        if self.rows_done:
+            print(f"  [{stem}] resuming at row {self.rows_done:,} of {rows:,}")
+
+    def _resume_point(self) -> int:
+        if not os.path.exists(self.progress_path):
+            return 0
+        try:
+            with open(self.progress_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        rows_done = int(saved.get("rows_done", 0))
+        same_run = all(saved.get(k) == v for k, v in self._progress.items()
+                       if k != "rows_done")
+        files_ok = os.path.exists(self.data_path) and (
+            self.scales_path is None or os.path.exists(self.scales_path))
+        if not (same_run and files_ok and 0 < rows_done <= self.rows):
+            print(f"  [{self.stem}] checkpoint does not match this input — starting over")
+            return 0
+        return rows_done
+
+    def write(self, start: int, embeddings: np.ndarray) -> None:
+        """Store raw embeddings for rows [start, start + len) and checkpoint."""
+        if start != self.rows_done:
+            raise ValueError(f"expected rows from {self.rows_done}, got {start}")
+        stop = start + embeddings.shape[0]
+        block = EmbeddingMatrix.from_normalized(normalize_rows(embeddings), self.dtype)
+        self._data[start:stop] = block.data
+        self._data.flush()
+        if self._scales is not None:
+            self._scales[start:stop] = block.scales
+            self._scales.flush()
+        self.rows_done = stop
+        self._progress["rows_done"] = stop
+        with atomic_output(self.progress_path, "w") as f:
+            json.dump(self._progress, f)
+
+    def finalize(self, extra: Optional[Dict] = None) -> List[str]:
+        """Move the completed matrix into place; returns the written paths."""
+        if self.rows_done != self.rows:
+            raise RuntimeError(f"{self.stem}: only {self.rows_done}/{self.rows} rows written")
+        del self._data, self._scales   # close the memmaps before renaming
+        written = [os.path.join(self.index_dir, f"{self.stem}.npy")]
+        os.replace(self.data_path, written[0])
+        scales_name = None
+        if self.scales_path:
+            scales_name = f"{self.stem}.scales.npy"
+            written.append(os.path.join(self.index_dir, scales_name))
+            os.replace(self.scales_path, written[-1])
+        written.append(write_matrix_meta(self.index_dir, self.stem,
+                                         (self.rows, self.dim), self.dtype,
+                                         scales_name, extra))
+        if os.path.exists(self.progress_path):
+            os.remove(self.progress_path)
+        return written
+
+
+# ---------------------------------------------------------------------------
+# Encoder pool
+# ---------------------------------------------------------------------------
+
+_worker_model = None
+
+
+def _init_worker(model_name: str, backend: str, onnx_file: Optional[str],
+                 threads: int) -> None:
+    global _worker_model
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    # strict: a worker silently on PyTorch would mix backends in one matrix
+    _worker_model = load_embedding_model(model_name, backend, onnx_file, strict=True)
+
+
+def _encode_in_worker(texts: List[str], batch_size: int) -> np.ndarray:
+    return _worker_model.encode(texts, batch_size=batch_size,
+                                convert_to_numpy=True).astype(np.float32)
+
+
+def embed_stream(
+    chunks: Iterable[Sequence[str]],
+    writer: StreamingMatrixWriter,
+    model=None,
+    model_spec: Optional[Dict] = None,
+    workers: int = 1,
+    batch_size: int = 64,
+) -> None:
+    """
+    Encode `chunks` (consecutive slices of the writer's rows) into `writer`,
+    skipping rows it already holds.
+
+    With workers > 1, `model_spec` ({"model_name", "backend", "onnx_file"})
+    is loaded in each of `workers` spawned processes; otherwise `model` is
+    used in-process.
+    """
+    start_time = time.time()
+    resumed = writer.rows_done
+    pending = _pending_chunks(chunks, writer.rows_done)
+
+    if workers <= 1:
+        for start, texts in pending:
+            embeddings = model.encode(list(texts), batch_size=batch_size,
+                                      convert_to_numpy=True).astype(np.float32)
+            writer.write(start, embeddings)
+            _report(writer, resumed, start_time)
+        return
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    ctx = multiprocessing.get_context("spawn")   # torch is not fork-safe
+    with ctx.Pool(workers, initializer=_init_worker,
+                  initargs=(model_spec["model_name"], model_spec.get("backend", "torch"),
+                            model_spec.get("onnx_file"), threads)) as pool:
+        # Keep a bounded number of chunks in flight so the input is still
+        # read lazily; results are written back in submission order.
+        in_flight = deque()
+        for start, texts in pending:
+            in_flight.append((start, pool.apply_async(_encode_in_worker,
+                                                      (list(texts), batch_size))))
+            if len(in_flight) >= workers * 2:
+                done_start, result = in_flight.popleft()
+                writer.write(done_start, result.get())
+                _report(writer, resumed, start_time)
+        while in_flight:
+            done_start, result = in_flight.popleft()
+            writer.write(done_start, result.get())
+            _report(writer, resumed, start_time)
+
+
+def _pending_chunks(chunks: Iterable[Sequence[str]], skip_rows: int):
+    """(first row, texts) for every chunk, trimmed to rows >= skip_rows."""
+    offset = 0
+    for texts in chunks:
+        end = offset + len(texts)
+        if end > skip_rows and len(texts):
+            skip = max(0, skip_rows - offset)
+            yield offset + skip, texts[skip:]
+        offset = end
+
+
+def _report(writer: StreamingMatrixWriter, resumed: int, start_time: float) -> None:
+    elapsed = time.time() - start_time
+    rate = (writer.rows_done - resumed) / elapsed if elapsed > 0 else 0.0
+    print(f"  [{writer.stem}] {writer.rows_done:,}/{writer.rows:,} rows "
+          f"({rate:.0f} rows/sec)")
@@ -0,0 +1,476 @@
+"""
+Vector search backends for the RAG embedding indexes.
+
+Both backends expose the same interface:
+
+    index.search(q_norm, top_k) -> (indices, scores)
+
+where q_norm is a single L2-normalised query vector and the results are
+ordered best-first.
+
+  - ExactIndex: brute-force cosine similarity over every row. Always
+                correct; cost grows linearly with the corpus.
+  - IVFIndex:   inverted-file approximate index. Rows are clustered
+                offline with spherical k-means (build_recipe_index.py);
+                at query time only the `nprobe` closest clusters are
+                scored, so latency stays roughly flat as the corpus grows.
+
+The IVF artefact (recipe_ann.npz) is optional. If it is missing, was built
+for a different index, or a probe returns too few rows, search falls back
+to the exact backend.
+
+Both backends accept either a float32 ndarray or an EmbeddingMatrix, which
+keeps the normalised rows in float16, or in int8 with a per-row scale, to
+cut resident memory by 2-4x.
+
+On disk, an EmbeddingMatrix can be saved as raw pre-normalised .npy files
+plus a small <stem>.meta.json sidecar. Those load with mmap_mode="r": no
+decompression or normalisation at startup, and gunicorn workers on the same
+host share the page-cache pages instead of each holding a private copy.
+"""
+
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+ANN_FORMAT_VERSION = 1
+DEFAULT_NPROBE = 8
+
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+MATRIX_FORMAT = "npy-v1"
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+@contextmanager
+def atomic_output(path: str, mode: str = "wb", suffix: str = ""):
+    """
+    File handle on a unique temp file beside `path`, moved over `path` on
+    success (and removed on failure). Every index writer goes through this,
+    so concurrent builders or refreshers never share a temp file.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".",
+                                     prefix=f".{os.path.basename(path)}.", suffix=suffix)
+    try:
+        encoding = None if "b" in mode else "utf-8"
+        with os.fdopen(fd, mode, encoding=encoding) as f:
+            yield f
+        os.chmod(temp_path, 0o644)   # mkstemp creates 0600
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Return a float32 copy of `matrix` with every row scaled to unit length."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    return matrix / (np.linalg.norm(matrix, axis=-1, keepdims=True) + 1e-10)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k largest scores, best-first.
+    Uses argpartition so only the selected k are sorted — O(n + k log k).
+    """
+    n = scores.shape[0]
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+    # Sorting the partition first makes ties resolve to the lower index
+    part = np.sort(np.argpartition(-scores, k - 1)[:k])
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+def _assign_to_centroids(
+    e_norm: "MatrixLike",
+    centroids: np.ndarray,
+    chunk_size: int = 8192,
+) -> np.ndarray:
+    """Nearest centroid (by cosine) for every row, computed in chunks."""
+    assign = np.empty(e_norm.shape[0], dtype=np.int32)
+    for start in range(0, e_norm.shape[0], chunk_size):
+        block = np.asarray(e_norm[start:start + chunk_size], dtype=np.float32)
+        assign[start:start + chunk_size] = np.argmax(block @ centroids.T, axis=1)
+    return assign
+
+
+# ---------------------------------------------------------------------------
+# Compact storage
+# ---------------------------------------------------------------------------
+
+class EmbeddingMatrix:
+    """
+    Pre-normalised embedding rows stored as float32, float16 or int8.
+
+    int8 rows carry a per-row scale (row ~= data[i] * scales[i]), so cosine
+    scores stay within ~1e-3 of float32. Products with a query are computed
+    in row chunks that are upcast to float32 on the fly, keeping the BLAS
+    fast path without ever materialising a full float32 copy.
+
+    Supports the subset of the ndarray interface the search code uses:
+    `matrix @ q`, `matrix[ids]` (returns float32 rows) and `.shape`.
+    """
+
+    def __init__(self, data: np.ndarray, scales: Optional[np.ndarray] = None,
+                 chunk_size: int = 8192):
+        self.data = data
+        self.scales = scales
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_normalized(cls, e_norm: np.ndarray, dtype: str = "float32") -> "EmbeddingMatrix":
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"dtype must be one of {EMBEDDING_DTYPES}, got {dtype!r}")
+        if dtype == "float32":
+            return cls(np.ascontiguousarray(e_norm, dtype=np.float32))
+        if dtype == "float16":
+            return cls(np.ascontiguousarray(e_norm, dtype=np.float16))
+        scales = (np.abs(e_norm).max(axis=1) / 127.0).astype(np.float32)
+        scales[scales == 0] = 1.0
+        data = np.clip(np.rint(e_norm / scales[:, None]), -127, 127).astype(np.int8)
+        return cls(data, scales)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.data.shape
+
+    @property
+    def dtype_name(self) -> str:
+        return str(self.data.dtype)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0))
+
+    def _rows(self, key) -> np.ndarray:
+        rows = self.data[key].astype(np.float32)
+        if self.scales is not None:
+            scales = self.scales[key]
+            rows *= scales[..., None] if rows.ndim == 2 else scales
+        return rows
+
+    def __getitem__(self, key) -> np.ndarray:
+        return self._rows(key)
+
+    def __len__(self) -> int:
+        return self.data.shape[0]
+
+    def __matmul__(self, q: np.ndarray) -> np.ndarray:
+        q = np.asarray(q, dtype=np.float32)
+        if self.data.dtype == np.float32:
+            return self.data @ q
+        n_rows = self.data.shape[0]
+        out = np.empty((n_rows,) + q.shape[1:], dtype=np.float32)
+        for start in range(0, n_rows, self.chunk_size):
+            stop = min(start + self.chunk_size, n_rows)
+            block = self.data[start:stop].astype(np.float32) @ q
+            if self.scales is not None:
+                scales = self.scales[start:stop]
+                block *= scales[:, None] if block.ndim == 2 else scales
+            out[start:stop] = block
+        return out
+
+
+MatrixLike = Union[np.ndarray, EmbeddingMatrix]
+
+
+def compact_embeddings(embeddings: np.ndarray, dtype: str = "float32") -> EmbeddingMatrix:
+    """
+    Normalise raw embeddings in place and return them as an EmbeddingMatrix.
+    The caller should drop its reference to `embeddings` afterwards so only
+    the compact copy stays resident.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-10
+    return EmbeddingMatrix.from_normalized(embeddings, dtype)
+
+
+def _atomic_save_npy(path: str, array: np.ndarray) -> None:
+    # Write beside the target, then rename: workers that already mmap the old
+    # file keep reading its (unlinked) inode until they reload.
+    with atomic_output(path) as f:
+        np.save(f, array)
+
+
+def save_embedding_matrix(
+    index_dir: str,
+    stem: str,
+    embeddings: np.ndarray,
+    dtype: str = "float32",
+    extra: Optional[Dict] = None,
+) -> List[str]:
+    """
+    Normalise `embeddings` and write the mmap-friendly layout:
+
+        <stem>.npy          normalised rows in `dtype`
+        <stem>.scales.npy   per-row scales (int8 only)
+        <stem>.meta.json    sidecar describing the files above
+
+    Returns the written paths; the sidecar is written last so a reader never
+    sees it pointing at a half-written matrix.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    matrix = EmbeddingMatrix.from_normalized(normalize_rows(embeddings), dtype)
+
+    data_name = f"{stem}.npy"
+    written = [os.path.join(index_dir, data_name)]
+    _atomic_save_npy(written[0], matrix.data)
+
+    scales_name = None
+    if matrix.scales is not None:
+        scales_name = f"{stem}.scales.npy"
+        written.append(os.path.join(index_dir, scales_name))
+        _atomic_save_npy(written[-1], matrix.scales)
+
+    written.append(write_matrix_meta(index_dir, stem, matrix.shape, dtype,
+                                     scales_name, extra))
+    return written
+
+
+def write_matrix_meta(
+    index_dir: str,
+    stem: str,
+    shape: Tuple[int, int],
+    dtype: str,
+    scales_name: Optional[str] = None,
+    extra: Optional[Dict] = None,
+) -> str:
+    """
+    Atomically write the <stem>.meta.json sidecar for <stem>.npy (and
+    `scales_name`). Call it only once the data files are in place.
+    """
+    data_name = f"{stem}.npy"
+    meta = {
+        "format": MATRIX_FORMAT,
+        "rows": int(shape[0]),
+        "dim": int(shape[1]),
+        "dtype": dtype,
+        "normalized": True,
+        "data_file": data_name,
+        "scales_file": scales_name,
+        "files": [data_name] + ([scales_name] if scales_name else []),
+    }
+    meta.update(extra or {})
+    meta_path = os.path.join(index_dir, f"{stem}.meta.json")
+    with atomic_output(meta_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta_path
+
+
+def read_matrix_meta(meta_path: str) -> Dict:
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("format") != MATRIX_FORMAT:
+        raise ValueError(f"{meta_path}: unsupported matrix format {meta.get('format')!r}")
+    return meta
+
+
+def load_embedding_matrix(meta_path: str, mmap: bool = True) -> EmbeddingMatrix:
+    """
+    Open a matrix written by save_embedding_matrix. With mmap=True the rows
+    stay on disk (page cache) and are only faulted in as queries touch them.
+    """
+    meta = read_matrix_meta(meta_path)
+    index_dir = os.path.dirname(meta_path)
+    mmap_mode = "r" if mmap else None
+    data = np.load(os.path.join(index_dir, meta["data_file"]), mmap_mode=mmap_mode)
+    if data.shape != (meta["rows"], meta["dim"]) or str(data.dtype) != meta["dtype"]:
+        raise ValueError(
+            f"{meta_path}: sidecar says {(meta['rows'], meta['dim'])} "
+            f"{meta['dtype']} but {meta['data_file']} is {data.shape} {data.dtype}"
+        )
+    scales = None
+    if meta.get("scales_file"):
+        scales = np.load(os.path.join(index_dir, meta["scales_file"]), mmap_mode=mmap_mode)
+    return EmbeddingMatrix(data, scales)
+
+
+# ---------------------------------------------------------------------------
+# Backends
+# ---------------------------------------------------------------------------
+
+class ExactIndex:
+    """Brute-force cosine search over a pre-normalised matrix."""
+
+    name = "exact"
+
+    def __init__(self, e_norm: MatrixLike):
+        self.e_norm = e_norm
+
+    def search(self, q_norm: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        sims = self.e_norm @ q_norm
+        top_idx = top_k_indices(sims, top_k)
+        return top_idx, sims[top_idx]
+
+
+class IVFIndex:
+    """
+    Inverted-file ANN index over a pre-normalised matrix.
+
+    list_ids holds every row id grouped by cluster; the rows of cluster c
+    are list_ids[list_offsets[c]:list_offsets[c + 1]].
+    """
+
+    name = "ivf"
+
+    def __init__(self,
+                 e_norm: MatrixLike,
+                 centroids: np.ndarray,
+                 list_offsets: np.ndarray,
+                 list_ids: np.ndarray,
+                 nprobe: int = DEFAULT_NPROBE):
+        self.e_norm = e_norm
+        self.centroids = centroids.astype(np.float32)
+        self.list_offsets = list_offsets.astype(np.int64)
+        self.list_ids = list_ids.astype(np.int64)
+        self.nprobe = max(1, min(int(nprobe), self.centroids.shape[0]))
+        self._exact = ExactIndex(e_norm)
+
+    @property
+    def nlist(self) -> int:
+        return int(self.centroids.shape[0])
+
+    def _candidates(self, q_norm: np.ndarray, nprobe: int) -> np.ndarray:
+        probe = top_k_indices(self.centroids @ q_norm, nprobe)
+        lists = [
+            self.list_ids[self.list_offsets[c]:self.list_offsets[c + 1]]
+            for c in probe
+        ]
+        return np.concatenate(lists) if lists else np.empty(0, dtype=np.int64)
+
+    def search(self, q_norm: np.ndarray, top_k: int,
+               nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        candidates = self._candidates(q_norm, nprobe or self.nprobe)
+        if candidates.shape[0] < top_k:
+            # Probed clusters are too small to fill the page — stay correct.
+            return self._exact.search(q_norm, top_k)
+        sims = self.e_norm[candidates] @ q_norm
+        best = top_k_indices(sims, top_k)
+        return candidates[best], sims[best]
+
+
+# ---------------------------------------------------------------------------
+# Build / persist
+# ---------------------------------------------------------------------------
+
+def build_ivf(
+    e_norm: MatrixLike,
+    nlist: Optional[int] = None,
+    n_iter: int = 10,
+    sample_size: int = 50_000,
+    seed: int = 0,
+) -> Dict[str, np.ndarray]:
+    """
+    Cluster a pre-normalised matrix with spherical k-means.
+    Returns the arrays needed by IVFIndex (centroids, list_offsets, list_ids).
+    """
+    n_rows = e_norm.shape[0]
+    if n_rows == 0:
+        raise ValueError("Cannot build an IVF index over an empty matrix")
+    if nlist is None:
+        nlist = int(round(np.sqrt(n_rows)))
+    nlist = max(1, min(int(nlist), n_rows))
+
+    rng = np.random.default_rng(seed)
+    sample_idx = np.sort(rng.choice(n_rows, size=min(sample_size, n_rows), replace=False))
+    sample = np.asarray(e_norm[sample_idx], dtype=np.float32)
+    centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assign = _assign_to_centroids(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            # Re-seed empty clusters from random sample rows
+            sums[empty] = sample[rng.choice(sample.shape[0], size=empty.size)]
+        centroids = normalize_rows(sums)
+
+    assign = _assign_to_centroids(e_norm, centroids)
+    list_ids = np.argsort(assign, kind="stable").astype(np.int64)
+    counts = np.bincount(assign, minlength=nlist)
+    list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    return {
+        "centroids": centroids.astype(np.float32),
+        "list_offsets": list_offsets,
+        "list_ids": list_ids,
+    }
+
+
+def save_ivf(path: str, ivf: Dict[str, np.ndarray], dim: int) -> None:
+    """Write IVF arrays plus the shape they were built for."""
+    with atomic_output(path, suffix=".npz") as f:
+        np.savez(
+            f,
+            centroids=ivf["centroids"],
+            list_offsets=ivf["list_offsets"],
+            list_ids=ivf["list_ids"],
+            row_count=np.array(ivf["list_ids"].shape[0], dtype=np.int64),
+            dim=np.array(dim, dtype=np.int64),
+            format_version=np.array(ANN_FORMAT_VERSION, dtype=np.int64),
+        )
+
+
+def load_ivf(path: str, e_norm: MatrixLike, nprobe: int = DEFAULT_NPROBE) -> IVFIndex:
+    """
+    Load an IVF artefact for `e_norm`.
+    Raises ValueError if it was built for a different index shape.
+    """
+    data = np.load(path)
+    if int(data["format_version"]) != ANN_FORMAT_VERSION:
+        raise ValueError(f"unsupported ANN format version {int(data['format_version'])}")
+    row_count, dim = int(data["row_count"]), int(data["dim"])
+    if (row_count, dim) != tuple(e_norm.shape):
+        raise ValueError(
+            f"ANN index built for {(row_count, dim)} but embeddings are "
+            f"{tuple(e_norm.shape)} — rebuild with build_recipe_index.py"
+        )
+    return IVFIndex(
+        e_norm,
+        data["centroids"],
+        data["list_offsets"],
+        data["list_ids"],
+        nprobe=nprobe,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Quality check
+# ---------------------------------------------------------------------------
+
+def recall_at_k(index, e_norm: MatrixLike, queries: np.ndarray, k: int = 10) -> float:
+    """
+    Mean fraction of the exact top-k that `index` also returns.
+    `queries` must be L2-normalised, one per row.
+    """
+    exact = ExactIndex(e_norm)
+    hits = 0
+    total = 0
+    for q in queries:
+        truth, _ = exact.search(q, k)
+        found, _ = index.search(q, k)
+        hits += len(set(truth.tolist()) & set(found.tolist()))
+        total += len(truth)
+    return hits / total if total else 1.0
+
+
+def sample_queries(e_norm: MatrixLike, n: int = 200, seed: int = 0) -> np.ndarray:
+    """
+    Synthetic queries for recall checks: normalised midpoints of random
+    row pairs, so queries land between recipes rather than exactly on one.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, e_norm.shape[0], size=n)
+    b = rng.integers(0, e_norm.shape[0], size=n)
+    return normalize_rows(np.asarray(e_norm[a], dtype=np.float32)
+                          + np.asarray(e_norm[b], dtype=np.float32))
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Make the service modules (recipe_rag, ocr, ...) importable, like the CLI
+# scripts do for a direct run.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
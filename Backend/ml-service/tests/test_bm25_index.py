@@ -0,0 +1,30 @@
+import random
+
+import numpy as np
+import pytest
+
+from recipe_rag.bm25_index import InvertedBM25
+
+rank_bm25 = pytest.importorskip("rank_bm25")
+
+
+def tied_corpus(docs=300, seed=1):
+    # A tiny vocabulary gives many documents identical scores
+    rng = random.Random(seed)
+    vocab = ["milk", "bread", "egg", "oat", "rice"]
+    return [[rng.choice(vocab) for _ in range(rng.randint(1, 3))] for _ in range(docs)]
+
+
+@pytest.mark.parametrize("query", [["milk"], ["milk", "egg"], ["oat", "oat", "rice"]])
+def test_ranking_matches_bm25okapi_including_ties(query):
+    corpus = tied_corpus()
+    reference = rank_bm25.BM25Okapi(corpus).get_scores(query)
+    expected = [int(i) for i in np.argsort(reference, kind="stable")[::-1] if reference[i] > 0]
+
+    index = InvertedBM25(corpus)
+    doc_ids, scores = index.score_postings(query)
+    np.testing.assert_allclose(scores, reference[doc_ids])
+
+    assert [doc_id for doc_id, _ in index.top_k(query, len(expected))] == expected
+    assert [InvertedBM25.rank_of(doc_ids, scores, doc_id) for doc_id in expected] == \
+        list(range(1, len(expected) + 1))
@@ -0,0 +1,50 @@
+"""
+ONNX Runtime vs PyTorch parity for the embedding model.
+
+Skipped unless both backends are installed:
+
+    pip install "sentence-transformers[onnx]==5.2.2"
+
+The model is fetched from the Hugging Face hub on first use
+(PARITY_MODEL, default all-mpnet-base-v2).
+"""
+
+import os
+
+import pytest
+
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("onnxruntime")
+
+from recipe_rag.encoding import (
+    MIN_PARITY_COSINE,
+    PARITY_SENTENCES,
+    load_embedding_model,
+    loaded_backend,
+    parity_report,
+)
+
+PARITY_MODEL = os.getenv("PARITY_MODEL", "all-mpnet-base-v2")
+# Share of each sentence's top-3 neighbours (within the sample) that the
+# ONNX encoder must reproduce
+MIN_NEIGHBOUR_AGREEMENT = {
+    "onnx": 1.0,
+    "onnx-int8": 0.9,
+}
+
+
+@pytest.fixture(scope="module")
+def torch_model():
+    return load_embedding_model(PARITY_MODEL, "torch")
+
+
+@pytest.mark.parametrize("backend", ["onnx", "onnx-int8"])
+def test_onnx_embeddings_match_torch(torch_model, backend):
+    # strict: a silent PyTorch fallback would compare PyTorch with itself
+    onnx_model = load_embedding_model(PARITY_MODEL, backend, strict=True)
+    assert loaded_backend(onnx_model) == backend
+
+    report = parity_report(torch_model, onnx_model, PARITY_SENTENCES, top_k=3)
+
+    assert report["cosine_min"] >= MIN_PARITY_COSINE[backend]
+    assert report["top3_neighbour_agreement"] >= MIN_NEIGHBOUR_AGREEMENT[backend]
@@ -0,0 +1,115 @@
+import shutil
+
+import pytest
+
+from ocr.extractor import calculate_ocr_quality, ocr_text_from_data, preprocess_image
+from ocr.parser import build_receipt_data
+
+# block -> paragraph -> line -> words; every word gets RECEIPT_CONF
+RECEIPT = [
+    [
+        [["WOOLWORTHS"], ["Metro", "Sydney", "CBD"]],
+    ],
+    [
+        [["Full", "Cream", "Milk", "2L", "3.10"],
+         ["Wholemeal", "Bread", "700g", "4.50"]],
+        [["Free", "Range", "Eggs", "12pk", "6.90"]],
+    ],
+    [
+        [["SUBTOTAL", "14.50"], ["TOTAL", "14.50"], ["EFTPOS", "14.50"]],
+    ],
+]
+RECEIPT_CONF = 91
+
+# What image_to_string prints for the same --psm 6 pass: a blank line
+# between paragraphs, then the form feed that ends the page
+TWO_PASS_TEXT = """WOOLWORTHS
+Metro Sydney CBD
+
+Full Cream Milk 2L 3.10
+Wholemeal Bread 700g 4.50
+
+Free Range Eggs 12pk 6.90
+
+SUBTOTAL 14.50
+TOTAL 14.50
+EFTPOS 14.50
+\f"""
+
+
+def image_to_data_dict(blocks, conf):
+    """Output.DICT layout, including the empty structural rows (conf -1)."""
+    data = {key: [] for key in ("level", "block_num", "par_num", "line_num",
+                                "word_num", "text", "conf")}
+
+    def row(level, block, par, line, word, text, row_conf):
+        for key, value in zip(data, (level, block, par, line, word, text, row_conf)):
+            data[key].append(value)
+
+    row(1, 0, 0, 0, 0, "", -1)
+    for block_num, paragraphs in enumerate(blocks, 1):
+        row(2, block_num, 0, 0, 0, "", -1)
+        for par_num, lines in enumerate(paragraphs, 1):
+            row(3, block_num, par_num, 0, 0, "", "-1")
+            for line_num, words in enumerate(lines, 1):
+                row(4, block_num, par_num, line_num, 0, "", -1)
+                for word_num, word in enumerate(words, 1):
+                    row(5, block_num, par_num, line_num, word_num, word, conf)
+    return data
+
+
+def test_text_from_data_keeps_paragraph_breaks():
+    text = ocr_text_from_data(image_to_data_dict(RECEIPT, RECEIPT_CONF))
+    assert text == TWO_PASS_TEXT.rstrip("\n\f")
+
+
+def test_parse_and_quality_match_the_two_pass_result():
+    data = image_to_data_dict(RECEIPT, RECEIPT_CONF)
+    receipt = build_receipt_data(ocr_text_from_data(data))
+
+    assert receipt == build_receipt_data(TWO_PASS_TEXT)
+    assert [item["item"] for item in receipt["items"]] == \
+        ["Full Cream Milk", "Wholemeal Bread", "Free Range Eggs 12pk"]
+    assert receipt["total"] == 14.50
+
+    word_count = sum(len(words) for b in RECEIPT for p in b for words in p)
+    assert calculate_ocr_quality(data, receipt["items"]) == {
+        "avg_confidence": RECEIPT_CONF,
+        "word_count": word_count,
+        "parsed_item_count": 3,
+        "likely_item_count": 3,
+    }
+
+
+@pytest.mark.skipif(shutil.which("tesseract") is None, reason="tesseract binary not installed")
+def test_single_pass_matches_two_pass_on_rendered_receipt():
+    import cv2
+    import numpy as np
+    import pytesseract
+    from pytesseract import Output
+
+    from ocr.extractor import extract_ocr_data
+
+    lines = TWO_PASS_TEXT.rstrip("\n\f").split("\n")
+    img = np.full((60 + 50 * len(lines), 900, 3), 255, dtype=np.uint8)
+    for i, line in enumerate(lines):
+        cv2.putText(img, line, (30, 60 + 50 * i), cv2.FONT_HERSHEY_SIMPLEX, 1.1, (0, 0, 0), 2)
+    processed = preprocess_image(img)
+
+    # The old pipeline: image_to_string (--psm 6) for the text, and a
+    # separate default-psm image_to_data run for the quality score
+    old_text = pytesseract.image_to_string(processed, config=r"--oem 3 --psm 6")
+    old_receipt = build_receipt_data(old_text)
+    old_quality = calculate_ocr_quality(
+        pytesseract.image_to_data(processed, output_type=Output.DICT), old_receipt["items"])
+
+    data = extract_ocr_data(processed)
+    receipt = build_receipt_data(ocr_text_from_data(data))
+    quality = calculate_ocr_quality(data, receipt["items"])
+
+    assert receipt == old_receipt
+    assert quality["parsed_item_count"] == old_quality["parsed_item_count"]
+    assert quality["likely_item_count"] == old_quality["likely_item_count"]
+    # Confidences now come from the --psm 6 pass rather than psm 3
+    assert abs(quality["avg_confidence"] - old_quality["avg_confidence"]) <= 10
+    assert abs(quality["word_count"] - old_quality["word_count"]) <= max(2, old_quality["word_count"] // 10)
@@ -0,0 +1,51 @@
+import numpy as np
+
+from recipe_rag.vector_index import (
+    ExactIndex,
+    IVFIndex,
+    build_ivf,
+    normalize_rows,
+    recall_at_k,
+    sample_queries,
+)
+
+# build_recipe_index.py warns below this recall
+MIN_RECALL = 0.9
+
+
+def clustered_matrix(rows=4000, dim=64, clusters=40, seed=0):
+    # Sentence embeddings are clustered by topic; uniform noise would not
+    # be, and no IVF index reaches useful recall on it.
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim))
+    points = centers[rng.integers(0, clusters, rows)] + 0.35 * rng.standard_normal((rows, dim))
+    return normalize_rows(points.astype(np.float32))
+
+
+def ivf_index(e_norm, nprobe, **build_kwargs):
+    ivf = build_ivf(e_norm, seed=0, **build_kwargs)
+    return IVFIndex(e_norm, ivf["centroids"], ivf["list_offsets"], ivf["list_ids"],
+                    nprobe=nprobe)
+
+
+def test_ivf_recall_at_10_matches_exact_search():
+    e_norm = clustered_matrix()
+    index = ivf_index(e_norm, nprobe=8)
+
+    recall = recall_at_k(index, e_norm, sample_queries(e_norm, n=200, seed=1), k=10)
+
+    assert recall >= MIN_RECALL
+
+
+def test_ivf_falls_back_to_exact_when_probed_lists_are_short():
+    e_norm = clustered_matrix(rows=200)
+    # One row per cluster and a single probe: never enough candidates for top 10
+    index = ivf_index(e_norm, nprobe=1, nlist=200)
+    exact = ExactIndex(e_norm)
+
+    for q in sample_queries(e_norm, n=20, seed=2):
+        assert index._candidates(q, index.nprobe).shape[0] < 10
+        ids, scores = index.search(q, 10)
+        exact_ids, exact_scores = exact.search(q, 10)
+        np.testing.assert_array_equal(ids, exact_ids)
+        np.testing.assert_allclose(scores, exact_scores)